@@ -5,7 +5,7 @@ import traceback
 import torch 
 
 from whisperx.asr import load_model 
-from whisperx.audio import load_audio 
+from whisperx.audio import AudioCache, load_audio 
 from whisperx.utils import WriteVTT 
 
     
@@ -80,12 +80,8 @@ class HyperParameterTester:
         pass
     
     def __post_init__(self):
-        self.model = load_model(self.whisper_arch, self.device, self.compute_type, self.language, asr_options=self.asr_options, vad_options=self.vad_options)
+        self.model = load_model(self.whisper_arch, self.device, self.compute_type, self.language, asr_options=self.asr_options, vad_options=self.vad_options, use_registry=True)
 
-        
-    
-    def test_chunk_size(self, chunk_size):
-        
 
 
 def parse_options(options, default: NamedTuple=None):
@@ -120,8 +116,9 @@ def compare(args, chunk_size=30):
     device = "cuda" if torch.cuda.is_available() else "cpu"
     compute_type = "float16" if device == "cuda" else "int8"
     language = args.language 
-    model = load_model(whisper_arch, device=device, compute_type=compute_type, asr_options=asr_options, vad_options=vad_options)
+    model = load_model(whisper_arch, device=device, compute_type=compute_type, asr_options=asr_options, vad_options=vad_options, vad_cache_dir=args.vad_cache_dir, use_registry=True)
     
+    audio_cache = AudioCache(args.audio_cache_dir) if args.audio_cache_dir is not None else None
     # 3. loop through audio samples 
     write_options = {
         "max_line_width": 1000,
@@ -136,7 +133,7 @@ def compare(args, chunk_size=30):
                 if ext == ".wav":
                     try:
                         audio_path = os.path.join(prefix, file)
-                        audio = load_audio(audio_path)
+                        audio = audio_cache.load(audio_path) if audio_cache is not None else load_audio(audio_path)
                         result = model.transcribe(audio, language=language, chunk_size=chunk_size, print_progress=args.print_progress)
                         # make output dir based on the audio sample name and current hyperparameter and initiate the writer.
                         output_dir_name = "chunk_size" 
@@ -166,6 +163,8 @@ if __name__ == "__main__":
     
     ## vad options 
     parser.add_argument("--chunk_size", default=False, type=bool)
+    parser.add_argument("--vad_cache_dir", default=None, type=str, help="directory to cache raw VAD scores in, shared by all chunk sizes.")
+    parser.add_argument("--audio_cache_dir", default=None, type=str, help="directory to cache the decoded wav files in, shared by all chunk sizes.")
     
     ## vtt write options
     parser.add_argument("--output_dir", default="/home/ubuntu/", type=str)
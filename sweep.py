@@ -5,8 +5,9 @@ import pprint
 
 import numpy as np 
 
-import librosa 
 from whisperx import load_model
+from whisperx.audio import AudioCache, load_audio
+from whisperx.decode_sweep import DecodeSweep
 from whisperx.utils import WriteVTT 
 import gc 
 
@@ -41,6 +42,8 @@ def sweep(args):
     vad_offset = args.pop("vad_offset")
     length_penalty = args.pop("length_penalty")
     repetition_penalty = args.pop("repetition_penalty")
+    vad_cache_dir = args.pop("vad_cache_dir")
+    audio_cache_dir = args.pop("audio_cache_dir")
     
     # args for 
     is_with_default = args.pop("is_with_default", True)
@@ -60,44 +63,44 @@ def sweep(args):
     if do_beam_size:
         beam_sizes = np.arange(5, 25, 5)
         patiences = np.arange(1, 3, 0.5)
-        param_combinations = list(product(beam_sizes, patiences))
-        y, sr = librosa.load(audio, sr=16000)
-        for beam_size, patience in param_combinations:
-            asr_options = DEFAULT_ASR_OPTIONS
-            asr_options["beam_size"] = beam_size 
-            asr_options["patience"] = patience 
-            model = load_model("large-v3", device="cuda", compute_type="float16", asr_options=asr_options, vad_options=vad_options)
-            result = model.transcribe(y, language="ko", chunk_size=30, print_progress=print_progress)
-            printer.pprint(asr_options)
-            printer.pprint(vad_options)
-            name = f"_{beam_size}_{patience}"
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir, exist_ok=True)
-            WriteVTT(output_dir=output_dir)(result=result, audio_path=audio, options=VTT_OPTIONS, name=name)
-            del model 
-            
+        option_sets = {
+            f"_{beam_size}_{patience}": {"beam_size": int(beam_size), "patience": float(patience)}
+            for beam_size, patience in product(beam_sizes, patiences)
+        }
 
     if do_temperature:
-        temperatures = np.arange(0, 1, 0.2)
-        best_ofs = [1, 3, 5, 10]
-        param_combinations = list(product(temperatures, best_ofs))
-        y, sr = librosa.load(audio, sr=16000)
-        for temperature, best_of in param_combinations:
-            asr_options = DEFAULT_ASR_OPTIONS
-            asr_options["temperatures"] = temperature 
-            asr_options["best_of"] = best_of 
-
-            printer.pprint(asr_options)
-            printer.pprint(vad_options)
-            
-            model = load_model("large-v3", device="cuda", compute_type="float16", asr_options=asr_options, vad_options=vad_options)
-            result = model.transcribe(y, language="ko", chunk_size=30, print_progress=print_progress)
-            name = f"_{temperature}_{best_of}"
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir, exist_ok=True)
-            WriteVTT(output_dir=output_dir)(result=result, audio_path=audio, options=VTT_OPTIONS, name=name)
-            del model 
-    
+        # generate_segment_batched always decodes with beam search and never samples, so `temperatures` and
+        # `best_of` would not change the transcript of any combination
+        print("Warning: the batched decoder ignores temperatures and best_of, skipping the temperature sweep.")
+        return
+
+    if not (do_beam_size or do_temperature):
+        return
+
+    asr_options = dict(DEFAULT_ASR_OPTIONS, length_penalty=length_penalty, repetition_penalty=repetition_penalty)
+    printer.pprint(asr_options)
+    printer.pprint(vad_options)
+    # the model, VAD, log-Mel features and encoder outputs are computed once, every combination only re-runs the decoder
+    model = load_model("large-v3", device="cuda", compute_type="float16", asr_options=asr_options, vad_options=vad_options, vad_cache_dir=vad_cache_dir, use_registry=True)
+    y = AudioCache(audio_cache_dir).load(audio) if audio_cache_dir is not None else load_audio(audio)
+    decode_sweep = DecodeSweep(model, y, language="ko", outer_chunk_size=30)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+    timings = []
+    for name, result, seconds in decode_sweep.run(option_sets):
+        if print_progress:
+            printer.pprint(option_sets[name])
+        WriteVTT(output_dir=output_dir)(result=result, audio_path=audio, options=VTT_OPTIONS, name=name)
+        timings.append((name, seconds))
+
+    print(f"{'setting':<16}{'decode (s)':>12}")
+    print(f"{'encode':<16}{decode_sweep.encode_time:>12.2f}")
+    for name, seconds in timings:
+        print(f"{name:<16}{seconds:>12.2f}")
+    del decode_sweep, model
+    gc.collect()
+
 
 if __name__ == "__main__":
     import argparse 
@@ -111,10 +114,12 @@ if __name__ == "__main__":
     parser.add_argument("--vad_offset", type=float, default=0.363)
     parser.add_argument("--length_penalty", type=float, default=1)
     parser.add_argument("--repetition_penalty", type=float, default=1)
+    parser.add_argument("--vad_cache_dir", type=str, default=None, help="directory to cache raw VAD scores in, shared by all sweeped combinations.")
+    parser.add_argument("--audio_cache_dir", type=str, default=None, help="directory to cache the decoded wav files in, reused by reruns of the sweep.")
 
     # choose which one to sweep. the range is fixed based on the selected option
     parser.add_argument("--beam_size", action='store_true')
-    parser.add_argument("--temperature", action='store_true')
+    parser.add_argument("--temperature", action='store_true', help="not supported by the batched decoder, which ignores the temperatures and best_of, only warns.")
     args = parser.parse_args()
     args = args.__dict__
     
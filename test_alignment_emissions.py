@@ -0,0 +1,155 @@
+import logging
+
+import pytest
+import torch
+import numpy as np
+import torchaudio
+from transformers import Wav2Vec2Config, Wav2Vec2ForCTC
+
+from whisperx.alignment import (
+    EMISSION_FRAME_STRIDE,
+    EMISSION_RECEPTIVE_FIELD,
+    compute_file_emissions,
+    get_emissions,
+    load_file_emissions,
+    slice_emissions,
+    uses_group_norm,
+)
+from whisperx.audio import SAMPLE_RATE
+
+
+logger = logging.getLogger(__name__)
+
+# a tiny wav2vec2 with the strides and kernels of the real ones (20ms frames, 400 samples receptive field)
+CONV_LAYERS = [(8, 10, 5)] + [(8, 3, 2)] * 4 + [(8, 2, 2)] * 2
+
+
+def tiny_wav2vec2(model_type: str, norm: str) -> torch.nn.Module:
+    torch.manual_seed(0)
+    if model_type == "torchaudio":
+        model = torchaudio.models.wav2vec2_model(
+            extractor_mode=f"{norm}_norm",
+            extractor_conv_layer_config=CONV_LAYERS,
+            extractor_conv_bias=False,
+            encoder_embed_dim=16,
+            encoder_projection_dropout=0.0,
+            encoder_pos_conv_kernel=16,
+            encoder_pos_conv_groups=2,
+            encoder_num_layers=2,
+            encoder_num_heads=2,
+            encoder_attention_dropout=0.0,
+            encoder_ff_interm_features=32,
+            encoder_ff_interm_dropout=0.0,
+            encoder_dropout=0.0,
+            encoder_layer_norm_first=norm == "layer",
+            encoder_layer_drop=0.0,
+            aux_num_out=10,
+        )
+    else:
+        config = Wav2Vec2Config(
+            vocab_size=10,
+            hidden_size=16,
+            num_hidden_layers=2,
+            num_attention_heads=2,
+            intermediate_size=32,
+            conv_dim=[dim for dim, _, _ in CONV_LAYERS],
+            conv_kernel=[kernel for _, kernel, _ in CONV_LAYERS],
+            conv_stride=[stride for _, _, stride in CONV_LAYERS],
+            num_conv_pos_embeddings=16,
+            num_conv_pos_embedding_groups=2,
+            feat_extract_norm=norm,
+            do_stable_layer_norm=norm == "layer",
+        )
+        model = Wav2Vec2ForCTC(config)
+    return model.eval()
+
+
+def synthetic_waveforms(lengths, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return [torch.from_numpy(rng.standard_normal(length).astype(np.float32)) for length in lengths]
+
+
+class ForwardCounter:
+    def __init__(self, model):
+        self.batch_sizes = []
+        model.register_forward_hook(lambda module, inputs, output: self.batch_sizes.append(inputs[0].shape[0]))
+
+
+@pytest.mark.parametrize("model_type", ["torchaudio", "huggingface"])
+@pytest.mark.parametrize("norm", ["layer", "group"])
+def test_uses_group_norm(model_type, norm):
+    assert uses_group_norm(tiny_wav2vec2(model_type, norm)) == (norm == "group")
+
+
+@pytest.mark.parametrize("model_type", ["torchaudio", "huggingface"])
+@pytest.mark.parametrize("norm", ["layer", "group"])
+@pytest.mark.parametrize("lengths", [[16000, 8000, 12345, 400], [3000, 401], [5000, 5000]])
+def test_batched_emissions_match_unbatched(model_type, norm, lengths):
+    model = tiny_wav2vec2(model_type, norm)
+    waveforms = synthetic_waveforms(lengths)
+    counter = ForwardCounter(model)
+    batched = get_emissions(model, model_type, waveforms, "cpu")
+    if norm == "layer" or len(set(lengths)) == 1:
+        assert counter.batch_sizes == [len(waveforms)]
+    else:
+        # group norm would normalize over the padding
+        assert counter.batch_sizes == [1] * len(waveforms)
+    for waveform, emission in zip(waveforms, batched):
+        expected, = get_emissions(model, model_type, [waveform], "cpu")
+        assert emission.shape == expected.shape
+        torch.testing.assert_close(emission, expected, atol=1e-4, rtol=1e-4)
+
+
+class LocalEmissionModel(torch.nn.Module):
+    # every frame only sees the samples of its receptive field, so emissions of a window do not depend on its context
+    def __init__(self, vocab_size: int = 10):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv1d(1, 16, EMISSION_RECEPTIVE_FIELD, stride=EMISSION_FRAME_STRIDE)
+        self.proj = torch.nn.Linear(16, vocab_size)
+
+    def forward(self, waveforms, lengths=None):
+        emissions = self.proj(torch.tanh(self.conv(waveforms[:, None]).transpose(1, 2)))
+        num_frames = None if lengths is None else (lengths - EMISSION_RECEPTIVE_FIELD) // EMISSION_FRAME_STRIDE + 1
+        return emissions, num_frames
+
+
+def synthetic_segments(num_samples: int, num_segments: int, seed: int = 0, frame_aligned: bool = True):
+    rng = np.random.default_rng(seed)
+    segments = []
+    for _ in range(num_segments):
+        f1 = int(rng.integers(0, num_samples - SAMPLE_RATE))
+        if frame_aligned:
+            f1 -= f1 % EMISSION_FRAME_STRIDE
+        f2 = min(f1 + int(rng.integers(EMISSION_RECEPTIVE_FIELD, 5 * SAMPLE_RATE)), num_samples)
+        segments.append({"start": f1 / SAMPLE_RATE, "end": f2 / SAMPLE_RATE})
+    return segments
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("frame_aligned", [True, False])
+@pytest.mark.parametrize("partial", [False, True])
+def test_sliced_file_emissions_match_segment_emissions(tmp_path, seed, frame_aligned, partial):
+    model = LocalEmissionModel()
+    metadata = {"type": "torchaudio"}
+    audio = np.random.default_rng(seed).standard_normal(20 * SAMPLE_RATE).astype(np.float32)
+    segments = synthetic_segments(len(audio), 10, seed=seed, frame_aligned=frame_aligned)
+    path = str(tmp_path / "emissions.npy")
+    # small windows, so that segments span window boundaries
+    emissions = compute_file_emissions(
+        model, metadata, audio, "cpu", path=path, segments=segments if partial else None, window_seconds=2.0, context_seconds=0.5, batch_size=3
+    )
+    for file_emissions in [emissions, load_file_emissions(path)]:
+        for segment in segments:
+            f1, f2 = int(segment["start"] * SAMPLE_RATE), int(segment["end"] * SAMPLE_RATE)
+            sliced = slice_emissions(file_emissions, f1, f2)
+            expected, = get_emissions(model, "torchaudio", [torch.from_numpy(audio[f1:f2])], "cpu")
+            # slicing starts at the next frame boundary, at most one frame after the segment
+            boundary = -(-f1 // EMISSION_FRAME_STRIDE) * EMISSION_FRAME_STRIDE
+            assert boundary - f1 < EMISSION_FRAME_STRIDE
+            assert len(expected) - 1 <= len(sliced) <= len(expected)
+            if boundary == f1:
+                torch.testing.assert_close(sliced, expected, atol=1e-5, rtol=1e-5)
+            else:
+                shifted, = get_emissions(model, "torchaudio", [torch.from_numpy(audio[boundary:f2])], "cpu")
+                torch.testing.assert_close(sliced, shifted, atol=1e-5, rtol=1e-5)
@@ -0,0 +1,97 @@
+import time
+import logging
+
+import pytest
+import torch
+
+from whisperx.alignment import get_char_segments
+
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_emission(num_frames: int, num_tokens: int, vocab_size: int = 32, seed: int = 0):
+    # peaky CTC-like emissions: mostly blank, with the transcript tokens spread over the frames
+    generator = torch.Generator().manual_seed(seed)
+    tokens = torch.randint(1, vocab_size, (num_tokens,), generator=generator).tolist()
+    logits = torch.randn(num_frames, vocab_size, generator=generator)
+    logits[:, 0] += 4
+    positions = torch.linspace(0, num_frames - 1, num_tokens).long()
+    logits[positions, tokens] += 8
+    emission = torch.log_softmax(logits, dim=-1)
+    transcript = "".join(chr(ord("a") + token % 26) for token in tokens)
+    return emission, tokens, transcript
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("num_frames,num_tokens", [(1, 1), (5, 8), (50, 10), (500, 120), (1500, 400), (1500, 1499)])
+def test_numpy_kernel_matches_python(seed, num_frames, num_tokens):
+    emission, tokens, transcript = synthetic_emission(num_frames, num_tokens, seed=seed)
+    expected = get_char_segments(emission, tokens, transcript, kernel="python")
+    assert get_char_segments(emission, tokens, transcript, kernel="numpy") == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_numpy_kernel_matches_python_flat_emissions(seed):
+    # uniform emissions make the stay/change scores tie
+    emission = torch.log_softmax(torch.zeros(200, 32), dim=-1)
+    tokens = torch.randint(1, 32, (50,), generator=torch.Generator().manual_seed(seed)).tolist()
+    transcript = "x" * len(tokens)
+    expected = get_char_segments(emission, tokens, transcript, kernel="python")
+    assert get_char_segments(emission, tokens, transcript, kernel="numpy") == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_torchaudio_kernel(seed):
+    emission, tokens, transcript = synthetic_emission(1500, 300, seed=seed)
+    segments = get_char_segments(emission, tokens, transcript, kernel="torchaudio")
+    assert [segment.label for segment in segments] == list(transcript)
+    assert all(a.end <= b.start for a, b in zip(segments, segments[1:]))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("num_frames,num_tokens", [(1, 1), (5, 8), (50, 10), (500, 120), (1500, 1499)])
+def test_banded_kernel_full_band_matches_numpy(seed, num_frames, num_tokens):
+    emission, tokens, transcript = synthetic_emission(num_frames, num_tokens, seed=seed)
+    expected = get_char_segments(emission, tokens, transcript, kernel="numpy")
+    assert get_char_segments(emission, tokens, transcript, kernel="banded", band_width=num_frames) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_banded_kernel_widens_band(seed):
+    # 100 frames per token, bands narrower than 50 frames leave rows without any token and the backtrack fails
+    emission, tokens, transcript = synthetic_emission(1000, 10, seed=seed)
+    segments = get_char_segments(emission, tokens, transcript, kernel="banded", band_width=1)
+    assert [segment.label for segment in segments] == list(transcript)
+    assert segments == get_char_segments(emission, tokens, transcript, kernel="banded", band_width=64)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("num_frames,num_tokens", [(500, 100), (1500, 400)])
+def test_align_kernel_benchmark(num_frames, num_tokens):
+    # 10 s and 30 s segments at 50 fps
+    emission, tokens, transcript = synthetic_emission(num_frames, num_tokens)
+    timings = {}
+    for kernel in ["python", "numpy", "torchaudio", "banded"]:
+        start = time.time()
+        for _ in range(3):
+            get_char_segments(emission, tokens, transcript, kernel=kernel)
+        timings[kernel] = (time.time() - start) / 3
+    logger.info(
+        f"align kernel {num_frames} frames {num_tokens} tokens | python: {timings['python']:.3f}s"
+        f" | numpy: {timings['numpy']:.3f}s ({timings['python'] / timings['numpy']:.1f}x)"
+        f" | torchaudio: {timings['torchaudio']:.3f}s ({timings['python'] / timings['torchaudio']:.1f}x)"
+        f" | banded: {timings['banded']:.3f}s ({timings['python'] / timings['banded']:.1f}x)"
+    )
+
+
+@pytest.mark.benchmark
+def test_banded_kernel_long_segment_benchmark():
+    # a 5 min segment, the full trellis alone is 240MB
+    emission, tokens, transcript = synthetic_emission(15000, 4000)
+    timings = {}
+    for kernel in ["numpy", "banded"]:
+        start = time.time()
+        get_char_segments(emission, tokens, transcript, kernel=kernel)
+        timings[kernel] = time.time() - start
+    logger.info(f"align kernel 15000 frames 4000 tokens | numpy: {timings['numpy']:.3f}s | banded: {timings['banded']:.3f}s")
@@ -0,0 +1,144 @@
+import time
+import logging
+
+import pytest
+import numpy as np
+import pandas as pd
+from nltk.tokenize.punkt import PunktSentenceTokenizer, PunktParameters
+
+from whisperx.alignment import LANGUAGES_WITHOUT_SPACES, PUNKT_ABBREVIATIONS, get_aligned_subsegments
+from whisperx.utils import interpolate_nans, interpolate_nans_array
+
+
+logger = logging.getLogger(__name__)
+
+
+def pandas_aligned_subsegments(text, char_starts, char_ends, char_scores, sentence_spans, model_lang, interpolate_method, return_char_alignments):
+    # the DataFrame based post-processing `get_aligned_subsegments` replaced, kept as reference
+    char_segments_arr = []
+    word_idx = 0
+    for cdx, char in enumerate(text):
+        start, end, score = char_starts[cdx], char_ends[cdx], char_scores[cdx]
+        char_segments_arr.append({
+            "char": char,
+            "start": None if np.isnan(start) else start,
+            "end": None if np.isnan(end) else end,
+            "score": None if np.isnan(score) else score,
+            "word-idx": word_idx,
+        })
+        if model_lang in LANGUAGES_WITHOUT_SPACES:
+            word_idx += 1
+        elif cdx == len(text) - 1 or text[cdx+1] == " ":
+            word_idx += 1
+    char_segments_arr = pd.DataFrame(char_segments_arr)
+
+    aligned_subsegments = []
+    for sstart, send in sentence_spans:
+        curr_chars = char_segments_arr.loc[(char_segments_arr.index >= sstart) & (char_segments_arr.index <= send)]
+        sentence_start = curr_chars["start"].min()
+        end_chars = curr_chars[curr_chars["char"] != ' ']
+        sentence_end = end_chars["end"].max()
+        sentence_words = []
+        for word_idx in curr_chars["word-idx"].unique():
+            word_chars = curr_chars.loc[curr_chars["word-idx"] == word_idx]
+            word_text = "".join(word_chars["char"].tolist()).strip()
+            if len(word_text) == 0:
+                continue
+            word_chars = word_chars[word_chars["char"] != " "]
+            word_start = word_chars["start"].min()
+            word_end = word_chars["end"].max()
+            word_score = round(word_chars["score"].mean(), 3)
+            word_segment = {"word": word_text}
+            if not np.isnan(word_start):
+                word_segment["start"] = word_start
+            if not np.isnan(word_end):
+                word_segment["end"] = word_end
+            if not np.isnan(word_score):
+                word_segment["score"] = word_score
+            sentence_words.append(word_segment)
+        aligned_subsegments.append({"text": text[sstart:send], "start": sentence_start, "end": sentence_end, "words": sentence_words})
+        if return_char_alignments:
+            curr_chars = curr_chars[["char", "start", "end", "score"]].fillna(-1).to_dict("records")
+            aligned_subsegments[-1]["chars"] = [{key: val for key, val in char.items() if val != -1} for char in curr_chars]
+
+    aligned_subsegments = pd.DataFrame(aligned_subsegments)
+    aligned_subsegments["start"] = interpolate_nans(aligned_subsegments["start"].astype(float), method=interpolate_method)
+    aligned_subsegments["end"] = interpolate_nans(aligned_subsegments["end"].astype(float), method=interpolate_method)
+    agg_dict = {"text": " ".join, "words": "sum"}
+    if model_lang in LANGUAGES_WITHOUT_SPACES:
+        agg_dict["text"] = "".join
+    if return_char_alignments:
+        agg_dict["chars"] = "sum"
+    return aligned_subsegments.groupby(["start", "end"], as_index=False).agg(agg_dict).to_dict("records")
+
+
+def synthetic_segment(num_words: int, seed: int = 0, nan_rate: float = 0.1):
+    rng = np.random.default_rng(seed)
+    vocab = ["hello", "world", "this", "is", "a", "test.", "Dr.", "smith", "went", "home!", "42", "okay?", "x", "yes."]
+    text = " ".join(rng.choice(vocab, num_words))
+    char_starts = np.round(np.sort(rng.uniform(0, num_words * 0.4, len(text))), 3)
+    char_ends = np.round(char_starts + rng.uniform(0, 0.1, len(text)), 3)
+    char_scores = np.round(rng.uniform(0, 1, len(text)), 3)
+    # unaligned characters, and whole unaligned sentences in a row
+    unaligned = rng.random(len(text)) < nan_rate
+    if num_words > 20:
+        unaligned[len(text) // 3:len(text) // 2] = True
+    for values in [char_starts, char_ends, char_scores]:
+        values[unaligned] = np.nan
+    punkt_param = PunktParameters()
+    punkt_param.abbrev_types = set(PUNKT_ABBREVIATIONS)
+    sentence_spans = list(PunktSentenceTokenizer(punkt_param).span_tokenize(text))
+    return text, char_starts, char_ends, char_scores, sentence_spans
+
+
+def test_aligned_subsegments_golden():
+    text = "Hi there. Dr. X?"
+    char_starts = np.array([0.0, 0.1, np.nan, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, np.nan, 1.0, 1.1, 1.2, np.nan, np.nan, 1.5])
+    char_ends = np.round(char_starts + 0.05, 3)
+    char_scores = np.array([0.9, 0.8, np.nan, 0.7, 0.6, 0.5, 0.4, 0.3, 0.2, np.nan, 0.1, 0.2, 0.3, np.nan, np.nan, 0.4])
+    sentence_spans = [(0, 9), (10, 16)]
+    expected = [
+        {"start": 0.0, "end": 0.85, "text": "Hi there.", "words": [
+            {"word": "Hi", "start": 0.0, "end": 0.15, "score": 0.85},
+            {"word": "there.", "start": 0.3, "end": 0.85, "score": 0.45},
+        ]},
+        {"start": 1.0, "end": 1.55, "text": "Dr. X?", "words": [
+            {"word": "Dr.", "start": 1.0, "end": 1.25, "score": 0.2},
+            {"word": "X?", "start": 1.5, "end": 1.55, "score": 0.4},
+        ]},
+    ]
+    result = get_aligned_subsegments(text, char_starts, char_ends, char_scores, sentence_spans, "en")
+    assert result == expected
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("model_lang", ["en", "ja"])
+@pytest.mark.parametrize("interpolate_method", ["nearest", "linear"])
+@pytest.mark.parametrize("return_char_alignments", [False, True])
+def test_aligned_subsegments_match_pandas(seed, model_lang, interpolate_method, return_char_alignments):
+    segment = synthetic_segment(60, seed=seed, nan_rate=[0.0, 0.1, 0.5, 0.9, 1.0][seed % 5])
+    expected = pandas_aligned_subsegments(*segment, model_lang, interpolate_method, return_char_alignments)
+    result = get_aligned_subsegments(*segment, model_lang, interpolate_method=interpolate_method, return_char_alignments=return_char_alignments)
+    assert result == expected
+    assert [list(subsegment) for subsegment in result] == [list(subsegment) for subsegment in expected]
+
+
+@pytest.mark.parametrize("values", [
+    [np.nan], [1.0], [np.nan, 2.0, np.nan], [np.nan, 1.0, np.nan, 3.0, np.nan, np.nan, 6.0, np.nan],
+    [1.0, np.nan, np.nan, np.nan, 2.0], [np.nan, np.nan], [0.5, 0.7, 0.9],
+])
+@pytest.mark.parametrize("method", ["nearest", "linear"])
+def test_interpolate_nans_array(values, method):
+    expected = interpolate_nans(pd.Series(values, dtype=float), method=method).to_numpy()
+    np.testing.assert_array_equal(interpolate_nans_array(np.array(values), method=method), expected)
+
+
+@pytest.mark.benchmark
+def test_aligned_subsegments_benchmark():
+    segment = synthetic_segment(10000)
+    timings = {}
+    for name, fn in [("pandas", pandas_aligned_subsegments), ("numpy", get_aligned_subsegments)]:
+        start = time.time()
+        fn(*segment, "en", "nearest", True)
+        timings[name] = time.time() - start
+    logger.info(f"aligned subsegments 10k words | pandas: {timings['pandas']:.3f}s | numpy: {timings['numpy']:.3f}s | speedup: {timings['pandas'] / timings['numpy']:.1f}x")
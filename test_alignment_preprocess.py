@@ -0,0 +1,125 @@
+import time
+import logging
+
+import pytest
+import numpy as np
+from nltk.tokenize.punkt import PunktSentenceTokenizer, PunktParameters
+
+from concurrent.futures import ProcessPoolExecutor
+
+import whisperx.alignment
+from whisperx.alignment import LANGUAGES_WITHOUT_SPACES, PUNKT_ABBREVIATIONS, TextPreprocessor, align, get_preprocess_pool
+
+
+logger = logging.getLogger(__name__)
+
+MODEL_DICTIONARY = {char: idx for idx, char in enumerate("-|etaonihsrdlumwcfgypbvk'xjqz")}
+
+
+def reference_preprocess(text, model_dictionary, model_lang):
+    # the per-segment preprocessing `TextPreprocessor` replaced, kept as reference
+    num_leading = len(text) - len(text.lstrip())
+    num_trailing = len(text) - len(text.rstrip())
+    if model_lang not in LANGUAGES_WITHOUT_SPACES:
+        per_word = text.split(" ")
+    else:
+        per_word = text
+    clean_char, clean_cdx = [], []
+    for cdx, char in enumerate(text):
+        char_ = char.lower()
+        if model_lang not in LANGUAGES_WITHOUT_SPACES:
+            char_ = char_.replace(" ", "|")
+        if cdx < num_leading:
+            pass
+        elif cdx > len(text) - num_trailing - 1:
+            pass
+        elif char_ in model_dictionary.keys():
+            clean_char.append(char_)
+            clean_cdx.append(cdx)
+    clean_wdx = []
+    for wdx, wrd in enumerate(per_word):
+        if any([c in model_dictionary.keys() for c in wrd]):
+            clean_wdx.append(wdx)
+    punkt_param = PunktParameters()
+    punkt_param.abbrev_types = set(PUNKT_ABBREVIATIONS)
+    sentence_splitter = PunktSentenceTokenizer(punkt_param)
+    sentence_spans = list(sentence_splitter.span_tokenize(text))
+    return {"clean_char": clean_char, "clean_cdx": clean_cdx, "clean_wdx": clean_wdx, "sentence_spans": sentence_spans}
+
+
+def synthetic_texts(num_segments: int, seed: int = 0, punctuation: bool = True):
+    rng = np.random.default_rng(seed)
+    vocab = ["Hello", "world", "THIS", "is", "a", "Smith", "went", "42", "İstanbul", "안녕", "it's", "x"]
+    if punctuation:
+        vocab += ["test.", "Dr.", "home!", "okay?"]
+    spaces = ["", " ", "  "]
+    return [
+        rng.choice(spaces) + " ".join(rng.choice(vocab, rng.integers(1, 30))) + rng.choice(spaces)
+        for _ in range(num_segments)
+    ]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("model_lang", ["en", "ja"])
+def test_text_preprocessor_matches_reference(seed, model_lang):
+    preprocessor = TextPreprocessor(MODEL_DICTIONARY, model_lang)
+    for text in synthetic_texts(50, seed=seed) + synthetic_texts(10, seed=seed, punctuation=False) + ["", "   ", " a ", "hello  world ", "hi\nthere ", "Dr. X went home. He slept."]:
+        assert preprocessor(text) == reference_preprocess(text, MODEL_DICTIONARY, model_lang)
+
+
+def test_text_preprocessor_process_pool():
+    texts = synthetic_texts(100)
+    preprocessor = TextPreprocessor(MODEL_DICTIONARY, "en")
+    with ProcessPoolExecutor(2) as executor:
+        assert list(executor.map(preprocessor, texts)) == [preprocessor(text) for text in texts]
+
+
+def test_align_preprocess_workers_spawn_one_pool(monkeypatch):
+    start_methods = []
+
+    class SpyProcessPoolExecutor(ProcessPoolExecutor):
+        def __init__(self, max_workers=None, mp_context=None, **kwargs):
+            start_methods.append(mp_context.get_start_method() if mp_context is not None else None)
+            super().__init__(max_workers, mp_context=mp_context, **kwargs)
+
+    monkeypatch.setattr(whisperx.alignment, "ProcessPoolExecutor", SpyProcessPoolExecutor)
+    get_preprocess_pool.cache_clear()
+    texts = synthetic_texts(20)
+    transcript = [{"start": float(i), "end": i + 1.0, "text": text} for i, text in enumerate(texts)]
+    emissions = np.full((50 * len(texts), len(MODEL_DICTIONARY)), -np.log(len(MODEL_DICTIONARY)), dtype=np.float32)
+    metadata = {"language": "en", "dictionary": MODEL_DICTIONARY, "type": "torchaudio"}
+    expected = align([dict(segment) for segment in transcript], None, metadata, None, "cpu", emissions=emissions)
+    try:
+        # e.g. one call per file of a run
+        for _ in range(3):
+            result = align([dict(segment) for segment in transcript], None, metadata, None, "cpu", emissions=emissions, preprocess_workers=2)
+            assert result == expected
+        # workers do not fork the process, which may have initialized CUDA, and are started once
+        assert start_methods == ["spawn"]
+    finally:
+        get_preprocess_pool(2).shutdown()
+        get_preprocess_pool.cache_clear()
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("punctuation", [True, False])
+def test_text_preprocessor_benchmark(punctuation):
+    texts = synthetic_texts(5000, punctuation=punctuation)
+    timings = {}
+    start = time.time()
+    expected = [reference_preprocess(text, MODEL_DICTIONARY, "en") for text in texts]
+    timings["reference"] = time.time() - start
+    start = time.time()
+    preprocessor = TextPreprocessor(MODEL_DICTIONARY, "en")
+    result = [preprocessor(text) for text in texts]
+    timings["preprocessor"] = time.time() - start
+    start = time.time()
+    with ProcessPoolExecutor(4) as executor:
+        pooled = list(executor.map(TextPreprocessor(MODEL_DICTIONARY, "en"), texts, chunksize=250))
+    timings["pool"] = time.time() - start
+    assert result == expected and pooled == expected
+    logger.info(
+        f"text preprocessing 5000 segments punctuation={punctuation} | reference: {timings['reference']:.3f}s"
+        f" | preprocessor: {timings['preprocessor']:.3f}s ({timings['reference'] / timings['preprocessor']:.1f}x)"
+        f" | 4 processes: {timings['pool']:.3f}s ({timings['reference'] / timings['pool']:.1f}x)"
+    )
@@ -0,0 +1,78 @@
+import copy
+import time
+import logging
+
+import pytest
+import numpy as np
+
+from whisperx.alignment import align, align_stream
+from whisperx.executor import prefetch
+
+
+logger = logging.getLogger(__name__)
+
+LETTERS = "|etaoinshrdlcumwfgypbvkjxqz'"
+ALIGN_MODEL_METADATA = {"language": "en", "dictionary": {"<pad>": 0} | {c: i + 1 for i, c in enumerate(LETTERS)}, "type": "torchaudio"}
+
+
+def synthetic_transcript(num_segments: int, seed: int = 0):
+    # segments and whole-file emissions (50 frames per second) that are peaky on their characters
+    rng = np.random.default_rng(seed)
+    words = ["hello", "world", "this", "is", "a", "test.", "Dr. smith", "went", "home!", "42", "okay"]
+    segments = []
+    t = 0.5
+    for _ in range(num_segments):
+        duration = rng.uniform(0.5, 5)
+        text = " " + " ".join(rng.choice(words, rng.integers(1, 10)))
+        segments.append({"start": round(t, 3), "end": round(t + duration, 3), "text": text})
+        t += duration + rng.uniform(0.1, 1)
+    logits = rng.standard_normal((int(t * 50) + 50, len(ALIGN_MODEL_METADATA["dictionary"]))).astype(np.float32)
+    logits[:, 0] += 4
+    for segment in segments:
+        tokens = [ALIGN_MODEL_METADATA["dictionary"][c] for c in segment["text"].strip().lower().replace(" ", "|") if c in ALIGN_MODEL_METADATA["dictionary"]]
+        frames = np.linspace(segment["start"] * 50, segment["end"] * 50 - 1, len(tokens)).astype(int)
+        logits[frames, tokens] += 8
+    emissions = logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
+    return segments, emissions
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("return_char_alignments", [False, True])
+def test_align_stream_matches_align(seed, return_char_alignments):
+    segments, emissions = synthetic_transcript(50, seed=seed)
+    expected = align(copy.deepcopy(segments), None, ALIGN_MODEL_METADATA, None, "cpu", emissions=emissions, return_char_alignments=return_char_alignments)
+    result = align_stream(prefetch(iter(copy.deepcopy(segments))), None, ALIGN_MODEL_METADATA, None, "cpu", emissions=emissions, return_char_alignments=return_char_alignments)
+    assert list(result) == expected["segments"]
+
+
+def test_prefetch_raises_worker_errors():
+    def items():
+        yield 1
+        raise ValueError("decoding failed")
+
+    stream = prefetch(items())
+    assert next(stream) == 1
+    with pytest.raises(ValueError, match="decoding failed"):
+        next(stream)
+
+
+@pytest.mark.benchmark
+def test_align_stream_first_segment_latency():
+    # segments produced one every 10ms, as if decoded batch by batch
+    segments, emissions = synthetic_transcript(200)
+
+    def produce():
+        for segment in copy.deepcopy(segments):
+            time.sleep(0.01)
+            yield segment
+
+    start = time.time()
+    align(list(produce()), None, ALIGN_MODEL_METADATA, None, "cpu", emissions=emissions)
+    two_phase = time.time() - start
+    start = time.time()
+    stream = align_stream(prefetch(produce()), None, ALIGN_MODEL_METADATA, None, "cpu", emissions=emissions)
+    next(stream)
+    first = time.time() - start
+    list(stream)
+    streamed = time.time() - start
+    logger.info(f"align 200 segments | two phases: {two_phase:.3f}s | streamed: {streamed:.3f}s, first segment after {first:.3f}s")
@@ -0,0 +1,108 @@
+import copy
+import time
+import logging
+
+import pytest
+import numpy as np
+import pandas as pd
+
+from whisperx.diarize import assign_word_speakers
+
+
+logger = logging.getLogger(__name__)
+
+
+def pandas_assign_word_speakers(diarize_df, transcript_result, fill_nearest=False):
+    # the per-segment/per-word DataFrame scan `assign_word_speakers` replaced, kept as reference
+    diarize_df = diarize_df.copy()
+    for seg in transcript_result["segments"]:
+        items = [seg] + [word for word in seg.get("words", []) if "start" in word]
+        for item in items:
+            diarize_df['intersection'] = np.minimum(diarize_df['end'], item['end']) - np.maximum(diarize_df['start'], item['start'])
+            diarize_df['union'] = np.maximum(diarize_df['end'], item['end']) - np.minimum(diarize_df['start'], item['start'])
+            if not fill_nearest:
+                dia_tmp = diarize_df[diarize_df['intersection'] > 0]
+            else:
+                dia_tmp = diarize_df
+            if len(dia_tmp) > 0:
+                item["speaker"] = dia_tmp.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
+    return transcript_result
+
+
+def synthetic_diarization(num_words: int, num_turns: int, num_speakers: int = 4, seed: int = 0, decimals=None):
+    rng = np.random.default_rng(seed)
+    duration = num_words * 0.36
+    turn_starts = np.sort(rng.uniform(0, duration, num_turns))
+    turn_ends = turn_starts + rng.exponential(duration / num_turns * 1.2, num_turns)
+    speakers = [f"SPEAKER_{i:02d}" for i in rng.integers(0, num_speakers, num_turns)]
+    word_starts = np.sort(rng.uniform(-5, duration + 5, num_words))
+    word_ends = word_starts + rng.uniform(0, 0.8, num_words)
+    if decimals is not None:
+        turn_starts, turn_ends = np.round(turn_starts, decimals), np.round(turn_ends, decimals)
+        word_starts, word_ends = np.round(word_starts, decimals), np.round(word_ends, decimals)
+    diarize_df = pd.DataFrame({"label": range(num_turns), "speaker": speakers, "start": turn_starts, "end": turn_ends})
+    segments = []
+    for wdx in range(0, num_words, 12):
+        words = [{"word": "x", "start": float(s), "end": float(e)} for s, e in zip(word_starts[wdx:wdx + 12], word_ends[wdx:wdx + 12])]
+        # unaligned words
+        words[len(words) // 2].pop("start")
+        segments.append({"start": words[0]["start"], "end": words[-1]["end"], "text": "x", "words": words})
+    return diarize_df, {"segments": segments}
+
+
+def speakers_of(result):
+    return [
+        [seg.get("speaker")] + [word.get("speaker") for word in seg["words"]]
+        for seg in result["segments"]
+    ]
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("fill_nearest", [False, True])
+@pytest.mark.parametrize("decimals", [None, 1, 3])
+def test_assign_word_speakers_matches_pandas(seed, fill_nearest, decimals):
+    diarize_df, transcript = synthetic_diarization(300, [5, 40, 200][seed % 3], seed=seed, decimals=decimals)
+    expected = pandas_assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest=fill_nearest)
+    original_df = diarize_df.copy()
+    result = assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest=fill_nearest)
+    assert speakers_of(result) == speakers_of(expected)
+    pd.testing.assert_frame_equal(diarize_df, original_df)
+
+
+@pytest.mark.parametrize("fill_nearest", [False, True])
+def test_assign_word_speakers_ties(fill_nearest):
+    diarize_df = pd.DataFrame({"speaker": ["B", "A", "C"], "start": [0.0, 1.0, 5.0], "end": [1.0, 2.0, 6.0]})
+    transcript = {"segments": [
+        {"start": 0.5, "end": 1.5, "words": [{"start": 0.5, "end": 1.5}, {"start": 1.0, "end": 1.0}, {"start": 3.0, "end": 4.0}]},
+        {"start": 7.0, "end": 8.0},
+    ]}
+    expected = pandas_assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest=fill_nearest)
+    assert assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest=fill_nearest) == expected
+
+
+def test_assign_word_speakers_empty_diarization():
+    diarize_df = pd.DataFrame({"speaker": [], "start": [], "end": []})
+    transcript = {"segments": [{"start": 0.5, "end": 1.5, "words": [{"start": 0.5, "end": 1.5}]}]}
+    assert assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest=True) == transcript
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("fill_nearest", [False, True])
+def test_assign_word_speakers_benchmark(fill_nearest):
+    # the pandas scan is timed on a tenth of the words and turns, it grows with both
+    diarize_df, transcript = synthetic_diarization(2000, 300)
+    start = time.time()
+    pandas_assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest=fill_nearest)
+    pandas_time = time.time() - start
+    start = time.time()
+    assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest=fill_nearest)
+    numpy_time = time.time() - start
+    # a 2 hour meeting
+    diarize_df, transcript = synthetic_diarization(20000, 3000)
+    start = time.time()
+    assign_word_speakers(diarize_df, transcript, fill_nearest=fill_nearest)
+    meeting_time = time.time() - start
+    logger.info(
+        f"assign word speakers fill_nearest={fill_nearest} | 2k words 300 turns pandas: {pandas_time:.3f}s"
+        f" | numpy: {numpy_time:.3f}s ({pandas_time / numpy_time:.0f}x) | 20k words 3k turns numpy: {meeting_time:.3f}s"
+    )
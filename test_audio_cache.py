@@ -0,0 +1,151 @@
+import os
+import time
+import wave
+import shutil
+import logging
+import threading
+
+import pytest
+import numpy as np
+
+import whisperx.audio
+from whisperx.audio import SAMPLE_RATE, AudioCache, load_audio
+
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    # counts the ffmpeg decodes, the waveform is derived from the file contents
+    calls = []
+
+    def fake_load_audio(file, sr=SAMPLE_RATE):
+        calls.append((file, sr))
+        with open(file, "rb") as f:
+            data = np.frombuffer(f.read(), np.uint8)
+        return np.repeat(data.astype(np.float32) / 255, sr // 1000)
+
+    monkeypatch.setattr(whisperx.audio, "load_audio", fake_load_audio)
+    return calls
+
+
+def write_file(path, size, seed=0):
+    with open(path, "wb") as f:
+        f.write(np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes())
+    return str(path)
+
+
+def test_audio_cache_hit(tmp_path, decodes):
+    path = write_file(tmp_path / "a.wav", 1000)
+    cache = AudioCache(str(tmp_path / "cache"))
+    first = cache.load(path)
+    second = AudioCache(str(tmp_path / "cache")).load(path)
+    assert len(decodes) == 1
+    assert isinstance(second, np.memmap) and second.dtype == np.float32
+    np.testing.assert_array_equal(first, second)
+    np.testing.assert_array_equal(second, whisperx.audio.load_audio(path))
+
+
+def test_audio_cache_invalidation(tmp_path, decodes):
+    path = write_file(tmp_path / "a.wav", 1000)
+    cache = AudioCache(str(tmp_path / "cache"))
+    cache.load(path)
+    cache.load(path, sr=8000)
+    assert len(decodes) == 2
+    # same size, later modification time
+    write_file(path, 1000, seed=1)
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+    np.testing.assert_array_equal(cache.load(path), whisperx.audio.load_audio(path))
+    assert len(decodes) == 4
+
+
+def test_audio_cache_copy_on_write(tmp_path, decodes):
+    path = write_file(tmp_path / "a.wav", 1000)
+    cache = AudioCache(str(tmp_path / "cache"))
+    audio = cache.load(path)
+    expected = np.array(audio)
+    audio[:] = 0
+    np.testing.assert_array_equal(cache.load(path), expected)
+    with pytest.raises(ValueError):
+        cache.load(path, mmap_mode="r")[0] = 0
+
+
+def test_audio_cache_concurrent_decodes(tmp_path, decodes, monkeypatch):
+    # decode threads of one process missing the same file at once each write their own temporary file
+    path = write_file(tmp_path / "a.wav", 1000)
+    cache = AudioCache(str(tmp_path / "cache"))
+    barrier = threading.Barrier(2)
+    replace = os.replace
+
+    def synchronized_replace(src, dst):
+        # both threads have written their temporary file before either moves it in place
+        barrier.wait(timeout=10)
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", synchronized_replace)
+    results = [None] * 2
+
+    def load(i):
+        results[i] = cache.load(path)
+
+    threads = [threading.Thread(target=load, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert len(decodes) == 2
+    expected = whisperx.audio.load_audio(path)
+    for result in results:
+        np.testing.assert_array_equal(result, expected)
+    assert os.listdir(tmp_path / "cache") == [cache.key(path) + ".npy"]
+
+
+def test_audio_cache_evicted_entry_is_decoded_again(tmp_path, decodes):
+    path = write_file(tmp_path / "a.wav", 1000)
+    cache = AudioCache(str(tmp_path / "cache"))
+    cache.load(path)
+    # e.g. by another process
+    os.remove(cache._path(cache.key(path)))
+    audio = cache.load(path)
+    assert len(decodes) == 2
+    np.testing.assert_array_equal(audio, whisperx.audio.load_audio(path))
+
+
+def test_audio_cache_eviction(tmp_path, decodes):
+    # every entry is 16 * 1000 float32 samples, about 64kB
+    cache = AudioCache(str(tmp_path / "cache"))
+    paths = [write_file(tmp_path / f"{i}.wav", 1000, seed=i) for i in range(4)]
+    for i, path in enumerate(paths):
+        cache.load(path)
+        # distinct modification times for the LRU order
+        os.utime(cache._path(cache.key(path)), (i, i))
+    cache.max_bytes = 150_000
+    cache.load(paths[0])
+    cache.load(write_file(tmp_path / "4.wav", 1000, seed=4))
+    cached = {name[:-len(".npy")] for name in os.listdir(cache.cache_dir)}
+    assert cached == {cache.key(paths[0]), cache.key(str(tmp_path / "4.wav"))}
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_audio_cache_benchmark(tmp_path):
+    path = str(tmp_path / "noise.wav")
+    samples = np.random.default_rng(0).integers(-32768, 32768, 600 * SAMPLE_RATE, dtype=np.int16)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+    cache = AudioCache(str(tmp_path / "cache"))
+    timings = {}
+    for name, fn in [("load_audio", load_audio), ("cold cache", cache.load), ("warm cache", cache.load)]:
+        start = time.time()
+        audio = fn(path)
+        float(audio.sum())
+        timings[name] = time.time() - start
+    np.testing.assert_array_equal(cache.load(path), load_audio(path))
+    logger.info(
+        f"audio cache 10min | load_audio: {timings['load_audio']:.3f}s | cold cache: {timings['cold cache']:.3f}s"
+        f" | warm cache: {timings['warm cache']:.3f}s ({timings['load_audio'] / timings['warm cache']:.1f}x)"
+    )
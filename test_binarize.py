@@ -0,0 +1,62 @@
+import time
+import logging
+
+import pytest
+import numpy as np
+from pyannote.core import SlidingWindow, SlidingWindowFeature
+
+from whisperx.vad import Binarize
+
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_scores(num_frames: int, seed: int = 0, smoothing: int = 50) -> SlidingWindowFeature:
+    # smoothed noise crosses the thresholds in runs, like real segmentation scores
+    rng = np.random.default_rng(seed)
+    noise = rng.random(num_frames)
+    data = np.convolve(noise, np.ones(smoothing) / smoothing, mode="same") * 1.6 - 0.3
+    data = np.clip(data, 0.0, 1.0).astype(np.float32)[:, None]
+    frames = SlidingWindow(start=0.0, duration=0.0619, step=0.016875)
+    return SlidingWindowFeature(data, frames)
+
+
+def regions(annotation):
+    return [(segment.start, segment.end, track, label) for segment, track, label in annotation.itertracks(yield_label=True)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_duration", [float("inf"), 30, 5, 1, 0.1])
+@pytest.mark.parametrize("onset_offset", [(0.5, 0.363), (0.1, 0.1), (0.7, 0.2)])
+def test_vectorized_binarize_matches_loop(seed, max_duration, onset_offset):
+    onset, offset = onset_offset
+    scores = synthetic_scores(20000, seed=seed, smoothing=[1, 5, 50, 200, 500][seed])
+    loop = Binarize(onset=onset, offset=offset, max_duration=max_duration)
+    vectorized = Binarize(onset=onset, offset=offset, max_duration=max_duration, vectorized=True)
+    assert regions(vectorized(scores)) == regions(loop(scores))
+
+
+@pytest.mark.parametrize("data", [[0.9], [0.1], [0.9, 0.1, 0.9], [0.1, 0.9, 0.9, 0.2, 0.6, 0.9], [0.0, 0.1, 0.7, 0.1, 0.0, 0.1, 0.7]])
+@pytest.mark.parametrize("onset_offset", [(0.5, 0.363), (0.1, 0.1)])
+def test_vectorized_binarize_edge_cases(data, onset_offset):
+    # scores equal to the thresholds in float32 are above 0.1 in float64
+    onset, offset = onset_offset
+    scores = SlidingWindowFeature(np.array(data, dtype=np.float32)[:, None], SlidingWindow(start=0.0, duration=0.1, step=0.05))
+    for max_duration in [float("inf"), 0.05, 0.01]:
+        loop = Binarize(onset=onset, offset=offset, max_duration=max_duration)
+        vectorized = Binarize(onset=onset, offset=offset, max_duration=max_duration, vectorized=True)
+        assert regions(vectorized(scores)) == regions(loop(scores))
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("num_frames", [200000, 1000000])
+def test_binarize_benchmark(num_frames):
+    # ~56 min and ~4.7 h of audio at the segmentation model frame rate
+    scores = synthetic_scores(num_frames)
+    timings = {}
+    for vectorized in [False, True]:
+        binarize = Binarize(onset=0.5, offset=0.363, max_duration=30, vectorized=vectorized)
+        start = time.time()
+        binarize(scores)
+        timings[vectorized] = time.time() - start
+    logger.info(f"binarize {num_frames} frames | loop: {timings[False]:.3f}s | vectorized: {timings[True]:.3f}s | speedup: {timings[False] / timings[True]:.1f}x")
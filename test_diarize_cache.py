@@ -0,0 +1,110 @@
+import os
+import logging
+
+import pytest
+import numpy as np
+from pyannote.audio import Pipeline
+from pyannote.core import SlidingWindow, SlidingWindowFeature
+
+from whisperx.diarize import DiarizationCache, DiarizationPipeline
+
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_intermediates(num_chunks: int = 20, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    segmentations = SlidingWindowFeature(rng.random((num_chunks, 589, 3)).astype(np.float32), SlidingWindow(start=0.0, duration=10.0, step=1.0))
+    embeddings = rng.standard_normal((num_chunks, 3, 256)).astype(np.float32)
+    return segmentations, embeddings
+
+
+@pytest.mark.parametrize("with_embeddings", [True, False])
+def test_diarization_cache_roundtrip(tmp_path, with_embeddings):
+    audio = np.random.default_rng(0).standard_normal(16000 * 5).astype(np.float32)
+    segmentations, embeddings = synthetic_intermediates()
+    if not with_embeddings:
+        embeddings = None
+    cache = DiarizationCache("model", cache_dir=str(tmp_path))
+    key = cache.key(audio)
+    assert cache.get(key) is None
+    cache.put(key, segmentations, embeddings)
+
+    # a new process only has the files
+    cached_segmentations, cached_embeddings = DiarizationCache("model", cache_dir=str(tmp_path)).get(key)
+    np.testing.assert_array_equal(cached_segmentations.data, segmentations.data)
+    assert cached_segmentations.sliding_window.step == segmentations.sliding_window.step
+    assert cached_segmentations.sliding_window.duration == segmentations.sliding_window.duration
+    if with_embeddings:
+        np.testing.assert_array_equal(cached_embeddings, embeddings)
+    else:
+        assert cached_embeddings is None
+
+    # other models and other audio miss
+    assert DiarizationCache("other model", cache_dir=str(tmp_path)).get(DiarizationCache("other model").key(audio)) is None
+    assert DiarizationCache("model", cache_dir=str(tmp_path)).get(cache.key(audio[1:])) is None
+
+
+def test_diarization_cache_in_memory():
+    cache = DiarizationCache("model")
+    segmentations, embeddings = synthetic_intermediates()
+    cache.put("a", segmentations, embeddings)
+    assert cache.get("a")[0] is segmentations
+    cache.put("b", segmentations, embeddings)
+    # only the last entry is kept without a cache directory
+    assert cache.get("a") is None
+
+
+def test_diarization_cache_evicts_least_recently_used(tmp_path):
+    segmentations, embeddings = synthetic_intermediates()
+    entry_bytes = segmentations.data.nbytes + embeddings.nbytes
+    cache = DiarizationCache("model", cache_dir=str(tmp_path), max_bytes=int(2.5 * entry_bytes))
+    for key in ["a", "b", "c"]:
+        cache.put(key, segmentations, embeddings)
+    reader = DiarizationCache("model", cache_dir=str(tmp_path))
+    assert reader.get("a") is None
+    assert reader.get("b") is not None and reader.get("c") is not None
+
+
+class StubPipeline:
+    def to(self, device):
+        return self
+
+
+@pytest.mark.parametrize("cache_dir", [None, "cache"])
+def test_recluster_needs_cached_audio(monkeypatch, tmp_path, cache_dir):
+    monkeypatch.setattr(Pipeline, "from_pretrained", lambda *args, **kwargs: StubPipeline())
+    pipeline = DiarizationPipeline(cache_dir=str(tmp_path / cache_dir) if cache_dir is not None else None)
+    # caching is opt-in
+    assert (pipeline.cache is None) == (cache_dir is None)
+    with pytest.raises(ValueError):
+        pipeline.recluster(num_speakers=2)
+
+
+def test_diarization_cache_unique_temporary_files(tmp_path, monkeypatch):
+    segmentations, embeddings = synthetic_intermediates()
+    cache = DiarizationCache("model", cache_dir=str(tmp_path))
+    written = []
+    savez = np.savez
+    monkeypatch.setattr(np, "savez", lambda file, **arrays: (written.append(file.name), savez(file, **arrays)))
+    cache.put("a", segmentations, embeddings)
+    cache.put("a", segmentations, embeddings)
+    # every put writes its own temporary file in the cache directory, then moves it in place
+    assert len(set(written)) == 2
+    assert all(os.path.dirname(name) == str(tmp_path) and name.endswith(".tmp") for name in written)
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "a.npz"]
+
+
+@pytest.mark.parametrize("evicted", ["data", "utime"])
+def test_diarization_cache_concurrent_eviction_is_a_miss(tmp_path, monkeypatch, evicted):
+    segmentations, embeddings = synthetic_intermediates()
+    DiarizationCache("model", cache_dir=str(tmp_path)).put("a", segmentations, embeddings)
+    # a fresh reader, without the last entry in memory
+    cache = DiarizationCache("model", cache_dir=str(tmp_path))
+    if evicted == "data":
+        os.remove(tmp_path / "a.npz")
+    else:
+        def utime(path, *args, **kwargs):
+            raise FileNotFoundError(path)
+        monkeypatch.setattr(os, "utime", utime)
+    assert cache.get("a") is None
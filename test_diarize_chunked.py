@@ -0,0 +1,192 @@
+import math
+import wave
+import threading
+import logging
+from types import SimpleNamespace
+
+import pytest
+import numpy as np
+from pyannote.audio import Pipeline
+from pyannote.core import Annotation, Segment
+
+import whisperx.audio
+import whisperx.diarize
+from whisperx.audio import SAMPLE_RATE
+from whisperx.diarize import DiarizationPipeline, assign_word_speakers, link_speakers
+
+
+logger = logging.getLogger(__name__)
+
+
+class WindowDiarization:
+    # stands in for the pyannote pipeline: diarizes the waveform it gets from a known speaker timeline,
+    # with shuffled window labels and noisy speaker embeddings
+    clustering = SimpleNamespace(threshold=0.7, method="centroid")
+
+    def __init__(self, turns, speaker_embeddings, offsets, seed=0):
+        self.turns = turns
+        self.speaker_embeddings = speaker_embeddings
+        # where every window starts in the file, the pipeline only sees the waveform
+        self.offsets = list(offsets)
+        self.rng = np.random.default_rng(seed)
+        self.max_samples = 0
+
+    def to(self, device):
+        return self
+
+    def __call__(self, audio_data, num_speakers=None, min_speakers=None, max_speakers=None, return_embeddings=False):
+        num_samples = audio_data["waveform"].shape[1]
+        self.max_samples = max(self.max_samples, num_samples)
+        start = self.offsets.pop(0)
+        end = start + num_samples / SAMPLE_RATE
+        speakers = sorted({speaker for s, e, speaker in self.turns if s < end and e > start})
+        names = {speaker: f"SPEAKER_{i:02d}" for i, speaker in enumerate(self.rng.permutation(speakers))}
+        diarization = Annotation()
+        for s, e, speaker in self.turns:
+            if s < end and e > start:
+                diarization[Segment(max(s, start) - start, min(e, end) - start)] = names[speaker]
+        centroids = np.array([
+            self.speaker_embeddings[speaker] + self.rng.normal(0, 0.05, self.speaker_embeddings.shape[1])
+            for speaker in sorted(names, key=names.get)
+        ]).reshape(len(names), -1)
+        return diarization, centroids
+
+
+def synthetic_meeting(duration: float, num_speakers: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    turns = []
+    t = 0.0
+    while t < duration:
+        length = min(rng.uniform(1, 30), duration - t)
+        turns.append((round(t, 3), round(t + length, 3), int(rng.integers(num_speakers))))
+        t += length + rng.uniform(0, 2)
+    speaker_embeddings = np.eye(num_speakers, 32)
+    return turns, speaker_embeddings
+
+
+def diarization_pipeline(monkeypatch, model, **kwargs):
+    # the real constructor, with the fake in place of the pretrained pyannote pipeline
+    monkeypatch.setattr(Pipeline, "from_pretrained", lambda *args, **kwargs: model)
+    return DiarizationPipeline(**kwargs)
+
+
+def chunked_pipeline(monkeypatch, turns, speaker_embeddings, duration, chunk_duration, chunk_overlap):
+    offsets = np.arange(0, max(duration - chunk_overlap, 1e-9), chunk_duration - chunk_overlap)
+    return diarization_pipeline(monkeypatch, WindowDiarization(turns, speaker_embeddings, offsets))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("chunk_duration,chunk_overlap", [(120.0, 20.0), (300.0, 30.0)])
+def test_chunked_diarization_links_speakers(monkeypatch, seed, chunk_duration, chunk_overlap):
+    duration = 1800.0
+    turns, speaker_embeddings = synthetic_meeting(duration, num_speakers=4, seed=seed)
+    pipeline = chunked_pipeline(monkeypatch, turns, speaker_embeddings, duration, chunk_duration, chunk_overlap)
+    audio = np.zeros(int(duration * SAMPLE_RATE), dtype=np.float32)
+    diarize_df = pipeline(audio, chunk_duration=chunk_duration, chunk_overlap=chunk_overlap)
+
+    assert list(diarize_df.columns) == ["segment", "label", "speaker", "start", "end"]
+    assert pipeline.model.max_samples <= chunk_duration * SAMPLE_RATE
+    # every true speaker maps to exactly one speaker name
+    words = {"segments": [{"start": (s + e) / 2 - 0.1, "end": (s + e) / 2 + 0.1} for s, e, _ in turns]}
+    assign_word_speakers(diarize_df, words)
+    mapping = {}
+    for (_, _, speaker), segment in zip(turns, words["segments"]):
+        assert mapping.setdefault(speaker, segment["speaker"]) == segment["speaker"]
+    assert len(set(mapping.values())) == len(mapping)
+    # turns cut at the window cores are merged back
+    assert len(diarize_df) == len(turns)
+
+
+def test_link_speakers_num_speakers():
+    rng = np.random.default_rng(0)
+    embeddings = np.repeat(np.eye(3, 16), 4, axis=0) + rng.normal(0, 0.05, (12, 16))
+    assert len(set(link_speakers(embeddings, threshold=0.7))) == 3
+    assert len(set(link_speakers(embeddings, threshold=0.7, num_speakers=2))) == 2
+    assert len(set(link_speakers(embeddings, threshold=0.7, max_speakers=2))) == 2
+    assert len(set(link_speakers(embeddings, threshold=2.0, min_speakers=3))) == 3
+    # speakers without embedding keep their own
+    embeddings[5] = 0
+    speakers = link_speakers(embeddings, threshold=0.7)
+    assert len(set(speakers)) == 4 and list(speakers).count(speakers[5]) == 1
+
+
+def test_submit_shares_decoded_audio(monkeypatch):
+    duration = 60.0
+    turns, speaker_embeddings = synthetic_meeting(duration, num_speakers=2)
+    audio = np.zeros(int(duration * SAMPLE_RATE), dtype=np.float32)
+    waveforms = []
+
+    class Diarization(WindowDiarization):
+        def __call__(self, audio_data, **kwargs):
+            waveforms.append(audio_data["waveform"])
+            return super().__call__(audio_data, return_embeddings=True, **kwargs)[0]
+
+    pipeline = diarization_pipeline(monkeypatch, Diarization(turns, speaker_embeddings, [0.0, 0.0]))
+    expected = pipeline(audio)
+    diarize_df = pipeline.submit(audio).result()
+    assert diarize_df[["speaker", "start", "end"]].equals(expected[["speaker", "start", "end"]])
+    assert np.shares_memory(waveforms[-1].numpy(), audio)
+
+
+@pytest.mark.parametrize("max_pending", [1, 2])
+def test_submit_bounds_pending_files(monkeypatch, max_pending):
+    num_files = 4
+    turns, speaker_embeddings = synthetic_meeting(10.0, num_speakers=2)
+    audio = np.zeros(10 * SAMPLE_RATE, dtype=np.float32)
+    release = threading.Event()
+
+    class Diarization(WindowDiarization):
+        def __call__(self, audio_data, **kwargs):
+            release.wait(timeout=10)
+            return super().__call__(audio_data, return_embeddings=True, **kwargs)[0]
+
+    pipeline = diarization_pipeline(monkeypatch, Diarization(turns, speaker_embeddings, [0.0] * num_files), max_pending=max_pending)
+    futures = []
+
+    def submit_all():
+        for _ in range(num_files):
+            futures.append(pipeline.submit(audio))
+
+    submitter = threading.Thread(target=submit_all, daemon=True)
+    submitter.start()
+    # the running file and the ones waiting for it hold their audio, further submissions block
+    submitter.join(timeout=0.5)
+    assert submitter.is_alive()
+    assert len(futures) == max_pending
+    release.set()
+    submitter.join(timeout=10)
+    assert not submitter.is_alive()
+    assert len(futures) == num_files
+    for future in futures:
+        assert len(future.result()) > 0
+
+
+def test_chunked_diarization_of_path_decodes_windows(monkeypatch, tmp_path):
+    duration, chunk_duration, chunk_overlap = 300.0, 60.0, 10.0
+    turns, speaker_embeddings = synthetic_meeting(duration, num_speakers=3)
+    samples = np.random.default_rng(0).integers(-32768, 32768, int(duration * SAMPLE_RATE), dtype=np.int16)
+    path = str(tmp_path / "meeting.wav")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+
+    decoded = []
+
+    def spy_load_audio(*args, **kwargs):
+        audio = whisperx.audio.load_audio(*args, **kwargs)
+        decoded.append(len(audio))
+        return audio
+
+    monkeypatch.setattr(whisperx.diarize, "load_audio", spy_load_audio)
+    expected = chunked_pipeline(monkeypatch, turns, speaker_embeddings, duration, chunk_duration, chunk_overlap)(
+        samples.astype(np.float32) / 32768.0, chunk_duration=chunk_duration, chunk_overlap=chunk_overlap
+    )
+    pipeline = chunked_pipeline(monkeypatch, turns, speaker_embeddings, duration, chunk_duration, chunk_overlap)
+    diarize_df = pipeline(path, chunk_duration=chunk_duration, chunk_overlap=chunk_overlap)
+
+    # one decode per window, none of them longer than a window
+    assert len(decoded) == math.ceil((duration - chunk_overlap) / (chunk_duration - chunk_overlap))
+    assert max(decoded) <= chunk_duration * SAMPLE_RATE
+    assert diarize_df[["speaker", "start", "end"]].equals(expected[["speaker", "start", "end"]])
@@ -0,0 +1,157 @@
+import time
+import logging
+import threading
+
+import pytest
+import numpy as np
+
+from whisperx.executor import PipelinedExecutor, prefetch
+
+
+logger = logging.getLogger(__name__)
+
+
+class StubPipeline:
+    # stands in for FasterWhisperPipeline: VAD and ASR record the audio they get, optionally failing on one file
+    def __init__(self, fail_vad_on=None):
+        self.fail_vad_on = fail_vad_on
+        self.events = []
+        self.lock = threading.Lock()
+
+    def get_vad_segments(self, audio, **kwargs):
+        if self.fail_vad_on is not None and audio[0] == self.fail_vad_on:
+            raise ValueError(f"VAD failed on file {self.fail_vad_on}")
+        return [{"start": 0.0, "end": len(audio) / 16000}]
+
+    def transcribe(self, audio, vad_segments=None, **kwargs):
+        with self.lock:
+            self.events.append(("transcribe", int(audio[0])))
+        return {"segments": [{"text": str(int(audio[0])), **segment} for segment in vad_segments], "language": "en"}
+
+
+def files(num_files):
+    # every file is filled with its index
+    return [np.full(1600, i, dtype=np.float32) for i in range(num_files)]
+
+
+def test_pipelined_executor_calls_on_decoded_before_transcription():
+    model = StubPipeline()
+    decoded = {}
+
+    def on_decoded(idx, audio):
+        with model.lock:
+            model.events.append(("decoded", idx))
+        decoded[idx] = audio
+
+    audios = files(5)
+    executor = PipelinedExecutor(model, decode_workers=2, queue_size=1, on_decoded=on_decoded)
+    results = {idx: result for idx, audio, result in executor(audios)}
+    assert sorted(results) == list(range(5))
+    assert all(results[idx]["segments"][0]["text"] == str(idx) for idx in results)
+    # the decoded arrays are handed out as is
+    assert all(decoded[idx] is audios[idx] for idx in range(5))
+    for idx in range(5):
+        assert model.events.index(("decoded", idx)) < model.events.index(("transcribe", idx))
+
+
+def run_with_timeout(fn, timeout=10.0):
+    # runs `fn` on a thread, so that a hanging executor fails the test instead of blocking the run
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = fn()
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the consumer hangs"
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def wait_for_threads(threads, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline and any(thread.is_alive() for thread in threads):
+        time.sleep(0.05)
+    return [thread for thread in threads if thread.is_alive()]
+
+
+class FailingAudioCache:
+    # "decodes" paths of the form "<index>", failing on one of them
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+
+    def load(self, path):
+        if int(path) == self.fail_on:
+            raise RuntimeError(f"Failed to load audio: {path}")
+        return np.full(1600, int(path), dtype=np.float32)
+
+
+@pytest.mark.parametrize("stage", ["input", "decode", "on_decoded", "vad"])
+@pytest.mark.parametrize("decode_workers", [1, 3])
+def test_pipelined_executor_raises_worker_errors(stage, decode_workers):
+    threads = set(threading.enumerate())
+
+    def paths():
+        for i in range(6):
+            if stage == "input" and i == 2:
+                raise OSError("listing the files failed")
+            yield str(i)
+
+    def on_decoded(idx, audio):
+        if stage == "on_decoded" and idx == 2:
+            raise ValueError("diarization failed to start")
+
+    executor = PipelinedExecutor(
+        StubPipeline(fail_vad_on=2 if stage == "vad" else None),
+        decode_workers=decode_workers,
+        queue_size=1,
+        audio_cache=FailingAudioCache(fail_on=2 if stage == "decode" else None),
+        on_decoded=on_decoded,
+    )
+    errors = {"input": "listing the files failed", "decode": "Failed to load audio", "on_decoded": "diarization failed", "vad": "VAD failed"}
+    with pytest.raises(Exception, match=errors[stage]):
+        run_with_timeout(lambda: [idx for idx, _, _ in executor(paths())])
+    assert wait_for_threads(set(threading.enumerate()) - threads) == []
+
+
+@pytest.mark.parametrize("queue_size", [1, 4])
+def test_pipelined_executor_stops_when_consumer_stops_early(queue_size):
+    threads = set(threading.enumerate())
+    model = StubPipeline()
+    results = PipelinedExecutor(model, decode_workers=2, vad_workers=2, queue_size=queue_size)(files(50))
+    assert run_with_timeout(lambda: next(results))[0] in range(50)
+    results.close()
+    assert wait_for_threads(set(threading.enumerate()) - threads) == []
+    # nothing past the bounded queues was processed
+    assert len(model.events) == 1
+
+
+def test_prefetch_stops_when_consumer_stops_early():
+    threads = set(threading.enumerate())
+    produced = []
+
+    def items():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    stream = prefetch(items(), queue_size=2)
+    assert run_with_timeout(lambda: next(stream)) == 0
+    stream.close()
+    assert wait_for_threads(set(threading.enumerate()) - threads) == []
+    # the worker stays at most a full queue (and the item it is putting) ahead
+    assert len(produced) <= 4
+
+
+def test_prefetch_raises_worker_errors_without_hanging():
+    def items():
+        yield 1
+        raise ValueError("decoding failed")
+
+    with pytest.raises(ValueError, match="decoding failed"):
+        run_with_timeout(lambda: list(prefetch(items(), queue_size=1)))
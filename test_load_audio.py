@@ -0,0 +1,86 @@
+import wave
+import shutil
+import logging
+import subprocess
+import tracemalloc
+
+import pytest
+import numpy as np
+
+import whisperx.audio
+from whisperx.audio import SAMPLE_RATE, iter_audio, load_audio
+
+
+logger = logging.getLogger(__name__)
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+
+
+def subprocess_load_audio(file: str, sr: int = SAMPLE_RATE):
+    # the `load_audio` that buffered all of the ffmpeg output, kept as reference
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0", "-i", file, "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr), "-"]
+    out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+@pytest.fixture(autouse=True)
+def no_read_wav(monkeypatch):
+    # 16 kHz mono WAV files are read without ffmpeg, these tests are about the ffmpeg decoder
+    monkeypatch.setattr(whisperx.audio, "read_wav", lambda *args, **kwargs: None)
+
+
+@pytest.fixture(scope="module")
+def wav_file(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("audio") / "noise.wav")
+    samples = np.random.default_rng(0).integers(-32768, 32768, 47 * SAMPLE_RATE + 123, dtype=np.int16)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+    return path
+
+
+@pytest.mark.parametrize("block_size", [1000, 1 << 16, 1 << 20])
+def test_load_audio_matches_subprocess(wav_file, block_size):
+    expected = subprocess_load_audio(wav_file)
+    audio = load_audio(wav_file, block_size=block_size)
+    assert audio.dtype == np.float32
+    np.testing.assert_array_equal(audio, expected)
+
+
+@pytest.mark.parametrize("start,duration", [(0.0, 10.0), (5.0, 10.0), (40.0, 10.0), (20.0, None), (None, 3.5), (50.0, 10.0)])
+def test_load_audio_window(wav_file, start, duration):
+    expected = subprocess_load_audio(wav_file)
+    first = int((start or 0.0) * SAMPLE_RATE)
+    last = len(expected) if duration is None else first + int(duration * SAMPLE_RATE)
+    np.testing.assert_allclose(load_audio(wav_file, start=start, duration=duration), expected[first:last], atol=1 / 32768)
+
+
+def test_iter_audio_blocks(wav_file):
+    blocks = list(iter_audio(wav_file, block_size=SAMPLE_RATE))
+    assert all(len(block) == SAMPLE_RATE for block in blocks[:-1])
+    assert 0 < len(blocks[-1]) <= SAMPLE_RATE
+    np.testing.assert_array_equal(np.concatenate(blocks), subprocess_load_audio(wav_file))
+
+
+def test_iter_audio_close_early(wav_file):
+    blocks = iter_audio(wav_file, block_size=SAMPLE_RATE)
+    assert len(next(blocks)) == SAMPLE_RATE
+    blocks.close()
+
+
+def test_load_audio_missing_file(tmp_path):
+    with pytest.raises(RuntimeError, match="Failed to load audio"):
+        load_audio(str(tmp_path / "missing.wav"))
+
+
+def test_load_audio_peak_memory(wav_file):
+    peaks = {}
+    for name, fn in [("subprocess", subprocess_load_audio), ("streaming", load_audio)]:
+        tracemalloc.start()
+        audio = fn(wav_file)
+        peaks[name] = tracemalloc.get_traced_memory()[1] / audio.nbytes
+        tracemalloc.stop()
+    logger.info(f"load_audio 47s peak memory | subprocess: {peaks['subprocess']:.2f}x | streaming: {peaks['streaming']:.2f}x (of the decoded array)")
+    assert peaks["streaming"] < peaks["subprocess"]
@@ -0,0 +1,107 @@
+import time
+import wave
+import shutil
+import struct
+import logging
+
+import pytest
+import numpy as np
+
+from whisperx.audio import SAMPLE_RATE, iter_audio, load_audio, read_wav
+
+
+logger = logging.getLogger(__name__)
+
+
+def write_wav(path, samples, sr=SAMPLE_RATE, channels=1, sampwidth=2):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(sampwidth)
+        f.setframerate(sr)
+        f.writeframes(samples.tobytes())
+    return str(path)
+
+
+def wave_reference(path):
+    with wave.open(path, "rb") as f:
+        data = f.readframes(f.getnframes())
+    return np.frombuffer(data, np.int16).astype(np.float32) / 32768.0
+
+
+def noise(seconds, seed=0):
+    return np.random.default_rng(seed).integers(-32768, 32768, int(seconds * SAMPLE_RATE), dtype=np.int16)
+
+
+@pytest.mark.parametrize("seconds", [0.001, 5, 47.3])
+def test_read_wav_matches_wave(tmp_path, seconds):
+    path = write_wav(tmp_path / "a.wav", noise(seconds))
+    audio = read_wav(path)
+    assert audio.dtype == np.float32 and audio.flags.writeable
+    np.testing.assert_array_equal(audio, wave_reference(path))
+
+
+@pytest.mark.parametrize("start,duration", [(0.0, 10.0), (5.0, 10.0), (40.0, 10.0), (20.0, None), (None, 3.5), (50.0, 10.0)])
+def test_read_wav_window(tmp_path, start, duration):
+    path = write_wav(tmp_path / "a.wav", noise(47))
+    expected = wave_reference(path)
+    first = int((start or 0.0) * SAMPLE_RATE)
+    last = len(expected) if duration is None else first + int(duration * SAMPLE_RATE)
+    np.testing.assert_array_equal(read_wav(path, start=start, duration=duration), expected[first:last])
+
+
+def test_read_wav_extra_chunks(tmp_path):
+    # an odd-sized LIST chunk before fmt and its padding byte, trailing bytes after the data chunk
+    samples = noise(1)
+    fmt = struct.pack("<HHIIHH", 1, 1, SAMPLE_RATE, 2 * SAMPLE_RATE, 2, 16)
+    chunks = b"LIST" + struct.pack("<I", 5) + b"INFO!\0" + b"fmt " + struct.pack("<I", 16) + fmt
+    chunks += b"data" + struct.pack("<I", samples.nbytes) + samples.tobytes() + b"id3 junk"
+    path = tmp_path / "a.wav"
+    path.write_bytes(b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks)
+    np.testing.assert_array_equal(read_wav(str(path)), samples.astype(np.float32) / 32768.0)
+
+
+def test_read_wav_streamed_size(tmp_path):
+    # ffmpeg writing to a pipe leaves the data size at 0xFFFFFFFF
+    samples = noise(1)
+    path = write_wav(tmp_path / "a.wav", samples)
+    data = bytearray(open(path, "rb").read())
+    data[40:44] = struct.pack("<I", 0xFFFFFFFF)
+    open(path, "wb").write(data)
+    np.testing.assert_array_equal(read_wav(path), samples.astype(np.float32) / 32768.0)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"sr": 8000}, {"sr": 44100}, {"channels": 2}, {"sampwidth": 4}, {"sampwidth": 1},
+])
+def test_read_wav_falls_back(tmp_path, kwargs):
+    samples = np.random.default_rng(0).integers(0, 256, 1000, dtype=np.uint8)
+    assert read_wav(write_wav(tmp_path / "a.wav", samples, **kwargs)) is None
+
+
+def test_read_wav_not_wav(tmp_path):
+    for name, data in [("empty.wav", b""), ("short.wav", b"RIFF"), ("a.mp3", b"ID3\x04" + bytes(100)), ("nodata.wav", b"RIFF\0\0\0\0WAVE")]:
+        (tmp_path / name).write_bytes(data)
+        assert read_wav(str(tmp_path / name)) is None
+    assert read_wav(str(tmp_path / "missing.wav")) is None
+    # 16 kHz mono WAV, but read by 8 kHz callers
+    assert read_wav(write_wav(tmp_path / "a.wav", noise(1)), sr=8000) is None
+
+
+@pytest.mark.benchmark
+def test_read_wav_benchmark(tmp_path):
+    # per-file latency of short clips, where spawning ffmpeg dominates
+    paths = [write_wav(tmp_path / f"{i}.wav", noise(5, seed=i)) for i in range(20)]
+    timings = {}
+    loaders = [("read_wav", load_audio)]
+    if shutil.which("ffmpeg") is not None:
+        loaders.append(("ffmpeg", lambda path: np.concatenate(list(iter_audio(path)))))
+    for name, fn in loaders:
+        start = time.time()
+        for path in paths:
+            audio = fn(path)
+        timings[name] = (time.time() - start) / len(paths)
+    np.testing.assert_array_equal(audio, wave_reference(paths[-1]))
+    message = f"load_audio 5s wav per file | read_wav: {timings['read_wav'] * 1000:.2f}ms"
+    if "ffmpeg" in timings:
+        message += f" | ffmpeg: {timings['ffmpeg'] * 1000:.2f}ms ({timings['ffmpeg'] / timings['read_wav']:.1f}x)"
+    logger.info(message)
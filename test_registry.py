@@ -0,0 +1,185 @@
+import os
+import hashlib
+import logging
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+import whisperx.vad
+from whisperx.registry import ModelRegistry, estimate_nbytes
+from whisperx.vad import VAD_SEGMENTATION_SHA256, file_sha256, load_vad_model
+
+
+logger = logging.getLogger(__name__)
+
+
+class Loader:
+    # counts the loads of every key
+    def __init__(self):
+        self.loads = []
+
+    def __call__(self, key):
+        def load():
+            self.loads.append(key)
+            return f"model {key}"
+        return load
+
+
+def test_registry_reuses_entries():
+    registry = ModelRegistry()
+    loader = Loader()
+    assert registry.get_or_load("a", loader("a")) == "model a"
+    assert registry.get_or_load("a", loader("a")) == "model a"
+    assert loader.loads == ["a"]
+    assert "a" in registry and len(registry) == 1
+
+
+def test_registry_evicts_least_recently_used_entries():
+    registry = ModelRegistry(max_entries=2)
+    loader = Loader()
+    registry.get_or_load("a", loader("a"))
+    registry.get_or_load("b", loader("b"))
+    # using "a" makes "b" the least recently used
+    registry.get_or_load("a", loader("a"))
+    registry.get_or_load("c", loader("c"))
+    assert "a" in registry and "b" not in registry and "c" in registry
+    registry.get_or_load("b", loader("b"))
+    assert loader.loads == ["a", "b", "c", "b"]
+    assert "a" not in registry
+
+
+def test_registry_memory_budget():
+    registry = ModelRegistry(max_bytes=100)
+    loader = Loader()
+    registry.get_or_load("a", loader("a"), nbytes=40)
+    registry.get_or_load("b", loader("b"), nbytes=40)
+    assert registry.nbytes == 80
+    registry.get_or_load("c", loader("c"), nbytes=40)
+    assert [key for key in "abc" if key in registry] == ["b", "c"]
+    assert registry.nbytes == 80
+    # an entry over the budget on its own is still kept
+    registry.get_or_load("d", loader("d"), nbytes=500)
+    assert [key for key in "abcd" if key in registry] == ["d"]
+    assert registry.nbytes == 500
+
+
+def test_registry_estimates_torch_weights():
+    model = torch.nn.Sequential(torch.nn.Linear(10, 20), torch.nn.BatchNorm1d(20))
+    # weights and biases, the batch norm running statistics and its number of batches
+    expected = 4 * (10 * 20 + 20 + 2 * 20 + 2 * 20) + 8
+    assert estimate_nbytes(model) == expected
+    assert estimate_nbytes((model, {"labels": []})) == expected
+    assert estimate_nbytes("ctranslate2 model") == 0
+    registry = ModelRegistry()
+    registry.get_or_load("model", lambda: model)
+    assert registry.nbytes == expected
+
+
+def test_registry_evict_and_clear():
+    registry = ModelRegistry()
+    loader = Loader()
+    for key in "abc":
+        registry.get_or_load(key, loader(key), nbytes=10)
+    assert registry.evict("b")
+    assert not registry.evict("b")
+    assert len(registry) == 2 and registry.nbytes == 20
+    registry.clear()
+    assert len(registry) == 0 and registry.nbytes == 0
+    registry.get_or_load("a", loader("a"))
+    assert loader.loads == ["a", "b", "c", "a"]
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    # counts the files hashed by file_sha256
+    hashed = []
+    sha256 = hashlib.sha256
+
+    class CountingSha256:
+        def __init__(self):
+            hashed.append(1)
+            self.digest = sha256()
+
+        def update(self, block):
+            self.digest.update(block)
+
+        def hexdigest(self):
+            return self.digest.hexdigest()
+
+    monkeypatch.setattr(whisperx.vad, "hashlib", SimpleNamespace(sha256=CountingSha256))
+    return hashed
+
+
+def write_checkpoint(path, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_file_sha256_sidecar(tmp_path, hashes):
+    path = write_checkpoint(tmp_path / "model.bin", b"weights" * 1000)
+    expected = hashlib.sha256(b"weights" * 1000).hexdigest()
+    assert file_sha256(path, block_size=1000) == expected
+    assert os.path.isfile(path + ".sha256")
+    assert file_sha256(path) == expected
+    assert len(hashes) == 1
+    assert sorted(os.listdir(tmp_path)) == ["model.bin", "model.bin.sha256"]
+
+
+@pytest.mark.parametrize("change", ["mtime", "size"])
+def test_file_sha256_sidecar_invalidation(tmp_path, hashes, change):
+    path = write_checkpoint(tmp_path / "model.bin", b"weights" * 1000)
+    file_sha256(path)
+    stat = os.stat(path)
+    if change == "mtime":
+        # same size, e.g. a checkpoint downloaded again
+        data = b"WEIGHTS" * 1000
+        write_checkpoint(path, data)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    else:
+        # same modification time, e.g. restored with its original timestamps
+        data = b"weights" * 999
+        write_checkpoint(path, data)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert file_sha256(path) == hashlib.sha256(data).hexdigest()
+    assert len(hashes) == 2
+    assert file_sha256(path) == hashlib.sha256(data).hexdigest()
+    assert len(hashes) == 2
+
+
+def test_file_sha256_corrupt_sidecar(tmp_path, hashes):
+    path = write_checkpoint(tmp_path / "model.bin", b"weights")
+    with open(path + ".sha256", "w") as f:
+        f.write("{not json")
+    assert file_sha256(path) == hashlib.sha256(b"weights").hexdigest()
+    assert file_sha256(path) == hashlib.sha256(b"weights").hexdigest()
+    assert len(hashes) == 1
+
+
+class StubVoiceActivitySegmentation:
+    def __init__(self, segmentation, device):
+        self.instantiated = []
+
+    def instantiate(self, hyperparameters):
+        self.instantiated.append(dict(hyperparameters))
+
+
+def test_load_vad_model_registry_shares_pipeline_across_thresholds(tmp_path, monkeypatch):
+    registry = ModelRegistry()
+    loads = []
+    monkeypatch.setattr(whisperx.vad, "MODEL_REGISTRY", registry)
+    monkeypatch.setattr(whisperx.vad, "file_sha256", lambda path: VAD_SEGMENTATION_SHA256)
+    monkeypatch.setattr(whisperx.vad.Model, "from_pretrained", lambda *args, **kwargs: loads.append(args) or "segmentation")
+    monkeypatch.setattr(whisperx.vad, "VoiceActivitySegmentation", StubVoiceActivitySegmentation)
+    model_fp = write_checkpoint(tmp_path / "vad.bin", b"weights")
+
+    default = load_vad_model("cpu", model_fp=model_fp, use_registry=True)
+    assert load_vad_model("cpu", model_fp=model_fp, use_registry=True) is default
+    # the thresholds are applied per call by merge_chunks, the pipeline only returns raw scores
+    assert load_vad_model("cpu", vad_onset=0.3, vad_offset=0.2, model_fp=model_fp, use_registry=True) is default
+    assert len(loads) == 1
+    assert len(default.instantiated) == 1
+    assert load_vad_model("cpu", model_fp=model_fp, use_registry=False) is not default
+    assert len(loads) == 2
+    assert len(registry) == 1
@@ -0,0 +1,383 @@
+import os
+import logging
+
+import pytest
+import torch
+import numpy as np
+import ctranslate2
+import faster_whisper
+from pyannote.core import SlidingWindow, SlidingWindowFeature
+
+from whisperx.asr import FasterWhisperPipeline, bucket_segments
+from whisperx.audio import SAMPLE_RATE
+from whisperx.decode_sweep import DecodeSweep
+from whisperx.vad import VadScoreCache
+
+
+logger = logging.getLogger(__name__)
+
+# the stub model tells the languages apart by the pitch of the speech
+LANGUAGE_FREQUENCIES = {"en": 300.0, "de": 2500.0}
+# mel bin separating the two pitches
+LANGUAGE_MEL_BIN = 30
+
+
+class StubTokenizer:
+    def __init__(self, hf_tokenizer, multilingual, task=None, language=None):
+        self.task = task
+        self.language_code = language
+
+
+def detect_pitch_language(features: torch.Tensor) -> str:
+    return "de" if int(features.mean(dim=-1).argmax()) > LANGUAGE_MEL_BIN else "en"
+
+
+class StubCTranslate2Model:
+    is_multilingual = True
+
+    def detect_language(self, encoder_output):
+        results = []
+        for features in torch.from_numpy(np.array(encoder_output)):
+            language = detect_pitch_language(features)
+            other = "en" if language == "de" else "de"
+            results.append([(f"<|{language}|>", 0.8), (f"<|{other}|>", 0.2)])
+        return results
+
+
+class StubWhisperModel:
+    # stands in for WhisperModel: the "encoder" passes the features through, the encoder runs are counted
+    # and every decoded batch is recorded
+    feat_kwargs = {"feature_size": 80}
+    hf_tokenizer = None
+
+    def __init__(self, fail_on_batch=None):
+        self.model = StubCTranslate2Model()
+        self.fail_on_batch = fail_on_batch
+        self.encoded = []
+        self.batches = []
+
+    def encode(self, features):
+        if features.ndim == 2:
+            features = features.unsqueeze(0)
+        self.encoded.append(features.shape[0])
+        return ctranslate2.StorageView.from_array(np.ascontiguousarray(features.numpy()))
+
+    def generate_segment_batched(self, features, tokenizer, options, encoder_output=None):
+        if len(self.batches) == self.fail_on_batch:
+            raise RuntimeError("decoding failed")
+        encoded = torch.from_numpy(np.array(encoder_output)) if encoder_output is not None else None
+        self.batches.append({
+            "size": (features if features is not None else encoded).shape[0],
+            "language": tokenizer.language_code,
+            "encoder_output": encoder_output is not None,
+            "encoder_output_matches": encoded is not None and (features is None or torch.equal(encoded, features)),
+        })
+        # the text tells the chunks apart by their loudness, and the decodes by their beam size
+        return [
+            f"{tokenizer.language_code}:{float(f.max()):.3f}" + (f":{options.beam_size}" if options.beam_size else "")
+            for f in (features if features is not None else encoded)
+        ]
+
+
+def stub_vad(inputs):
+    # speech wherever a frame is not silent
+    waveform = inputs["waveform"][0].numpy()
+    step = 0.016875
+    num_frames = int(len(waveform) / SAMPLE_RATE / step)
+    starts = (np.arange(num_frames) * step * SAMPLE_RATE).astype(int)
+    frame = int(step * SAMPLE_RATE)
+    data = np.array([np.abs(waveform[start:start + frame]).max(initial=0.0) > 0.01 for start in starts], dtype=np.float32)
+    return SlidingWindowFeature(data[:, None], SlidingWindow(start=0.0, duration=0.0619, step=step))
+
+
+def speech(language: str, seconds: float = 30.0, seed: int = 0) -> np.ndarray:
+    # bursts of a pitch of the language with distinct loudness, separated by silence
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+    t = 0.5
+    while t < seconds - 1:
+        duration = rng.uniform(0.5, 4.0)
+        first, last = int(t * SAMPLE_RATE), int(min(t + duration, seconds) * SAMPLE_RATE)
+        time = np.arange(last - first) / SAMPLE_RATE
+        audio[first:last] = rng.uniform(0.1, 0.9) * np.sin(2 * np.pi * LANGUAGE_FREQUENCIES[language] * time)
+        t += duration + rng.uniform(0.2, 1.5)
+    return audio
+
+
+@pytest.fixture(autouse=True)
+def stub_tokenizer(monkeypatch):
+    monkeypatch.setattr(faster_whisper.tokenizer, "Tokenizer", StubTokenizer)
+
+
+def stub_pipeline(language=None, batch_size=4, **kwargs):
+    options = faster_whisper.transcribe.TranscriptionOptions(
+        **{field: None for field in faster_whisper.transcribe.TranscriptionOptions._fields}
+    )._replace(suppress_tokens=[-1])
+    return FasterWhisperPipeline(
+        model=StubWhisperModel(**kwargs),
+        vad=stub_vad,
+        vad_params={"vad_onset": 0.500, "vad_offset": 0.363},
+        options=options,
+        tokenizer=StubTokenizer(None, True, task="transcribe", language=language) if language else None,
+        language=language,
+        batch_size=batch_size,
+    )
+
+
+def speech_chunks(chunks, seed: int = 0):
+    # one burst of speech per (language, seconds), and the VAD chunks holding exactly one burst each
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int((sum(seconds + 0.5 for _, seconds in chunks) + 0.5) * SAMPLE_RATE), dtype=np.float32)
+    vad_segments = []
+    t = 0.5
+    for language, seconds in chunks:
+        first, last = int(t * SAMPLE_RATE), int((t + seconds) * SAMPLE_RATE)
+        time = np.arange(last - first) / SAMPLE_RATE
+        audio[first:last] = rng.uniform(0.1, 0.9) * np.sin(2 * np.pi * LANGUAGE_FREQUENCIES[language] * time)
+        vad_segments.append({"start": t, "end": t + seconds, "segments": [(t, t + seconds)]})
+        t += seconds + 0.5
+    return audio, vad_segments
+
+
+@pytest.mark.parametrize("language", ["en", "de"])
+@pytest.mark.parametrize("batch_size", [1, 4])
+def test_language_detection_reuses_encoder_output(monkeypatch, language, batch_size):
+    # the chunk with the most speech is decoded in the first batch
+    audio, vad_segments = speech_chunks([(language, 2.0)] * (batch_size - 1) + [(language, 5.0)] + [(language, 2.0)] * 6)
+    pipeline = stub_pipeline(batch_size=batch_size)
+    monkeypatch.setattr(pipeline, "detect_language", lambda audio: pytest.fail("detected on the first 30s"))
+    result = pipeline.transcribe(audio, vad_segments=vad_segments)
+    assert result["language"] == language
+    # one encoder run for detection, its output is decoded by exactly the first batch
+    assert pipeline.model.encoded == [batch_size]
+    assert [batch["encoder_output"] for batch in pipeline.model.batches] == [True] + [False] * (len(pipeline.model.batches) - 1)
+    assert pipeline.model.batches[0]["encoder_output_matches"]
+    assert pipeline.next_encoder_output is None
+    assert pipeline.tokenizer is None
+
+    # same transcript as with a known language
+    known = stub_pipeline(language=language, batch_size=batch_size)
+    assert known.transcribe(audio, vad_segments=vad_segments) == result
+    assert known.model.encoded == []
+
+
+@pytest.mark.parametrize("num_buckets", [0, 3])
+def test_language_detection_on_chunk_with_most_speech(num_buckets):
+    # a short first chunk of another language, the chunk with the most speech is not in the first batch
+    audio, vad_segments = speech_chunks([("en", 0.5)] + [("de", 2.0)] * 6 + [("de", 8.0)] + [("de", 1.0)] * 4)
+    pipeline = stub_pipeline(batch_size=4)
+    result = pipeline.transcribe(audio, vad_segments=vad_segments, num_buckets=num_buckets)
+    assert result["language"] == "de"
+    # the window is encoded on its own, the batches are decoded in their usual order without reuse
+    assert pipeline.model.encoded == [1]
+    assert not any(batch["encoder_output"] for batch in pipeline.model.batches)
+    assert [batch["size"] for batch in pipeline.model.batches] == [4, 4, 4]
+    known = stub_pipeline(language="de", batch_size=4)
+    assert known.transcribe(audio, vad_segments=vad_segments, num_buckets=num_buckets) == result
+
+
+@pytest.mark.parametrize("num_windows,expected", [(1, "de"), (2, "en"), (3, "en")])
+def test_language_detection_windows_majority(monkeypatch, num_windows, expected):
+    # the chunk with the most speech is German, most of the chunks with the most speech are English
+    audio, vad_segments = speech_chunks([("de", 1.0), ("en", 4.0), ("en", 5.0), ("de", 6.0)] + [("de", 1.0)] * 6)
+    pipeline = stub_pipeline(batch_size=4)
+    monkeypatch.setattr(pipeline, "detect_language", lambda audio: pytest.fail("detected on the first 30s"))
+    result = pipeline.transcribe(audio, vad_segments=vad_segments, language_detection_windows=num_windows)
+    assert result["language"] == expected
+    # the windows are in the first batch, which is encoded once for detection and decoded with that output
+    assert pipeline.model.encoded == [4]
+    assert [batch["encoder_output"] for batch in pipeline.model.batches] == [True, False, False]
+    assert pipeline.model.batches[0]["encoder_output_matches"]
+    assert pipeline.next_encoder_output is None
+    known = stub_pipeline(language=expected, batch_size=4)
+    assert known.transcribe(audio, vad_segments=vad_segments) == result
+
+
+def test_language_detection_windows_outside_first_batch():
+    audio, vad_segments = speech_chunks([("de", 1.0)] * 4 + [("en", 5.0), ("de", 4.0), ("en", 6.0)] + [("de", 1.0)] * 3)
+    pipeline = stub_pipeline(batch_size=4)
+    result = pipeline.transcribe(audio, vad_segments=vad_segments, language_detection_windows=3)
+    assert result["language"] == "en"
+    # only the windows are encoded, the batches are decoded in their usual order without reuse
+    assert pipeline.model.encoded == [3]
+    assert not any(batch["encoder_output"] for batch in pipeline.model.batches)
+    assert [batch["size"] for batch in pipeline.model.batches] == [4, 4, 2]
+    assert pipeline.next_encoder_output is None
+
+
+@pytest.mark.parametrize("languages", [("de", "en"), ("en", "de")])
+def test_language_detection_windows_tie(languages):
+    # one window per language, whatever their amount of speech the first window breaks the tie
+    first, second = languages
+    audio, vad_segments = speech_chunks([(first, 5.0), (second, 6.0)] + [("de", 1.0)] * 6)
+    pipeline = stub_pipeline(batch_size=4)
+    assert pipeline.transcribe(audio, vad_segments=vad_segments, language_detection_windows=2)["language"] == first
+    assert pipeline.model.encoded == [4]
+
+
+@pytest.mark.parametrize("language", [None, "de"])
+@pytest.mark.parametrize("bucket_by", ["duration", "tokens"])
+@pytest.mark.parametrize("num_buckets", [1, 2, 3, 8])
+def test_bucketed_transcribe_matches_unbucketed(language, bucket_by, num_buckets):
+    rng = np.random.default_rng(num_buckets)
+    audio, vad_segments = speech_chunks([("de", float(seconds)) for seconds in rng.uniform(0.5, 8.0, 13).round(1)])
+    if num_buckets > 1:
+        # the chunks are decoded out of their chronological order
+        assert bucket_segments(vad_segments, num_buckets, bucket_by=bucket_by) != list(range(len(vad_segments)))
+    expected = stub_pipeline(language=language).transcribe(audio, vad_segments=vad_segments)
+    pipeline = stub_pipeline(language=language)
+    result = pipeline.transcribe(audio, vad_segments=vad_segments, num_buckets=num_buckets, bucket_by=bucket_by)
+    # segments are back in chronological order, with the same text
+    assert result == expected
+    assert [batch["size"] for batch in pipeline.model.batches] == [4, 4, 4, 1]
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("outer_chunk_size,inner_chunk_size", [(5, 20), (30, 10), (30, 5)])
+def test_reused_vad_scores_match_second_pass(seed, outer_chunk_size, inner_chunk_size):
+    audio = speech("de", seconds=120.0, seed=seed)
+    pipeline = stub_pipeline()
+    reused = pipeline.get_vad_segments(audio, outer_chunk_size=outer_chunk_size, inner_chunk_size=inner_chunk_size, reuse_vad_scores=True)
+    second_pass = pipeline.get_vad_segments(audio, outer_chunk_size=outer_chunk_size, inner_chunk_size=inner_chunk_size)
+    # the frames of a second pass start at its outer chunk instead of the start of the audio, and their timestamps
+    # are the frame centers again, which shifts the chunks by less than a frame
+    frame = stub_vad({"waveform": torch.zeros(1, SAMPLE_RATE)}).sliding_window.duration
+    assert len(reused) == len(second_pass)
+    for chunk, expected in zip(reused, second_pass):
+        assert chunk["start"] == pytest.approx(expected["start"], abs=frame)
+        assert chunk["end"] == pytest.approx(expected["end"], abs=frame)
+        assert len(chunk["segments"]) == len(expected["segments"])
+
+
+class UnsupportedLanguageTokenizer(StubTokenizer):
+    def __init__(self, hf_tokenizer, multilingual, task=None, language=None):
+        raise ValueError(f"unsupported language {language}")
+
+
+@pytest.mark.parametrize("fail_on", ["tokenizer", "first batch", "second batch"])
+def test_language_detection_encoder_output_cleared_on_error(monkeypatch, fail_on):
+    audio, vad_segments = speech_chunks([("de", 5.0)] + [("de", 2.0)] * 7)
+    pipeline = stub_pipeline(fail_on_batch={"first batch": 0, "second batch": 1}.get(fail_on))
+    if fail_on == "tokenizer":
+        monkeypatch.setattr(faster_whisper.tokenizer, "Tokenizer", UnsupportedLanguageTokenizer)
+    with pytest.raises((ValueError, RuntimeError)):
+        pipeline.transcribe(audio, vad_segments=vad_segments)
+    assert pipeline.model.encoded == [4]
+    assert pipeline.next_encoder_output is None
+
+    # the next file does not decode with the encoder output of the failed one
+    monkeypatch.setattr(faster_whisper.tokenizer, "Tokenizer", StubTokenizer)
+    pipeline.model.fail_on_batch = None
+    pipeline.model.batches = []
+    audio, vad_segments = speech_chunks([("en", 2.0), ("en", 5.0)] + [("en", 2.0)] * 6, seed=1)
+    assert pipeline.transcribe(audio, vad_segments=vad_segments)["language"] == "en"
+    assert pipeline.model.batches[0]["encoder_output_matches"]
+
+
+def mixed_files():
+    # consecutive files of the same language, and a file without speech
+    return [
+        speech("en", 20.0, seed=0),
+        speech("en", 20.0, seed=1),
+        speech("de", 20.0, seed=2),
+        np.zeros(10 * SAMPLE_RATE, dtype=np.float32),
+        speech("en", 20.0, seed=3),
+        speech("de", 20.0, seed=4),
+    ]
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 16])
+def test_transcribe_many_matches_transcribe(batch_size):
+    audios = mixed_files()
+    pipeline = stub_pipeline(batch_size=batch_size)
+    results = list(pipeline.transcribe_many(audios))
+    # in input order, even though chunks of several files share batches
+    assert [idx for idx, _ in results] == list(range(len(audios)))
+    for audio, (_, result) in zip(audios, results):
+        assert result == stub_pipeline(batch_size=batch_size).transcribe(audio)
+    assert [result["language"] for _, result in results] == ["en", "en", "de", "en", "en", "de"]
+    assert results[3][1]["segments"] == []
+    assert pipeline.tokenizer is None
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 16])
+def test_transcribe_many_groups_languages(batch_size):
+    audios = mixed_files()
+    pipeline = stub_pipeline(batch_size=batch_size)
+    num_chunks = [len(pipeline.get_vad_segments(audio)) for audio in audios]
+    list(pipeline.transcribe_many(audios))
+    # runs of files with the same language share batches, the file without speech joins the run after it
+    expected = []
+    for language, files in [("en", [0, 1]), ("de", [2]), ("en", [3, 4]), ("de", [5])]:
+        chunks = sum(num_chunks[idx] for idx in files)
+        expected += [(language, min(batch_size, chunks - start)) for start in range(0, chunks, batch_size)]
+    assert [(batch["language"], batch["size"]) for batch in pipeline.model.batches] == expected
+
+
+def test_transcribe_many_streams_results():
+    audios = mixed_files()
+    loaded = []
+
+    def files():
+        for idx, audio in enumerate(audios):
+            loaded.append(idx)
+            yield audio
+
+    results = stub_pipeline(batch_size=4).transcribe_many(files())
+    idx, _ = next(results)
+    # the first file is done before the last one is even loaded
+    assert idx == 0 and len(loaded) < len(audios)
+    assert [idx for idx, _ in results] == list(range(1, len(audios)))
+
+
+def test_transcribe_many_known_language():
+    audios = mixed_files()
+    pipeline = stub_pipeline(language="de", batch_size=4)
+    results = list(pipeline.transcribe_many(audios))
+    assert all(result["language"] == "de" for _, result in results)
+    assert pipeline.model.encoded == []
+    # one run of files, so only the very last batch is not full
+    assert [batch["size"] for batch in pipeline.model.batches][:-1] == [4] * (len(pipeline.model.batches) - 1)
+    assert pipeline.tokenizer.language_code == "de"
+
+
+@pytest.mark.parametrize("language", [None, "de"])
+@pytest.mark.parametrize("spill", [False, True])
+def test_decode_sweep_encodes_once(tmp_path, language, spill):
+    audio = speech("de", seed=5)
+    pipeline = stub_pipeline(batch_size=4)
+    spill_dir = str(tmp_path / "encoder_outputs") if spill else None
+    sweep = DecodeSweep(pipeline, audio, batch_size=4, language=language, spill_dir=spill_dir)
+    assert sweep.language == "de"
+    batch_sizes = [min(4, len(sweep.segments) - start) for start in range(0, len(sweep.segments), 4)]
+    encoded = list(pipeline.model.encoded)
+    # every batch of chunks is encoded once, detection encodes the first batch once more
+    assert encoded == ([4] if language is None else []) + batch_sizes
+    if spill:
+        assert sorted(os.listdir(spill_dir)) == [f"encoder_output_{i:05d}.npy" for i in range(len(batch_sizes))]
+
+    option_sets = {"greedy": {"beam_size": 1}, "beam": {"beam_size": 5}}
+    results = {name: result for name, result, _ in sweep.run(option_sets)}
+    assert pipeline.model.encoded == encoded
+    assert all(batch["encoder_output_matches"] for batch in pipeline.model.batches)
+    for name, overrides in option_sets.items():
+        # the same transcript as decoding from scratch with these options
+        expected = stub_pipeline(language="de", batch_size=4)
+        expected.options = expected.options._replace(**overrides)
+        assert results[name] == expected.transcribe(audio)
+
+
+def test_vad_score_cache_chunk_size_sweep(tmp_path):
+    audio = speech("en", 60.0, seed=6)
+    pipeline = stub_pipeline(language="en")
+    calls = []
+    pipeline.vad_model = lambda inputs: calls.append(inputs["waveform"].shape[-1]) or stub_vad(inputs)
+    pipeline.vad_cache = VadScoreCache(str(tmp_path))
+    for outer_chunk_size, inner_chunk_size in [(30, 5), (20, 5), (10, 3), (30, 10)]:
+        segments = pipeline.get_vad_segments(audio, outer_chunk_size=outer_chunk_size, inner_chunk_size=inner_chunk_size)
+        # the same chunks as slicing the scores without a cache
+        uncached = stub_pipeline(language="en")
+        assert segments == uncached.get_vad_segments(audio, outer_chunk_size=outer_chunk_size, inner_chunk_size=inner_chunk_size, reuse_vad_scores=True)
+    # segmentation ran once, on the whole audio, which is the only cache entry
+    assert calls == [len(audio)]
+    assert sorted(os.listdir(tmp_path)) == [pipeline.vad_cache.key(audio) + ".json", pipeline.vad_cache.key(audio) + ".npy"]
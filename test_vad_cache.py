@@ -0,0 +1,149 @@
+import os
+import logging
+
+import pytest
+import numpy as np
+from pyannote.core import Segment, SlidingWindow, SlidingWindowFeature
+
+from whisperx.vad import VadScoreCache, crop_scores
+
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_vad_scores(num_frames: int = 1000, seed: int = 0) -> SlidingWindowFeature:
+    data = np.random.default_rng(seed).random((num_frames, 1)).astype(np.float32)
+    return SlidingWindowFeature(data, SlidingWindow(start=0.0, duration=0.0619, step=0.016875), labels=["speech"])
+
+
+def synthetic_audio(seconds: float = 5.0, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(int(seconds * 16000)).astype(np.float32)
+
+
+def test_vad_score_cache_roundtrip(tmp_path):
+    audio = synthetic_audio()
+    scores = synthetic_vad_scores()
+    cache = VadScoreCache(str(tmp_path))
+    assert cache.get(audio) is None
+    cache.put(audio, scores)
+
+    # a new process only has the files
+    cached = VadScoreCache(str(tmp_path)).get(audio)
+    assert isinstance(cached.data, np.memmap)
+    np.testing.assert_array_equal(cached.data, scores.data)
+    assert cached.sliding_window.start == scores.sliding_window.start
+    assert cached.sliding_window.duration == scores.sliding_window.duration
+    assert cached.sliding_window.step == scores.sliding_window.step
+    assert cached.labels == scores.labels
+
+    # other models and other audio miss
+    assert VadScoreCache(str(tmp_path), model_checksum="other").get(audio) is None
+    assert cache.get(audio[1:]) is None
+    assert sorted(os.listdir(tmp_path)) == [cache.key(audio) + ".json", cache.key(audio) + ".npy"]
+
+
+def test_vad_score_cache_evicts_least_recently_used(tmp_path):
+    audios = [synthetic_audio(seed=seed) for seed in range(4)]
+    scores = synthetic_vad_scores()
+    cache = VadScoreCache(str(tmp_path))
+    for i, audio in enumerate(audios[:3]):
+        cache.put(audio, scores)
+        # distinct modification times for the LRU order
+        os.utime(os.path.join(tmp_path, cache.key(audio) + ".npy"), (i, i))
+    # reading marks an entry as recently used
+    assert cache.get(audios[0]) is not None
+    entry_bytes = os.path.getsize(os.path.join(tmp_path, cache.key(audios[0]) + ".npy"))
+    cache.max_bytes = int(2.5 * entry_bytes)
+    cache.put(audios[3], scores)
+    assert [cache.get(audio) is not None for audio in audios] == [True, False, False, True]
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_vad_score_cache_scans_only_over_budget(tmp_path, monkeypatch):
+    scans = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: scans.append(path) or listdir(path))
+    scores = synthetic_vad_scores()
+    cache = VadScoreCache(str(tmp_path))
+    audios = [synthetic_audio(seed=seed) for seed in range(10)]
+    for audio in audios:
+        cache.put(audio, scores)
+    # the directory is scanned once to find its size, then the size is tracked
+    assert len(scans) == 1
+    entry_bytes = os.path.getsize(os.path.join(tmp_path, cache.key(audios[0]) + ".npy"))
+    cache.max_bytes = 10 * entry_bytes
+    cache.put(synthetic_audio(seed=10), scores)
+    assert len(scans) == 2
+    assert sum(cache.get(audio) is not None for audio in audios) == 9
+
+
+def test_vad_score_cache_unique_temporary_files(tmp_path, monkeypatch):
+    audio = synthetic_audio()
+    cache = VadScoreCache(str(tmp_path))
+    written = []
+    save = np.save
+    monkeypatch.setattr(np, "save", lambda file, arr: (written.append(file.name), save(file, arr)))
+    cache.put(audio, synthetic_vad_scores())
+    cache.put(audio, synthetic_vad_scores())
+    # every put writes its own temporary file in the cache directory, then moves it in place
+    assert len(set(written)) == 2
+    assert all(os.path.dirname(name) == str(tmp_path) and name.endswith(".tmp") for name in written)
+    assert sorted(os.listdir(tmp_path)) == [cache.key(audio) + ".json", cache.key(audio) + ".npy"]
+
+
+@pytest.mark.parametrize("evicted", ["scores", "utime"])
+def test_vad_score_cache_concurrent_eviction_is_a_miss(tmp_path, monkeypatch, evicted):
+    audio = synthetic_audio()
+    cache = VadScoreCache(str(tmp_path))
+    cache.put(audio, synthetic_vad_scores())
+    data_fp = os.path.join(tmp_path, cache.key(audio) + ".npy")
+    if evicted == "scores":
+        # removed after the json was written or read
+        os.remove(data_fp)
+    else:
+        # removed between loading the scores and marking them as used
+        def utime(path, *args, **kwargs):
+            raise FileNotFoundError(path)
+        monkeypatch.setattr(os, "utime", utime)
+    assert cache.get(audio) is None
+
+
+def cropped_frames(scores: SlidingWindowFeature, cropped: SlidingWindowFeature, start: float) -> range:
+    # frames of `scores` that `cropped` holds, from its shifted timestamps
+    frames = scores.sliding_window
+    first = round((cropped.sliding_window.start + start - frames.start) / frames.step)
+    return range(first, first + cropped.data.shape[0])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_crop_scores_matches_pyannote_crop(seed):
+    scores = synthetic_vad_scores(1000, seed=seed)
+    rng = np.random.default_rng(seed)
+    file_duration = 1000 * scores.sliding_window.step
+    for _ in range(20):
+        start, end = sorted(rng.uniform(0, file_duration, 2))
+        cropped = crop_scores(scores, start, end)
+        frames = cropped_frames(scores, cropped, start)
+        expected = scores.sliding_window.crop(Segment(start, end), mode="center")
+        # the same frames as pyannote, up to one at either end
+        assert abs(frames.start - expected[0]) <= 1
+        assert abs(frames.stop - 1 - expected[-1]) <= 1
+        np.testing.assert_array_equal(cropped.data, scores.data[frames.start:frames.stop])
+        # timestamps are relative to the start of the region
+        for i in [0, len(frames) - 1]:
+            assert cropped.sliding_window[i].start + start == pytest.approx(scores.sliding_window[frames[i]].start)
+        assert cropped.sliding_window.duration == scores.sliding_window.duration
+        assert cropped.labels == scores.labels
+
+
+@pytest.mark.parametrize("start,end", [(0.0, 1.0), (0.0, 100.0), (15.0, 100.0), (16.0, 17.0), (5.0, 5.0)])
+def test_crop_scores_edges(start, end):
+    scores = synthetic_vad_scores(1000)
+    cropped = crop_scores(scores, start, end)
+    frames = cropped_frames(scores, cropped, start)
+    # regions past the end of the scores are cut to the frames there are
+    expected = scores.sliding_window.crop(Segment(start, end), mode="center")
+    expected = expected[(expected >= 0) & (expected < 1000)]
+    assert frames.start >= 0 and frames.stop <= 1000
+    assert len(frames) >= len(expected) and len(frames) <= len(expected) + 2
+    np.testing.assert_array_equal(cropped.data, scores.data[frames.start:frames.stop])
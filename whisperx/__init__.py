@@ -1,4 +1,4 @@
 from .transcribe import load_model
-from .alignment import load_align_model, align
+from .alignment import load_align_model, align, align_stream
 from .audio import load_audio
 from .diarize import assign_word_speakers, DiarizationPipeline
\ No newline at end of file
@@ -2,17 +2,21 @@
 Forced Alignment with Whisper
 C. Max Bain
 """
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import Iterable, Union, List
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional, Union, List, Tuple
 
 import numpy as np
-import pandas as pd
 import torch
 import torchaudio
 from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 
 from .audio import SAMPLE_RATE, load_audio
-from .utils import interpolate_nans
+from .registry import MODEL_REGISTRY
+from .utils import interpolate_nans_array
 from .types import AlignedTranscriptionResult, SingleSegment, SingleAlignedSegment, SingleWordSegment
 import nltk
 from nltk.tokenize.punkt import PunktSentenceTokenizer, PunktParameters
@@ -58,7 +62,7 @@ DEFAULT_ALIGN_MODELS_HF = {
 }
 
 
-def load_align_model(language_code, device, model_name=None, model_dir=None):
+def load_align_model(language_code, device, model_name=None, model_dir=None, use_registry=False):
     if model_name is None:
         # use default model
         if language_code in DEFAULT_ALIGN_MODELS_TORCH:
@@ -70,6 +74,10 @@ def load_align_model(language_code, device, model_name=None, model_dir=None):
                 Please find a wav2vec2.0 model finetuned on this language in https://huggingface.co/models, then pass the model name in --align_model [MODEL_NAME]")
             raise ValueError(f"No default align-model for language: {language_code}")
 
+    if use_registry:
+        key = ("align", language_code, str(device), model_name, model_dir)
+        return MODEL_REGISTRY.get_or_load(key, lambda: load_align_model(language_code, device, model_name, model_dir))
+
     if model_name in torchaudio.pipelines.__all__:
         pipeline_type = "torchaudio"
         bundle = torchaudio.pipelines.__dict__[model_name]
@@ -94,6 +102,82 @@ def load_align_model(language_code, device, model_name=None, model_dir=None):
     return align_model, align_metadata
 
 
+@lru_cache(maxsize=None)
+def get_sentence_splitter() -> PunktSentenceTokenizer:
+    """The Punkt sentence splitter, built once per process."""
+    punkt_param = PunktParameters()
+    punkt_param.abbrev_types = set(PUNKT_ABBREVIATIONS)
+    return PunktSentenceTokenizer(punkt_param)
+
+
+@lru_cache(maxsize=None)
+def get_preprocess_pool(num_workers: int) -> ProcessPoolExecutor:
+    """
+    The process pool of `align(preprocess_workers=num_workers)`, started once per process and reused by every
+    later call, since each spawned worker imports whisperx again. Shut down at interpreter exit.
+    """
+    # forked workers would inherit the CUDA state of the alignment model, so start fresh interpreters
+    return ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class TextPreprocessor:
+    """
+    Phase 1 of `align` for one alignment model: keeps the characters (and words) of a segment's text that are in
+    the model dictionary and splits the text into sentences.
+    Every distinct character is looked up in the dictionary once and the sentence splitter is shared by the process,
+    the preprocessor itself is picklable to run in a process pool.
+    """
+
+    def __init__(self, model_dictionary: dict, model_lang: str):
+        self.model_lang = model_lang
+        self.dictionary_keys = frozenset(model_dictionary)
+        self._clean_chars = {}
+
+    def clean_char(self, char: str) -> Optional[str]:
+        """The dictionary key of `char`, None if it is not in the dictionary."""
+        if char not in self._clean_chars:
+            char_ = char.lower()
+            # wav2vec2 models use "|" character to represent spaces
+            if self.model_lang not in LANGUAGES_WITHOUT_SPACES:
+                char_ = char_.replace(" ", "|")
+            self._clean_chars[char] = char_ if char_ in self.dictionary_keys else None
+        return self._clean_chars[char]
+
+    def __call__(self, text: str) -> dict:
+        for char in set(text).difference(self._clean_chars):
+            self.clean_char(char)
+        clean_chars = self._clean_chars
+
+        # strip spaces at beginning / end, but keep track of the amount.
+        num_leading = len(text) - len(text.lstrip())
+        num_trailing = len(text) - len(text.rstrip())
+
+        # ignore whitespace at beginning and end of transcript
+        clean_cdx = [cdx for cdx in range(num_leading, len(text) - num_trailing) if clean_chars[text[cdx]] is not None]
+        clean_char = [clean_chars[text[cdx]] for cdx in clean_cdx]
+
+        # split into words
+        if self.model_lang not in LANGUAGES_WITHOUT_SPACES:
+            per_word = text.split(" ")
+        else:
+            per_word = text
+        clean_wdx = [wdx for wdx, wrd in enumerate(per_word) if not self.dictionary_keys.isdisjoint(wrd)]
+
+        sentence_splitter = get_sentence_splitter()
+        if any(char in text for char in sentence_splitter._lang_vars.sent_end_chars):
+            sentence_spans = list(sentence_splitter.span_tokenize(text))
+        else:
+            # a single sentence, skip the Punkt annotation passes
+            sentence_spans = [(0, len(text.rstrip()))] if text.strip() else []
+
+        return {
+            "clean_char": clean_char,
+            "clean_cdx": clean_cdx,
+            "clean_wdx": clean_wdx,
+            "sentence_spans": sentence_spans,
+        }
+
+
 def align(
     transcript: Iterable[SingleSegment],
     model: torch.nn.Module,
@@ -104,251 +188,494 @@ def align(
     return_char_alignments: bool = False,
     print_progress: bool = False,
     combined_progress: bool = False,
+    batch_size: int = 1,
+    align_kernel: str = "numpy",
+    emissions: Optional[np.ndarray] = None,
+    band_width: int = 250,
+    preprocess_workers: int = 0,
 ) -> AlignedTranscriptionResult:
     """
     Align phoneme recognition predictions to known transcription.
+    With `batch_size` > 1 the alignment model runs on batches of segments of similar length, see `get_emissions`.
+    `align_kernel` selects the forced alignment implementation, see `get_char_segments`, `band_width` (in frames)
+    only applies to the "banded" kernel.
+    `emissions` are whole-file emissions from `compute_file_emissions`, every segment then slices its frames from them
+    and neither `model` nor `audio` are used (both can be None).
+    `preprocess_workers` > 0 runs the text preprocessing of the segments in a process pool shared by all calls, see
+    `get_preprocess_pool` and `TextPreprocessor`.
     """
     
-    if not torch.is_tensor(audio):
-        if isinstance(audio, str):
-            audio = load_audio(audio)
-        audio = torch.from_numpy(audio)
-    if len(audio.shape) == 1:
-        audio = audio.unsqueeze(0)
-    
-    MAX_DURATION = audio.shape[1] / SAMPLE_RATE
-
+    audio, num_channels, max_duration = prepare_align_audio(audio, emissions)
     model_dictionary = align_model_metadata["dictionary"]
     model_lang = align_model_metadata["language"]
-    model_type = align_model_metadata["type"]
 
     # 1. Preprocess to keep only characters in dictionary
     total_segments = len(transcript)
-    for sdx, segment in enumerate(transcript):
-        # strip spaces at beginning / end, but keep track of the amount.
+    preprocessor = TextPreprocessor(model_dictionary, model_lang)
+    texts = [segment["text"] for segment in transcript]
+    if preprocess_workers > 0:
+        executor = get_preprocess_pool(preprocess_workers)
+        preprocessed = list(executor.map(preprocessor, texts, chunksize=max(1, len(texts) // (4 * preprocess_workers))))
+    else:
+        preprocessed = map(preprocessor, texts)
+    for sdx, (segment, clean) in enumerate(zip(transcript, preprocessed)):
         if print_progress:
             base_progress = ((sdx + 1) / total_segments) * 100
             percent_complete = (50 + base_progress / 2) if combined_progress else base_progress
             print(f"Progress: {percent_complete:.2f}%...")
-            
-        num_leading = len(segment["text"]) - len(segment["text"].lstrip())
-        num_trailing = len(segment["text"]) - len(segment["text"].rstrip())
-        text = segment["text"]
-
-        # split into words
-        if model_lang not in LANGUAGES_WITHOUT_SPACES:
-            per_word = text.split(" ")
-        else:
-            per_word = text
-
-        clean_char, clean_cdx = [], []
-        for cdx, char in enumerate(text):
-            char_ = char.lower()
-            # wav2vec2 models use "|" character to represent spaces
-            if model_lang not in LANGUAGES_WITHOUT_SPACES:
-                char_ = char_.replace(" ", "|")
-            
-            # ignore whitespace at beginning and end of transcript
-            if cdx < num_leading:
-                pass
-            elif cdx > len(text) - num_trailing - 1:
-                pass
-            elif char_ in model_dictionary.keys():
-                clean_char.append(char_)
-                clean_cdx.append(cdx)
-
-        clean_wdx = []
-        for wdx, wrd in enumerate(per_word):
-            if any([c in model_dictionary.keys() for c in wrd]):
-                clean_wdx.append(wdx)
-
-                
-        punkt_param = PunktParameters()
-        punkt_param.abbrev_types = set(PUNKT_ABBREVIATIONS)
-        sentence_splitter = PunktSentenceTokenizer(punkt_param)
-        sentence_spans = list(sentence_splitter.span_tokenize(text))
-
-        segment["clean_char"] = clean_char
-        segment["clean_cdx"] = clean_cdx
-        segment["clean_wdx"] = clean_wdx
-        segment["sentence_spans"] = sentence_spans
+        segment.update(clean)
     
+    # 2. Get prediction matrix from alignment model
+    segment_emissions = get_segment_emissions(
+        transcript, model, align_model_metadata["type"], audio, device, max_duration, batch_size=batch_size, emissions=emissions
+    )
+
+    # 3. Align
     aligned_segments: List[SingleAlignedSegment] = []
-    
-    # 2. Get prediction matrix from alignment model & align
     for sdx, segment in enumerate(transcript):
-        
-        t1 = segment["start"]
-        t2 = segment["end"]
-        text = segment["text"]
-
-        aligned_seg: SingleAlignedSegment = {
-            "start": t1,
-            "end": t2,
-            "text": text,
-            "words": [],
-        }
-
-        if return_char_alignments:
-            aligned_seg["chars"] = []
-
-        # check we can align
-        if len(segment["clean_char"]) == 0:
-            print(f'Failed to align segment ("{segment["text"]}"): no characters in this segment found in model dictionary, resorting to original...')
-            aligned_segments.append(aligned_seg)
-            continue
+        aligned_segments += align_segment(
+            segment,
+            segment_emissions.pop(sdx, None),
+            align_model_metadata,
+            num_channels,
+            max_duration,
+            interpolate_method=interpolate_method,
+            return_char_alignments=return_char_alignments,
+            align_kernel=align_kernel,
+            band_width=band_width,
+        )
 
-        if t1 >= MAX_DURATION:
-            print(f'Failed to align segment ("{segment["text"]}"): original start time longer than audio duration, skipping...')
-            aligned_segments.append(aligned_seg)
-            continue
+    # create word_segments list
+    word_segments: List[SingleWordSegment] = []
+    for segment in aligned_segments:
+        word_segments += segment["words"]
 
-        text_clean = "".join(segment["clean_char"])
-        tokens = [model_dictionary[c] for c in text_clean]
+    return {"segments": aligned_segments, "word_segments": word_segments}
 
-        f1 = int(t1 * SAMPLE_RATE)
-        f2 = int(t2 * SAMPLE_RATE)
+def align_stream(
+    transcript: Iterable[SingleSegment],
+    model: torch.nn.Module,
+    align_model_metadata: dict,
+    audio: Union[str, np.ndarray, torch.Tensor],
+    device: str,
+    interpolate_method: str = "nearest",
+    return_char_alignments: bool = False,
+    batch_size: int = 1,
+    align_kernel: str = "numpy",
+    emissions: Optional[np.ndarray] = None,
+    band_width: int = 250,
+) -> Iterator[SingleAlignedSegment]:
+    """
+    Streaming variant of `align`: consumes the segments as they are produced, e.g. by
+    `FasterWhisperPipeline.transcribe_stream`, and yields the aligned segments in order.
+    Segments are aligned `batch_size` at a time in order of arrival instead of sorted by length.
+    """
+    audio, num_channels, max_duration = prepare_align_audio(audio, emissions)
+    preprocessor = TextPreprocessor(align_model_metadata["dictionary"], align_model_metadata["language"])
 
-        # TODO: Probably can get some speedup gain with batched inference here
-        waveform_segment = audio[:, f1:f2]
-        # Handle the minimum input length for wav2vec2 models
-        if waveform_segment.shape[-1] < 400:
-            lengths = torch.as_tensor([waveform_segment.shape[-1]]).to(device)
-            waveform_segment = torch.nn.functional.pad(
-                waveform_segment, (0, 400 - waveform_segment.shape[-1])
+    def align_batch(batch):
+        segment_emissions = get_segment_emissions(
+            batch, model, align_model_metadata["type"], audio, device, max_duration, batch_size=batch_size, emissions=emissions
+        )
+        for sdx, segment in enumerate(batch):
+            yield from align_segment(
+                segment,
+                segment_emissions.pop(sdx, None),
+                align_model_metadata,
+                num_channels,
+                max_duration,
+                interpolate_method=interpolate_method,
+                return_char_alignments=return_char_alignments,
+                align_kernel=align_kernel,
+                band_width=band_width,
             )
-        else:
-            lengths = None
-            
-        with torch.inference_mode():
-            if model_type == "torchaudio":
-                emissions, _ = model(waveform_segment.to(device), lengths=lengths)
-            elif model_type == "huggingface":
-                emissions = model(waveform_segment.to(device)).logits
-            else:
-                raise NotImplementedError(f"Align model of type {model_type} not supported.")
-            emissions = torch.log_softmax(emissions, dim=-1)
-
-        emission = emissions[0].cpu().detach()
-
-        blank_id = 0
-        for char, code in model_dictionary.items():
-            if char == '[pad]' or char == '<pad>':
-                blank_id = code
 
-        trellis = get_trellis(emission, tokens, blank_id)
-        path = backtrack(trellis, emission, tokens, blank_id)
+    batch = []
+    for segment in transcript:
+        segment.update(preprocessor(segment["text"]))
+        batch.append(segment)
+        if len(batch) == batch_size:
+            yield from align_batch(batch)
+            batch = []
+    yield from align_batch(batch)
+
+def prepare_align_audio(
+    audio: Union[str, np.ndarray, torch.Tensor], emissions: Optional[np.ndarray] = None
+) -> Tuple[Optional[torch.Tensor], int, float]:
+    """The audio as a (channels, samples) tensor, its number of channels and its duration in seconds."""
+    if emissions is not None:
+        return None, 1, emission_frames_to_samples(len(emissions)) / SAMPLE_RATE
+    if not torch.is_tensor(audio):
+        if isinstance(audio, str):
+            audio = load_audio(audio)
+        audio = torch.from_numpy(audio)
+    if len(audio.shape) == 1:
+        audio = audio.unsqueeze(0)
+    return audio, audio.size(0), audio.shape[1] / SAMPLE_RATE
+
+def get_segment_emissions(
+    segments: List[SingleSegment],
+    model: torch.nn.Module,
+    model_type: str,
+    audio: Optional[torch.Tensor],
+    device: str,
+    max_duration: float,
+    batch_size: int = 1,
+    emissions: Optional[np.ndarray] = None,
+) -> dict:
+    """
+    Emissions of the preprocessed segments that can be aligned, by segment index.
+    Segments run through the model sorted by length, so that batches need little padding, or are sliced from the
+    whole-file `emissions`.
+    """
+    def segment_samples(segment):
+        return int(segment["start"] * SAMPLE_RATE), int(segment["end"] * SAMPLE_RATE)
+
+    alignable = [
+        sdx for sdx, segment in enumerate(segments)
+        if len(segment["clean_char"]) > 0 and segment["start"] < max_duration
+    ]
+    alignable.sort(key=lambda sdx: segment_samples(segments[sdx])[1] - segment_samples(segments[sdx])[0])
+    segment_emissions = {}
+    if emissions is not None:
+        for sdx in alignable:
+            segment_emissions[sdx] = slice_emissions(emissions, *segment_samples(segments[sdx]))
+    else:
+        for batch_start in range(0, len(alignable), batch_size):
+            batch = alignable[batch_start:batch_start + batch_size]
+            waveforms = []
+            for sdx in batch:
+                f1, f2 = segment_samples(segments[sdx])
+                waveforms.append(audio[0, f1:f2])
+            segment_emissions.update(zip(batch, get_emissions(model, model_type, waveforms, device)))
+    return segment_emissions
+
+def align_segment(
+    segment: SingleSegment,
+    emission: Optional[torch.Tensor],
+    align_model_metadata: dict,
+    num_channels: int,
+    max_duration: float,
+    interpolate_method: str = "nearest",
+    return_char_alignments: bool = False,
+    align_kernel: str = "numpy",
+    band_width: int = 250,
+) -> List[SingleAlignedSegment]:
+    """
+    Align one preprocessed segment given its emission, returns its sentences as aligned segments
+    (or the segment itself if it cannot be aligned).
+    """
+    model_dictionary = align_model_metadata["dictionary"]
+    t1 = segment["start"]
+    t2 = segment["end"]
+    text = segment["text"]
+
+    aligned_seg: SingleAlignedSegment = {
+        "start": t1,
+        "end": t2,
+        "text": text,
+        "words": [],
+    }
+
+    if return_char_alignments:
+        aligned_seg["chars"] = []
+
+    # check we can align
+    if len(segment["clean_char"]) == 0:
+        print(f'Failed to align segment ("{segment["text"]}"): no characters in this segment found in model dictionary, resorting to original...')
+        return [aligned_seg]
+
+    if t1 >= max_duration:
+        print(f'Failed to align segment ("{segment["text"]}"): original start time longer than audio duration, skipping...')
+        return [aligned_seg]
+
+    text_clean = "".join(segment["clean_char"])
+    tokens = [model_dictionary[c] for c in text_clean]
+
+    blank_id = 0
+    for char, code in model_dictionary.items():
+        if char == '[pad]' or char == '<pad>':
+            blank_id = code
+
+    char_segments = get_char_segments(emission, tokens, text_clean, blank_id, kernel=align_kernel, band_width=band_width)
+
+    if char_segments is None:
+        print(f'Failed to align segment ("{segment["text"]}"): backtrack failed, resorting to original...')
+        return [aligned_seg]
+
+    duration = t2 -t1
+    ratio = duration * num_channels / emission.size(0)
+
+    # assign timestamps to aligned characters
+    char_starts = np.full(len(text), np.nan)
+    char_ends = np.full(len(text), np.nan)
+    char_scores = np.full(len(text), np.nan)
+    for cdx, char_seg in zip(segment["clean_cdx"], char_segments):
+        char_starts[cdx] = round(char_seg.start * ratio + t1, 3)
+        char_ends[cdx] = round(char_seg.end * ratio + t1, 3)
+        char_scores[cdx] = round(char_seg.score, 3)
+
+    return get_aligned_subsegments(
+        text,
+        char_starts,
+        char_ends,
+        char_scores,
+        segment["sentence_spans"],
+        align_model_metadata["language"],
+        interpolate_method=interpolate_method,
+        return_char_alignments=return_char_alignments,
+    )
+
+def uses_group_norm(model: torch.nn.Module) -> bool:
+    """
+    Whether the feature extractor of the wav2vec2 model normalizes with group norm, like the default torchaudio
+    `WAV2VEC2_ASR_BASE_960H` and the wav2vec2-base huggingface models. Group norm normalizes over all frames of the
+    input, so zero padding changes the emissions of the whole waveform and neither `lengths` nor attention masks help.
+    """
+    return any(isinstance(module, torch.nn.GroupNorm) for module in model.modules())
 
-        if path is None:
-            print(f'Failed to align segment ("{segment["text"]}"): backtrack failed, resorting to original...')
-            aligned_segments.append(aligned_seg)
+def get_emissions(
+    model: torch.nn.Module,
+    model_type: str,
+    waveforms: List[torch.Tensor],
+    device: str,
+) -> List[torch.Tensor]:
+    """
+    Log-softmax emissions of a batch of mono waveforms in one forward pass, split back to the frames of every waveform.
+    The waveforms are zero-padded to the longest one (and to the 400 samples wav2vec2 models need at least), passing
+    the true `lengths` to torchaudio models and an attention mask to huggingface models normalizing with layer norm.
+    Models normalizing with group norm (see `uses_group_norm`) would see the padding, their waveforms run one by one
+    unless they all have the same length.
+    """
+    lengths = torch.as_tensor([waveform.shape[-1] for waveform in waveforms])
+    max_length = max(int(lengths.max()), 400)
+    padded = bool((lengths < max_length).any())
+    if padded and len(waveforms) > 1 and uses_group_norm(model):
+        return [emission for waveform in waveforms for emission in get_emissions(model, model_type, [waveform], device)]
+    batch = torch.zeros((len(waveforms), max_length), dtype=waveforms[0].dtype)
+    for i, waveform in enumerate(waveforms):
+        batch[i, :waveform.shape[-1]] = waveform
+
+    with torch.inference_mode():
+        if model_type == "torchaudio":
+            emissions, num_frames = model(batch.to(device), lengths=lengths.to(device) if padded else None)
+        elif model_type == "huggingface":
+            attention_mask = None
+            if padded and getattr(model.config, "feat_extract_norm", None) == "layer":
+                attention_mask = (torch.arange(max_length)[None, :] < lengths[:, None]).long().to(device)
+            emissions = model(batch.to(device), attention_mask=attention_mask).logits
+            num_frames = model._get_feat_extract_output_lengths(lengths) if padded else None
+        else:
+            raise NotImplementedError(f"Align model of type {model_type} not supported.")
+        emissions = torch.log_softmax(emissions, dim=-1).cpu()
+
+    if num_frames is None:
+        return list(emissions)
+    # waveforms shorter than the receptive field still get the one frame of their padded input
+    num_frames = num_frames.cpu().clamp(min=1, max=emissions.shape[1])
+    return [emission[:n] for emission, n in zip(emissions, num_frames.tolist())]
+
+def get_aligned_subsegments(
+    text: str,
+    char_starts: np.ndarray,
+    char_ends: np.ndarray,
+    char_scores: np.ndarray,
+    sentence_spans: List[Tuple[int, int]],
+    model_lang: str,
+    interpolate_method: str = "nearest",
+    return_char_alignments: bool = False,
+) -> List[SingleAlignedSegment]:
+    """
+    Split an aligned segment into sentences with word (and char) timestamps.
+    `char_starts`, `char_ends` and `char_scores` hold one value per character of `text`, NaN for characters that
+    could not be aligned. Sentences without timestamps are interpolated from their neighbours and sentences
+    ending up with the same timestamps are merged.
+    """
+    num_chars = len(text)
+    is_space = np.fromiter((char == " " for char in text), dtype=bool, count=num_chars)
+    # a character belongs to the word after the last space before it, nltk word tokenization would probably be more robust here
+    if model_lang in LANGUAGES_WITHOUT_SPACES:
+        word_idx = np.arange(num_chars)
+    else:
+        word_idx = np.concatenate(([0], np.cumsum(is_space[1:])))
+    # dont use space character for alignment
+    word_starts = np.where(is_space, np.nan, char_starts)
+    word_ends = np.where(is_space, np.nan, char_ends)
+    scored = ~(is_space | np.isnan(char_scores))
+    zeroed_scores = np.where(scored, char_scores, 0)
+
+    # character indices of all sentences back to back, the character at `send` is part of the sentence as well
+    spans = np.asarray(sentence_spans, dtype=np.int64).reshape(-1, 2)
+    sentence_lo = spans[:, 0]
+    sentence_hi = np.minimum(spans[:, 1] + 1, num_chars)
+    offsets = np.concatenate(([0], np.cumsum(sentence_hi - sentence_lo)))
+    chars = np.repeat(sentence_lo - offsets[:-1], sentence_hi - sentence_lo) + np.arange(offsets[-1])
+    sentence_starts = np.fmin.reduceat(char_starts[chars], offsets[:-1])
+    sentence_ends = np.fmax.reduceat(word_ends[chars], offsets[:-1])
+
+    # words cut at sentence boundaries
+    is_word_start = np.ones(len(chars), dtype=bool)
+    is_word_start[1:] = word_idx[chars[1:]] != word_idx[chars[:-1]]
+    is_word_start[offsets[:-1]] = True
+    bounds = np.flatnonzero(is_word_start)
+    starts = np.fmin.reduceat(word_starts[chars], bounds).tolist()
+    ends = np.fmax.reduceat(word_ends[chars], bounds).tolist()
+    score_counts = np.add.reduceat(scored[chars], bounds).tolist()
+    word_sentence = (np.searchsorted(offsets, bounds, side="right") - 1).tolist()
+    word_lo = chars[bounds].tolist()
+    word_hi = (chars[np.append(bounds[1:], len(chars)) - 1] + 1).tolist()
+
+    sentence_words = [[] for _ in sentence_spans]
+    scored_words, score_means = [], []
+    for sdx, lo, hi, start, end, score_count in zip(word_sentence, word_lo, word_hi, starts, ends, score_counts):
+        word_text = text[lo:hi].strip()
+        if len(word_text) == 0:
             continue
+        word_segment = {"word": word_text}
+        if not math.isnan(start):
+            word_segment["start"] = start
+        if not math.isnan(end):
+            word_segment["end"] = end
+        if score_count > 0:
+            # a space can only be the first character of a word, sum the rest like pandas' mean does
+            scored_words.append(word_segment)
+            score_means.append(zeroed_scores[lo + int(is_space[lo]):hi].sum() / score_count)
+        sentence_words[sdx].append(word_segment)
+    for word_segment, score in zip(scored_words, np.round(score_means, 3).tolist()):
+        word_segment["score"] = score
+
+    subsegments = [
+        {"text": text[sstart:send], "words": words}
+        for (sstart, send), words in zip(sentence_spans, sentence_words)
+    ]
+    if return_char_alignments:
+        char_alignments = []
+        for char, start, end, score in zip(text, char_starts.tolist(), char_ends.tolist(), char_scores.tolist()):
+            char_alignment = {"char": char}
+            if not math.isnan(start):
+                char_alignment["start"] = start
+            if not math.isnan(end):
+                char_alignment["end"] = end
+            if not math.isnan(score):
+                char_alignment["score"] = score
+            char_alignments.append(char_alignment)
+        for subsegment, lo, hi in zip(subsegments, sentence_lo.tolist(), sentence_hi.tolist()):
+            subsegment["chars"] = char_alignments[lo:hi]
+
+    sentence_starts = interpolate_nans_array(sentence_starts, method=interpolate_method)
+    sentence_ends = interpolate_nans_array(sentence_ends, method=interpolate_method)
+
+    # concatenate sentences with same timestamps, in timestamp order, dropping those still without timestamps
+    groups = {}
+    for subsegment, start, end in zip(subsegments, sentence_starts.tolist(), sentence_ends.tolist()):
+        if not (math.isnan(start) or math.isnan(end)):
+            groups.setdefault((start, end), []).append(subsegment)
+    separator = "" if model_lang in LANGUAGES_WITHOUT_SPACES else " "
+    aligned_subsegments = []
+    for (start, end), group in sorted(groups.items(), key=lambda item: item[0]):
+        aligned_subsegment = {
+            "start": start,
+            "end": end,
+            "text": separator.join(subsegment["text"] for subsegment in group),
+            "words": [word for subsegment in group for word in subsegment["words"]],
+        }
+        if return_char_alignments:
+            aligned_subsegment["chars"] = [char for subsegment in group for char in subsegment["chars"]]
+        aligned_subsegments.append(aligned_subsegment)
+    return aligned_subsegments
 
-        char_segments = merge_repeats(path, text_clean)
-
-        duration = t2 -t1
-        ratio = duration * waveform_segment.size(0) / (trellis.size(0) - 1)
-
-        # assign timestamps to aligned characters
-        char_segments_arr = []
-        word_idx = 0
-        for cdx, char in enumerate(text):
-            start, end, score = None, None, None
-            if cdx in segment["clean_cdx"]:
-                char_seg = char_segments[segment["clean_cdx"].index(cdx)]
-                start = round(char_seg.start * ratio + t1, 3)
-                end = round(char_seg.end * ratio + t1, 3)
-                score = round(char_seg.score, 3)
-
-            char_segments_arr.append(
-                {
-                    "char": char,
-                    "start": start,
-                    "end": end,
-                    "score": score,
-                    "word-idx": word_idx,
-                }
-            )
+# wav2vec2 feature encoders emit one frame per 320 samples (20ms) with a 400 samples receptive field
+EMISSION_FRAME_STRIDE = 320
+EMISSION_RECEPTIVE_FIELD = 400
 
-            # increment word_idx, nltk word tokenization would probably be more robust here, but us space for now...
-            if model_lang in LANGUAGES_WITHOUT_SPACES:
-                word_idx += 1
-            elif cdx == len(text) - 1 or text[cdx+1] == " ":
-                word_idx += 1
-            
-        char_segments_arr = pd.DataFrame(char_segments_arr)
-
-        aligned_subsegments = []
-        # assign sentence_idx to each character index
-        char_segments_arr["sentence-idx"] = None
-        for sdx, (sstart, send) in enumerate(segment["sentence_spans"]):
-            curr_chars = char_segments_arr.loc[(char_segments_arr.index >= sstart) & (char_segments_arr.index <= send)]
-            char_segments_arr.loc[(char_segments_arr.index >= sstart) & (char_segments_arr.index <= send), "sentence-idx"] = sdx
-        
-            sentence_text = text[sstart:send]
-            sentence_start = curr_chars["start"].min()
-            end_chars = curr_chars[curr_chars["char"] != ' ']
-            sentence_end = end_chars["end"].max()
-            sentence_words = []
-
-            for word_idx in curr_chars["word-idx"].unique():
-                word_chars = curr_chars.loc[curr_chars["word-idx"] == word_idx]
-                word_text = "".join(word_chars["char"].tolist()).strip()
-                if len(word_text) == 0:
-                    continue
-
-                # dont use space character for alignment
-                word_chars = word_chars[word_chars["char"] != " "]
-
-                word_start = word_chars["start"].min()
-                word_end = word_chars["end"].max()
-                word_score = round(word_chars["score"].mean(), 3)
-
-                # -1 indicates unalignable 
-                word_segment = {"word": word_text}
-
-                if not np.isnan(word_start):
-                    word_segment["start"] = word_start
-                if not np.isnan(word_end):
-                    word_segment["end"] = word_end
-                if not np.isnan(word_score):
-                    word_segment["score"] = word_score
-
-                sentence_words.append(word_segment)
-            
-            aligned_subsegments.append({
-                "text": sentence_text,
-                "start": sentence_start,
-                "end": sentence_end,
-                "words": sentence_words,
-            })
-
-            if return_char_alignments:
-                curr_chars = curr_chars[["char", "start", "end", "score"]]
-                curr_chars.fillna(-1, inplace=True)
-                curr_chars = curr_chars.to_dict("records")
-                curr_chars = [{key: val for key, val in char.items() if val != -1} for char in curr_chars]
-                aligned_subsegments[-1]["chars"] = curr_chars
-
-        aligned_subsegments = pd.DataFrame(aligned_subsegments)
-        aligned_subsegments["start"] = interpolate_nans(aligned_subsegments["start"], method=interpolate_method)
-        aligned_subsegments["end"] = interpolate_nans(aligned_subsegments["end"], method=interpolate_method)
-        # concatenate sentences with same timestamps
-        agg_dict = {"text": " ".join, "words": "sum"}
-        if model_lang in LANGUAGES_WITHOUT_SPACES:
-            agg_dict["text"] = "".join
-        if return_char_alignments:
-            agg_dict["chars"] = "sum"
-        aligned_subsegments= aligned_subsegments.groupby(["start", "end"], as_index=False).agg(agg_dict)
-        aligned_subsegments = aligned_subsegments.to_dict('records')
-        aligned_segments += aligned_subsegments
+def emission_frames_to_samples(num_frames: int) -> int:
+    return (num_frames - 1) * EMISSION_FRAME_STRIDE + EMISSION_RECEPTIVE_FIELD
 
-    # create word_segments list
-    word_segments: List[SingleWordSegment] = []
-    for segment in aligned_segments:
-        word_segments += segment["words"]
+def samples_to_emission_frames(num_samples: int) -> int:
+    return max(1, (num_samples - EMISSION_RECEPTIVE_FIELD) // EMISSION_FRAME_STRIDE + 1)
 
-    return {"segments": aligned_segments, "word_segments": word_segments}
+def compute_file_emissions(
+    model: torch.nn.Module,
+    align_model_metadata: dict,
+    audio: Union[str, np.ndarray, torch.Tensor],
+    device: str,
+    path: Optional[str] = None,
+    segments: Optional[Iterable[SingleSegment]] = None,
+    window_seconds: float = 30.0,
+    context_seconds: float = 1.0,
+    batch_size: int = 1,
+) -> np.ndarray:
+    """
+    Log-softmax emissions of the whole file, a frames x vocab array for `align(..., emissions=...)`.
+    The audio is encoded in windows of `window_seconds` with `context_seconds` of extra audio on both sides,
+    keeping only the frames of each window's core so that every frame sees some context.
+    With `path` the emissions are written to a memory-mapped `.npy` file, which `load_file_emissions` opens again
+    to re-align without the model. With `segments` only the frames covering them are computed, the others stay 0.
+    """
+    if not torch.is_tensor(audio):
+        if isinstance(audio, str):
+            audio = load_audio(audio)
+        audio = torch.from_numpy(audio)
+    if len(audio.shape) == 1:
+        audio = audio.unsqueeze(0)
+    num_samples = audio.shape[1]
+    num_frames = samples_to_emission_frames(num_samples)
+
+    # frame ranges to compute, merged so that adjacent segments share windows
+    if segments is None:
+        regions = [[0, num_frames]]
+    else:
+        regions = []
+        for start, end in sorted((segment["start"], segment["end"]) for segment in segments):
+            f1 = min(max(int(start * SAMPLE_RATE) // EMISSION_FRAME_STRIDE, 0), num_frames)
+            f2 = min(samples_to_emission_frames(int(end * SAMPLE_RATE)) + 1, num_frames)
+            if regions and f1 <= regions[-1][1]:
+                regions[-1][1] = max(regions[-1][1], f2)
+            elif f1 < f2:
+                regions.append([f1, f2])
+        if not regions:
+            # nothing to align, one frame still gives the vocab size
+            regions = [[0, 1]]
+
+    window_frames = max(int(window_seconds * SAMPLE_RATE) // EMISSION_FRAME_STRIDE, 1)
+    context_frames = int(context_seconds * SAMPLE_RATE) // EMISSION_FRAME_STRIDE
+    windows = [
+        (core_start, min(core_start + window_frames, region_end))
+        for region_start, region_end in regions
+        for core_start in range(region_start, region_end, window_frames)
+    ]
+
+    emissions = None
+    for batch_start in range(0, len(windows), batch_size):
+        batch = windows[batch_start:batch_start + batch_size]
+        waveforms, offsets = [], []
+        for core_start, core_end in batch:
+            window_start = max(core_start - context_frames, 0)
+            window_end = min(core_end + context_frames, num_frames)
+            waveforms.append(audio[0, window_start * EMISSION_FRAME_STRIDE:emission_frames_to_samples(window_end)])
+            offsets.append(window_start)
+        for (core_start, core_end), offset, window_emission in zip(batch, offsets, get_emissions(model, align_model_metadata["type"], waveforms, device)):
+            if emissions is None:
+                shape = (num_frames, window_emission.shape[-1])
+                if path is not None:
+                    emissions = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+                else:
+                    emissions = np.zeros(shape, dtype=np.float32)
+            emissions[core_start:core_end] = window_emission[core_start - offset:core_end - offset].numpy()
+
+    if path is not None:
+        emissions.flush()
+    return emissions
+
+def load_file_emissions(path: str) -> np.ndarray:
+    """Open emissions saved by `compute_file_emissions` without reading them into memory."""
+    return np.load(path, mmap_mode="r")
+
+def slice_emissions(emissions: np.ndarray, f1: int, f2: int) -> torch.Tensor:
+    """Emission frames of the samples `f1:f2`, the frames a model run on just those samples would emit."""
+    start = min(-(-f1 // EMISSION_FRAME_STRIDE), len(emissions) - 1)
+    num_frames = samples_to_emission_frames(f2 - start * EMISSION_FRAME_STRIDE)
+    return torch.from_numpy(np.array(emissions[start:start + num_frames], dtype=np.float32))
 
 """
 source: https://pytorch.org/tutorials/intermediate/forced_alignment_with_torchaudio_tutorial.html
@@ -417,6 +744,150 @@ def backtrack(trellis, emission, tokens, blank_id=0):
         return None
     return path[::-1]
 
+def get_trellis_numpy(emission, tokens, blank_id=0):
+    """`get_trellis` filling one frame per step from precomputed emission columns, with the same float32 results."""
+    num_frame = emission.size(0)
+    num_tokens = len(tokens)
+
+    blank_emission = emission[:, blank_id].numpy()
+    token_emission = emission[:, tokens].numpy()
+    trellis = np.empty((num_frame + 1, num_tokens + 1), dtype=np.float32)
+    trellis[0, 0] = 0
+    trellis[1:, 0] = torch.cumsum(emission[:, 0], 0).numpy()
+    trellis[0, -num_tokens:] = -np.inf
+    trellis[-num_tokens:, 0] = np.inf
+
+    for t in range(num_frame):
+        np.maximum(trellis[t, 1:] + blank_emission[t], trellis[t, :-1] + token_emission[t], out=trellis[t + 1, 1:])
+    return trellis
+
+def backtrack_numpy(trellis, emission, tokens, blank_id=0):
+    """
+    `backtrack` on a NumPy trellis. The stay/change decisions of all cells are compared at once, the walk back
+    only reads them and stores the path in preallocated int arrays.
+    Returns `(token_index, time_index, score)` arrays in path order, or None if the backtrack failed.
+    """
+    j = trellis.shape[1] - 1
+    t_start = int(np.argmax(trellis[:, j]))
+
+    blank_emission = emission[:, blank_id].numpy()
+    token_emission = emission[:, tokens].numpy()
+    changed = trellis[:-1, :-1] + token_emission > trellis[:-1, 1:] + blank_emission[:, None]
+
+    token_index = np.empty(t_start, dtype=np.int64)
+    time_index = np.empty(t_start, dtype=np.int64)
+    changed_path = np.empty(t_start, dtype=bool)
+    length = 0
+    for t in range(t_start, 0, -1):
+        change = changed[t - 1, j - 1]
+        token_index[length] = j - 1
+        time_index[length] = t - 1
+        changed_path[length] = change
+        length += 1
+        if change:
+            j -= 1
+            if j == 0:
+                break
+    else:
+        # failed
+        return None
+
+    return path_scores(emission, tokens, token_index[:length][::-1], time_index[:length][::-1], changed_path[:length][::-1])
+
+def path_scores(emission, tokens, token_index, time_index, changed_path):
+    """Frame-wise probabilities of a backtracked path: the token's when it changed, the first class' when it stayed."""
+    emission_index = np.where(changed_path, np.asarray(tokens)[token_index], 0)
+    score = emission[torch.from_numpy(time_index.copy()), torch.from_numpy(emission_index)].exp().double().numpy()
+    return token_index, time_index, score
+
+def get_band(num_frame, num_tokens, band_width):
+    """
+    Token range `[band_start[t], band_end[t])` of every trellis row `t`: the tokens whose linear time prior,
+    token `j` at frame `j * num_frame / num_tokens`, lies within `band_width` frames of `t`.
+    """
+    t = np.arange(num_frame + 1)
+    band_start = np.clip(np.ceil((t - band_width) * num_tokens / num_frame), 0, num_tokens).astype(np.int64)
+    band_end = np.clip(np.floor((t + band_width) * num_tokens / num_frame) + 1, 1, num_tokens + 1).astype(np.int64)
+    return band_start, np.maximum(band_end, band_start)
+
+def get_trellis_banded(emission, tokens, band_start, band_end, blank_id=0):
+    """
+    `get_trellis_numpy` restricted to the band of every row. Row `t` only stores the tokens
+    `band_start[t]:band_start[t] + band_size`, cells outside of `[band_start[t], band_end[t])` are -inf,
+    so memory scales with `num_frame * band_size` instead of `num_frame * num_tokens`.
+    """
+    num_frame = emission.size(0)
+    num_tokens = len(tokens)
+    band_size = int((band_end - band_start).max())
+
+    blank_emission = emission[:, blank_id].numpy()
+    emission_np = emission.numpy()
+    # token j - 1 of every band cell j, padded so that the cells before the first / after the last token index too
+    padded_tokens = np.concatenate(([tokens[0]], tokens, np.full(band_size, tokens[-1])))
+    sos = np.empty(num_frame + 1, dtype=np.float32)
+    sos[0] = 0
+    sos[1:] = torch.cumsum(emission[:, 0], 0).numpy()
+    sos[-num_tokens:] = np.inf
+
+    trellis = np.full((num_frame + 1, band_size), -np.inf, dtype=np.float32)
+    trellis[0, 0] = 0
+    # previous row with one -inf cell in front (token j - 1 of the first token) and enough behind for the band shift
+    previous = np.full(band_size + 2 + int(np.diff(band_start).max(initial=0)), -np.inf, dtype=np.float32)
+    offsets = np.arange(band_size)
+    for t in range(num_frame):
+        previous[1:band_size + 1] = trellis[t]
+        shift = band_start[t + 1] - band_start[t]
+        row = trellis[t + 1]
+        np.maximum(
+            # Score for staying at the same token
+            previous[shift + 1:shift + 1 + band_size] + blank_emission[t],
+            # Score for changing to the next token
+            previous[shift:shift + band_size] + emission_np[t, padded_tokens[band_start[t + 1] + offsets]],
+            out=row,
+        )
+        row[band_end[t + 1] - band_start[t + 1]:] = -np.inf
+        if band_start[t + 1] == 0:
+            row[0] = sos[t + 1]
+    return trellis
+
+def backtrack_banded(trellis, emission, tokens, band_start, band_end, blank_id=0):
+    """`backtrack_numpy` on a banded trellis, returns None if no path within the band reaches the start."""
+    num_tokens = len(tokens)
+    band_size = trellis.shape[1]
+
+    def cell(t, j):
+        if band_start[t] <= j < band_end[t]:
+            return trellis[t, j - band_start[t]]
+        return -np.inf
+
+    last = num_tokens - band_start
+    in_band = (band_start <= num_tokens) & (num_tokens < band_end)
+    t_start = int(np.argmax(np.where(in_band, trellis[np.arange(len(trellis)), np.clip(last, 0, band_size - 1)], -np.inf)))
+
+    blank_emission = emission[:, blank_id].numpy()
+    emission_np = emission.numpy()
+    token_index = np.empty(t_start, dtype=np.int64)
+    time_index = np.empty(t_start, dtype=np.int64)
+    changed_path = np.empty(t_start, dtype=bool)
+    j = num_tokens
+    length = 0
+    for t in range(t_start, 0, -1):
+        stayed = cell(t - 1, j) + blank_emission[t - 1]
+        changed = cell(t - 1, j - 1) + emission_np[t - 1, tokens[j - 1]]
+        change = changed > stayed
+        token_index[length] = j - 1
+        time_index[length] = t - 1
+        changed_path[length] = change
+        length += 1
+        if change:
+            j -= 1
+            if j == 0:
+                break
+    else:
+        # failed
+        return None
+    return path_scores(emission, tokens, token_index[:length][::-1], time_index[:length][::-1], changed_path[:length][::-1])
+
 # Merge the labels
 @dataclass
 class Segment:
@@ -450,6 +921,71 @@ def merge_repeats(path, transcript):
         i1 = i2
     return segments
 
+def merge_repeats_numpy(token_index, time_index, score, transcript):
+    """`merge_repeats` on the arrays returned by `backtrack_numpy`."""
+    starts = np.flatnonzero(np.diff(token_index, prepend=-1))
+    ends = np.append(starts[1:], len(token_index))
+    scores = np.add.reduceat(score, starts) / (ends - starts)
+    return [
+        Segment(transcript[token_index[i1]], int(time_index[i1]), int(time_index[i2 - 1]) + 1, float(segment_score))
+        for i1, i2, segment_score in zip(starts, ends, scores)
+    ]
+
+def forced_align_torchaudio(emission, tokens, transcript, blank_id=0):
+    """
+    Standard CTC forced alignment with `torchaudio.functional.forced_align`. Unlike the trellis above, characters
+    only span the frames emitting them (blank frames are not attributed to the previous character) and repeated
+    characters need a blank frame in between, so the timestamps differ slightly from the other kernels.
+    Returns None if the emission is too short for the transcript.
+    """
+    num_repeats = sum(token == next_token for token, next_token in zip(tokens, tokens[1:]))
+    if emission.size(0) < len(tokens) + num_repeats:
+        return None
+    targets = torch.as_tensor([tokens], dtype=torch.int32)
+    labels, scores = torchaudio.functional.forced_align(emission[None].float(), targets, blank=blank_id)
+    spans = torchaudio.functional.merge_tokens(labels[0], scores[0].exp(), blank=blank_id)
+    return [Segment(transcript[i], span.start, span.end, span.score) for i, span in enumerate(spans)]
+
+ALIGN_KERNELS = ["python", "numpy", "torchaudio", "banded"]
+
+def get_char_segments(emission, tokens, transcript, blank_id=0, kernel="numpy", band_width=250):
+    """
+    Forced alignment of `tokens` to the frames of `emission`, returning the `merge_repeats` segments of the
+    characters in `transcript` or None if the alignment failed.
+
+    kernel:
+        "python": the original `get_trellis`/`backtrack`/`merge_repeats`.
+        "numpy": the same algorithm on NumPy arrays, with identical results.
+        "torchaudio": `forced_align_torchaudio`, falls back to "numpy" where `forced_align` is not available
+            (torchaudio < 2.1) or the blank token is part of the transcript.
+        "banded": the numpy algorithm with every token restricted to `band_width` frames around its linear time
+            prior, see `get_band`. The band is doubled until the backtrack succeeds. Same results as "numpy"
+            whenever the best path stays within the band, with memory linear in the segment length.
+    """
+    if kernel not in ALIGN_KERNELS:
+        raise ValueError(f"Unknown align kernel {kernel}, choose one of {ALIGN_KERNELS}")
+    if kernel == "torchaudio" and (not hasattr(torchaudio.functional, "forced_align") or blank_id in tokens):
+        kernel = "numpy"
+
+    if kernel == "python":
+        trellis = get_trellis(emission, tokens, blank_id)
+        path = backtrack(trellis, emission, tokens, blank_id)
+        return merge_repeats(path, transcript) if path is not None else None
+    if kernel == "numpy":
+        trellis = get_trellis_numpy(emission, tokens, blank_id)
+        path = backtrack_numpy(trellis, emission, tokens, blank_id)
+        return merge_repeats_numpy(*path, transcript) if path is not None else None
+    if kernel == "banded":
+        num_frame = emission.size(0)
+        while True:
+            band_start, band_end = get_band(num_frame, len(tokens), band_width)
+            trellis = get_trellis_banded(emission, tokens, band_start, band_end, blank_id)
+            path = backtrack_banded(trellis, emission, tokens, band_start, band_end, blank_id)
+            if path is not None or band_width >= num_frame:
+                return merge_repeats_numpy(*path, transcript) if path is not None else None
+            band_width *= 2
+    return forced_align_torchaudio(emission, tokens, transcript, blank_id)
+
 def merge_words(segments, separator="|"):
     words = []
     i1, i2 = 0, 0
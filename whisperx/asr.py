@@ -1,22 +1,28 @@
+import logging
 import os
 import re 
 import warnings
 import traceback
-from typing import List, Union, Optional, NamedTuple
+from collections import deque
+from itertools import groupby
+from typing import Iterable, Iterator, List, Union, Optional, NamedTuple, Tuple
 
 import ctranslate2
 import faster_whisper
 import numpy as np
 import torch
+from pyannote.core import SlidingWindowFeature
 from transformers import Pipeline
 from transformers.pipelines.pt_utils import PipelineIterator
 
 from .audio import N_SAMPLES, SAMPLE_RATE, load_audio, log_mel_spectrogram
-from .vad import load_vad_model, merge_chunks
+from .registry import MODEL_REGISTRY
+from .vad import VadScoreCache, crop_scores, load_vad_model, merge_chunks
 from .types import TranscriptionResult, SingleSegment
 from .utils import GHOST_PATTERNS
 import pprint 
 printer = pprint.PrettyPrinter()
+logger = logging.getLogger(__name__)
 
 def find_numeral_symbol_tokens(tokenizer):
     numeral_symbol_tokens = []
@@ -27,14 +33,60 @@ def find_numeral_symbol_tokens(tokenizer):
             numeral_symbol_tokens.append(i)
     return numeral_symbol_tokens
 
+def bucket_segments(segments: List[dict], num_buckets: int, bucket_by: str = "duration") -> List[int]:
+    """
+    Scheduling order that groups VAD chunks of similar length into the same batches.
+    Chunks are ranked by `bucket_by` and split into `num_buckets` buckets of equal size,
+    shortest first; inside a bucket, chunks keep their chronological order.
+
+    bucket_by:
+        "duration" - the length of the chunk.
+        "tokens" - the amount of speech in the chunk, which is what the number of decoded tokens scales with.
+    """
+    if bucket_by == "duration":
+        lengths = [seg["end"] - seg["start"] for seg in segments]
+    elif bucket_by == "tokens":
+        lengths = [sum(end - start for start, end in seg["segments"]) for seg in segments]
+    else:
+        raise ValueError(f"Unsupported bucket_by: {bucket_by}")
+    ranks = np.empty(len(segments), dtype=int)
+    ranks[np.argsort(lengths, kind="stable")] = np.arange(len(segments))
+    buckets = ranks * num_buckets // max(len(segments), 1)
+    return sorted(range(len(segments)), key=lambda i: (buckets[i], i))
+
+
+def speech_dense_segments(segments: List[dict], num_windows: int) -> List[int]:
+    """
+    Indices of the `num_windows` VAD chunks with the most speech, in chronological order.
+    """
+    speech = [sum(end - start for start, end in seg["segments"]) for seg in segments]
+    return sorted(np.argsort(speech, kind="stable")[::-1][:num_windows].tolist())
+
+
+def padding_efficiency(segments: List[dict], batch_size: int) -> float:
+    """
+    Share of the batched audio that is not padding to the longest chunk of its batch,
+    for the chunks batched in the given order.
+    """
+    durations = np.array([seg["end"] - seg["start"] for seg in segments])
+    if len(durations) == 0:
+        return 1.0
+    padded = sum(len(batch) * batch.max() for batch in np.split(durations, range(batch_size, len(durations), batch_size)))
+    return float(durations.sum() / padded) if padded > 0 else 1.0
+
+
 class WhisperModel(faster_whisper.WhisperModel):
     '''
     FasterWhisperModel provides batched inference for faster-whisper.
     Currently only works in non-timestamp mode and fixed prompt for all samples in batch.
     '''
 
-    def generate_segment_batched(self, features: np.ndarray, tokenizer: faster_whisper.tokenizer.Tokenizer, options: faster_whisper.transcribe.TranscriptionOptions, encoder_output = None):
-        batch_size = features.shape[0]
+    def generate_segment_batched(self, features: Optional[np.ndarray], tokenizer: faster_whisper.tokenizer.Tokenizer, options: faster_whisper.transcribe.TranscriptionOptions, encoder_output = None):
+        """
+        Decode a batch of features. If `encoder_output` is given (e.g. precomputed with `encode`),
+        the encoder is skipped and `features` may be None.
+        """
+        batch_size = features.shape[0] if features is not None else None
         all_tokens = []
         prompt_reset_since = 0
         if options.initial_prompt is not None:
@@ -49,7 +101,10 @@ class WhisperModel(faster_whisper.WhisperModel):
             prefix=options.prefix,
         )
 
-        encoder_output = self.encode(features)
+        if encoder_output is None:
+            encoder_output = self.encode(features)
+        else:
+            batch_size = encoder_output.shape[0]
 
         max_initial_timestamp_index = int(
             round(options.max_initial_timestamp / self.time_precision)
@@ -109,6 +164,7 @@ class FasterWhisperPipeline(Pipeline):
             framework = "pt",
             language : Optional[str] = None,
             suppress_numerals: bool = False,
+            vad_cache: Optional[VadScoreCache] = None,
             **kwargs
     ):
         self.model = model
@@ -136,6 +192,9 @@ class FasterWhisperPipeline(Pipeline):
         super(Pipeline, self).__init__()
         self.vad_model = vad
         self._vad_params = vad_params
+        self.vad_cache = vad_cache
+        # encoder output of the next batch, if it was already computed
+        self.next_encoder_output = None
 
     def _sanitize_parameters(self, **kwargs):
         preprocess_kwargs = {}
@@ -154,7 +213,9 @@ class FasterWhisperPipeline(Pipeline):
         return {'inputs': features}
 
     def _forward(self, model_inputs):
-        outputs = self.model.generate_segment_batched(model_inputs['inputs'], self.tokenizer, self.options)
+        # an encoder output handed over for this batch (e.g. by language detection) is used only once
+        encoder_output, self.next_encoder_output = self.next_encoder_output, None
+        outputs = self.model.generate_segment_batched(model_inputs['inputs'], self.tokenizer, self.options, encoder_output=encoder_output)
         return {'text': outputs}
 
     def postprocess(self, model_outputs):
@@ -175,98 +236,353 @@ class FasterWhisperPipeline(Pipeline):
         final_iterator = PipelineIterator(model_iterator, self.postprocess, postprocess_params)
         return final_iterator
 
-    def transcribe(
-        self, audio: Union[str, np.ndarray], batch_size=None, num_workers=0, language=None, task=None, outer_chunk_size=5, inner_chunk_size=20, print_progress = False, combined_progress=False
-    ) -> TranscriptionResult:
-        if isinstance(audio, str):
-            audio = load_audio(audio)
-        def data(audio, segments):
-            for seg in segments:
-                f1 = int(seg['start'] * SAMPLE_RATE)
-                f2 = int(seg['end'] * SAMPLE_RATE)
-                yield {'inputs': audio[f1:f2]}
-            
-                
-        vad_segments = self.vad_model({"waveform": torch.from_numpy(audio).unsqueeze(0), "sample_rate": SAMPLE_RATE})
+    def get_vad_scores(self, audio: np.ndarray) -> SlidingWindowFeature:
+        """
+        Run the VAD segmentation model on the audio, or read its scores back from the VAD score cache.
+        """
+        if self.vad_cache is not None:
+            vad_scores = self.vad_cache.get(audio)
+            if vad_scores is not None:
+                return vad_scores
+        vad_scores = self.vad_model({"waveform": torch.from_numpy(audio).unsqueeze(0), "sample_rate": SAMPLE_RATE})
+        if self.vad_cache is not None:
+            self.vad_cache.put(audio, vad_scores)
+        return vad_scores
+
+    def get_vad_segments(
+        self, audio: np.ndarray, outer_chunk_size=5, inner_chunk_size=20, reuse_vad_scores=False
+    ) -> List[dict]:
+        """
+        Split the audio into ASR chunks with two passes of VAD.
+        The first pass merges speech into outer chunks of `outer_chunk_size` seconds,
+        the second pass splits every outer chunk again into inner chunks of `inner_chunk_size` seconds.
+        With `reuse_vad_scores`, the second pass slices the scores of the first pass
+        instead of running the segmentation model again on every outer chunk.
+        With a VAD score cache, only the scores of the whole audio are cached and the second pass always slices them,
+        so that other chunk sizes or thresholds never run the segmentation model again.
+        """
+        vad_scores = self.get_vad_scores(audio)
+        reuse_vad_scores = reuse_vad_scores or self.vad_cache is not None
         # merge by duration_chunk_size which is 20. 
         vad_segments = merge_chunks(
-            vad_segments,
+            vad_scores,
             outer_chunk_size,
             onset=self._vad_params["vad_onset"],
             offset=self._vad_params["vad_offset"],
+            vectorized=self._vad_params.get("vad_vectorized", False),
         )
         
         final_segments = []
         
         for seg in vad_segments:
-            f1 = int(seg['start'] * SAMPLE_RATE)
-            f2 = int(seg['end'] * SAMPLE_RATE)
-            inner_segments = self.vad_model({"waveform": torch.from_numpy(audio[f1:f2]).unsqueeze(0), "sample_rate": SAMPLE_RATE})
-            inner_segments = merge_chunks(inner_segments, inner_chunk_size, onset=self._vad_params["vad_onset"], offset=self._vad_params["vad_offset"])
+            if reuse_vad_scores:
+                inner_scores = crop_scores(vad_scores, seg['start'], seg['end'])
+            else:
+                f1 = int(seg['start'] * SAMPLE_RATE)
+                f2 = int(seg['end'] * SAMPLE_RATE)
+                inner_scores = self.get_vad_scores(audio[f1:f2])
+            inner_segments = merge_chunks(
+                inner_scores,
+                inner_chunk_size,
+                onset=self._vad_params["vad_onset"],
+                offset=self._vad_params["vad_offset"],
+                vectorized=self._vad_params.get("vad_vectorized", False),
+            )
             for inner_seg in inner_segments:
                 final_segments.append({
                     "start": seg['start'] + inner_seg['start'],
                     "end": seg['start'] + inner_seg['end'],
                     "segments": inner_seg["segments"]
                 })
+        return final_segments
+
+    def transcribe(
+        self, audio: Union[str, np.ndarray], batch_size=None, num_workers=0, language=None, task=None, outer_chunk_size=5, inner_chunk_size=20, print_progress = False, combined_progress=False, reuse_vad_scores=False, num_buckets=0, bucket_by="duration", vad_segments=None, language_detection_windows=1
+    ) -> TranscriptionResult:
+        """
+        Transcribe the audio in batches of VAD chunks.
+        `vad_segments` can be passed to reuse chunks already computed with `get_vad_segments`.
+        When the language is not known, it is detected on the `language_detection_windows` chunks with the most speech
+        (voting over them if there are several). When they are all in the first batch, the encoder output of that batch
+        is reused to decode it.
+        With `num_buckets` > 0, the chunks are grouped into that many length buckets (see `bucket_segments`)
+        and batched bucket by bucket, so that every batch holds chunks of similar length;
+        the returned segments are still in chronological order.
+        """
+        try:
+            language, segments = self.transcribe_stream(
+                audio,
+                batch_size=batch_size,
+                num_workers=num_workers,
+                language=language,
+                task=task,
+                outer_chunk_size=outer_chunk_size,
+                inner_chunk_size=inner_chunk_size,
+                print_progress=print_progress,
+                combined_progress=combined_progress,
+                reuse_vad_scores=reuse_vad_scores,
+                num_buckets=num_buckets,
+                bucket_by=bucket_by,
+                vad_segments=vad_segments,
+                language_detection_windows=language_detection_windows,
+            )
+            return {"segments": list(segments), "language": language}
+        finally:
+            # never keep the encoder output of language detection past the call, also when decoding failed
+            self.next_encoder_output = None
+
+    def transcribe_stream(
+        self, audio: Union[str, np.ndarray], batch_size=None, num_workers=0, language=None, task=None, outer_chunk_size=5, inner_chunk_size=20, print_progress = False, combined_progress=False, reuse_vad_scores=False, num_buckets=0, bucket_by="duration", vad_segments=None, language_detection_windows=1
+    ) -> Tuple[str, Iterator[SingleSegment]]:
+        """
+        Generator variant of `transcribe`, taking the same arguments.
+        VAD and language detection run right away, the returned iterator then decodes the chunks lazily and yields
+        every segment as soon as it and all segments before it are decoded, e.g. to align them with `align_stream`
+        while the next batches are decoded.
+        Returns `(language, segments)`. The tokenizer and options of the pipeline are restored once `segments` is
+        exhausted or closed, so it must be consumed before the pipeline is used again.
+        """
+        if isinstance(audio, str):
+            audio = load_audio(audio)
+        def data(audio, segments):
+            for seg in segments:
+                f1 = int(seg['start'] * SAMPLE_RATE)
+                f2 = int(seg['end'] * SAMPLE_RATE)
+                yield {'inputs': audio[f1:f2]}
+            
                 
-        if self.tokenizer is None:
-            language = language or self.detect_language(audio)
-            task = task or "transcribe"
-            self.tokenizer = faster_whisper.tokenizer.Tokenizer(self.model.hf_tokenizer,
-                                                                self.model.model.is_multilingual, task=task,
-                                                                language=language)
+        if vad_segments is not None:
+            final_segments = vad_segments
         else:
-            language = language or self.tokenizer.language_code
-            task = task or self.tokenizer.task
-            if task != self.tokenizer.task or language != self.tokenizer.language_code:
+            final_segments = self.get_vad_segments(
+                audio,
+                outer_chunk_size=outer_chunk_size,
+                inner_chunk_size=inner_chunk_size,
+                reuse_vad_scores=reuse_vad_scores,
+            )
+                
+        batch_size = batch_size or self._batch_size
+
+        # order in which the segments are batched, results are put back in chronological order below
+        order = list(range(len(final_segments)))
+        if num_buckets:
+            order = bucket_segments(final_segments, num_buckets, bucket_by=bucket_by)
+            if logger.isEnabledFor(logging.DEBUG):
+                efficiency = padding_efficiency([final_segments[i] for i in order], batch_size or 1)
+                chronological_efficiency = padding_efficiency(final_segments, batch_size or 1)
+                logger.debug(f"Padding efficiency: {efficiency:.2f} (chronological: {chronological_efficiency:.2f})")
+
+        self.next_encoder_output = None
+        try:
+            if self.tokenizer is None:
+                if language is None and len(final_segments) > 0:
+                    num_windows = min(language_detection_windows, len(final_segments))
+                    # the first (or, when bucketing, shortest) chunk can be too short to tell the language
+                    windows = speech_dense_segments(final_segments, num_windows)
+                    first_batch = order[:batch_size or 1]
+                    if set(windows) <= set(first_batch):
+                        # detect on the whole first batch, windows first, its encoder output is then reused to decode it
+                        first_batch = windows + [i for i in first_batch if i not in set(windows)]
+                        order = first_batch + order[len(first_batch):]
+                        detection_batch, keep_encoder_output = first_batch, True
+                    else:
+                        detection_batch, keep_encoder_output = windows, False
+                    language = self.detect_language_batch(
+                        audio,
+                        [final_segments[i] for i in detection_batch],
+                        num_windows=num_windows,
+                        keep_encoder_output=keep_encoder_output,
+                    )
+                language = language or self.detect_language(audio)
+                task = task or "transcribe"
                 self.tokenizer = faster_whisper.tokenizer.Tokenizer(self.model.hf_tokenizer,
                                                                     self.model.model.is_multilingual, task=task,
                                                                     language=language)
-        
-        if self.suppress_numerals:
-            previous_suppress_tokens = self.options.suppress_tokens
-            numeral_symbol_tokens = find_numeral_symbol_tokens(self.tokenizer)
-            print(f"Suppressing numeral and symbol tokens: {numeral_symbol_tokens}")
-            new_suppressed_tokens = numeral_symbol_tokens + self.options.suppress_tokens
-            new_suppressed_tokens = list(set(new_suppressed_tokens))
-            self.options = self.options._replace(suppress_tokens=new_suppressed_tokens)
-
-        segments: List[SingleSegment] = []
-        batch_size = batch_size or self._batch_size
-        
-        # total_segments = len(vad_segments)
-        total_segments = len(final_segments)
-        for idx, out in enumerate(self.__call__(data(audio, final_segments), batch_size=batch_size, num_workers=num_workers)):
-            if print_progress:
-                base_progress = ((idx + 1) / total_segments) * 100
-                percent_complete = base_progress / 2 if combined_progress else base_progress
-                print(f"Progress: {percent_complete:.2f}%...")
-            
-            text = out['text']
-            if batch_size in [0, 1, None]:
-                text = text[0]
+            else:
+                language = language or self.tokenizer.language_code
+                task = task or self.tokenizer.task
+                if task != self.tokenizer.task or language != self.tokenizer.language_code:
+                    self.tokenizer = faster_whisper.tokenizer.Tokenizer(self.model.hf_tokenizer,
+                                                                        self.model.model.is_multilingual, task=task,
+                                                                        language=language)
+
+            if self.suppress_numerals:
+                previous_suppress_tokens = self.options.suppress_tokens
+                numeral_symbol_tokens = find_numeral_symbol_tokens(self.tokenizer)
+                print(f"Suppressing numeral and symbol tokens: {numeral_symbol_tokens}")
+                new_suppressed_tokens = numeral_symbol_tokens + self.options.suppress_tokens
+                new_suppressed_tokens = list(set(new_suppressed_tokens))
+                self.options = self.options._replace(suppress_tokens=new_suppressed_tokens)
+        except BaseException:
+            # the stream below, which consumes or drops the encoder output, is never started
+            self.next_encoder_output = None
+            raise
+
+        def stream():
+            texts = [None] * len(final_segments)
+            next_idx = 0
+            total_segments = len(final_segments)
             try:
-                segments.append(
+                for idx, out in enumerate(self.__call__(data(audio, [final_segments[i] for i in order]), batch_size=batch_size, num_workers=num_workers)):
+                    if print_progress:
+                        base_progress = ((idx + 1) / total_segments) * 100
+                        percent_complete = base_progress / 2 if combined_progress else base_progress
+                        print(f"Progress: {percent_complete:.2f}%...")
+
+                    text = out['text']
+                    if batch_size in [0, 1, None]:
+                        text = text[0]
+                    texts[order[idx]] = text
+
+                    # yield the segments decoded in chronological order so far
+                    while next_idx < total_segments and texts[next_idx] is not None:
+                        yield {
+                            "text": texts[next_idx],
+                            "start": round(final_segments[next_idx]['start'], 3),
+                            "end": round(final_segments[next_idx]['end'], 3)
+                        }
+                        next_idx += 1
+            finally:
+                # drop an encoder output that was not consumed
+                self.next_encoder_output = None
+
+                # revert the tokenizer if multilingual inference is enabled
+                if self.preset_language is None:
+                    self.tokenizer = None
+
+                # revert suppressed tokens if suppress_numerals is enabled
+                if self.suppress_numerals:
+                    self.options = self.options._replace(suppress_tokens=previous_suppress_tokens)
+
+        return language, stream()
+
+    def transcribe_many(
+        self, audios: Iterable[Union[str, np.ndarray]], batch_size=None, language=None, task=None, outer_chunk_size=5, inner_chunk_size=20, reuse_vad_scores=False
+    ) -> Iterator[Tuple[int, TranscriptionResult]]:
+        """
+        Transcribe many audio files, pooling the VAD chunks of consecutive files into shared batches,
+        so that short files do not leave batches half empty.
+        Files are loaded lazily and results are streamed back as `(index, result)` as soon as
+        the last chunk of a file is decoded, in input order.
+        Consecutive files with the same language share batches; the pool is flushed when the language changes.
+        """
+        batch_size = batch_size or self._batch_size
+        previous_tokenizer = self.tokenizer
+        previous_options = self.options
+        task = task or (self.tokenizer.task if self.tokenizer is not None else "transcribe")
+
+        def prepare():
+            for idx, audio in enumerate(audios):
+                if isinstance(audio, str):
+                    audio = load_audio(audio)
+                segments = self.get_vad_segments(
+                    audio,
+                    outer_chunk_size=outer_chunk_size,
+                    inner_chunk_size=inner_chunk_size,
+                    reuse_vad_scores=reuse_vad_scores,
+                )
+                if language is not None:
+                    file_language = language
+                elif self.tokenizer is not None and self.preset_language is not None:
+                    file_language = self.tokenizer.language_code
+                else:
+                    file_language = self.detect_language(audio)
+                yield idx, audio, segments, file_language
+
+        # per file: chunks, decoded texts and number of chunks still in flight
+        files = {}
+        # file index of every chunk handed to the model, in order
+        owners = deque()
+        next_idx = 0
+
+        def data(group):
+            for idx, audio, segments, _ in group:
+                files[idx] = {"segments": segments, "texts": [], "remaining": len(segments)}
+                for seg in segments:
+                    f1 = int(seg['start'] * SAMPLE_RATE)
+                    f2 = int(seg['end'] * SAMPLE_RATE)
+                    owners.append(idx)
+                    yield {'inputs': audio[f1:f2]}
+
+        def completed(group_language):
+            nonlocal next_idx
+            while next_idx in files and files[next_idx]["remaining"] == 0:
+                file = files.pop(next_idx)
+                segments = [
                     {
                         "text": text,
-                        "start": round(final_segments[idx]['start'], 3),
-                        "end": round(final_segments[idx]['end'], 3)
+                        "start": round(seg['start'], 3),
+                        "end": round(seg['end'], 3)
                     }
-                )
-            except Exception as e:
-                print(idx)
-                print(traceback.print_tb(e.__traceback__))
-        # revert the tokenizer if multilingual inference is enabled
-        if self.preset_language is None:
-            self.tokenizer = None
-
-        # revert suppressed tokens if suppress_numerals is enabled
-        if self.suppress_numerals:
-            self.options = self.options._replace(suppress_tokens=previous_suppress_tokens)
-
-        return {"segments": segments, "language": language}
+                    for seg, text in zip(file["segments"], file["texts"])
+                ]
+                yield next_idx, {"segments": segments, "language": group_language}
+                next_idx += 1
 
+        try:
+            for group_language, group in groupby(prepare(), key=lambda item: item[3]):
+                self.tokenizer = faster_whisper.tokenizer.Tokenizer(self.model.hf_tokenizer,
+                                                                    self.model.model.is_multilingual, task=task,
+                                                                    language=group_language)
+                self.options = previous_options
+                if self.suppress_numerals:
+                    numeral_symbol_tokens = find_numeral_symbol_tokens(self.tokenizer)
+                    new_suppressed_tokens = list(set(numeral_symbol_tokens + self.options.suppress_tokens))
+                    self.options = self.options._replace(suppress_tokens=new_suppressed_tokens)
+
+                # chunks are tracked by the data generator, so it has to run in this process
+                for out in self.__call__(data(group), batch_size=batch_size, num_workers=0):
+                    text = out['text']
+                    if batch_size in [0, 1, None]:
+                        text = text[0]
+                    file = files[owners.popleft()]
+                    file["texts"].append(text)
+                    file["remaining"] -= 1
+                    yield from completed(group_language)
+                # files without speech have no chunks in flight
+                yield from completed(group_language)
+        finally:
+            self.tokenizer = previous_tokenizer
+            self.options = previous_options
+
+    def get_features(self, audio: np.ndarray, segments: List[dict]) -> torch.Tensor:
+        """
+        Batch of log-Mel features of the given VAD chunks, exactly as they are fed to the encoder during transcription.
+        Together with `WhisperModel.encode` and the `encoder_output` argument of `generate_segment_batched`,
+        this lets callers encode chunks once and decode them several times.
+        """
+        features = []
+        for seg in segments:
+            f1 = int(seg['start'] * SAMPLE_RATE)
+            f2 = int(seg['end'] * SAMPLE_RATE)
+            features.append(self.preprocess({'inputs': audio[f1:f2]})['inputs'])
+        return torch.stack(features)
+
+    def detect_language_batch(self, audio: np.ndarray, segments: List[dict], num_windows: int = 1, keep_encoder_output: bool = True) -> str:
+        """
+        Detect the language on the first `num_windows` of the given VAD chunks, encoding all chunks in one batch
+        and running language detection once on the batch. With several windows, the language probabilities
+        are averaged over the windows and the most probable language wins, ties going to the language of the first window.
+        With `keep_encoder_output`, the encoder output is kept in `next_encoder_output`, so that the next batch
+        decoded by the pipeline (which must be made of the same chunks) skips the encoder.
+        """
+        encoder_output = self.model.encode(self.get_features(audio, segments))
+        results = self.model.model.detect_language(encoder_output)
+        language_probabilities = {}
+        for window_results in results[:num_windows]:
+            for language_token, probability in window_results:
+                language_probabilities[language_token] = language_probabilities.get(language_token, 0.0) + probability / num_windows
+        language_token = max(language_probabilities, key=language_probabilities.get)
+        language_probability = language_probabilities[language_token]
+        language = language_token[2:-2]
+        seconds = sum(seg["end"] - seg["start"] for seg in segments[:num_windows])
+        if num_windows > 1:
+            print(f"Detected language: {language} ({language_probability:.2f}) over {num_windows} chunks ({seconds:.1f}s) of audio...")
+        else:
+            print(f"Detected language: {language} ({language_probability:.2f}) in a {seconds:.1f}s chunk of audio...")
+        if keep_encoder_output:
+            self.next_encoder_output = encoder_output
+        return language
 
     def detect_language(self, audio: np.ndarray):
         if audio.shape[0] < N_SAMPLES:
@@ -293,7 +609,9 @@ def load_model(whisper_arch,
                model : Optional[WhisperModel] = None,
                task="transcribe",
                download_root=None,
-               threads=4):
+               threads=4,
+               vad_cache_dir=None,
+               use_registry=False):
     '''Load a Whisper model for inference.
     Args:
         whisper_arch: str - The name of the Whisper model to load.
@@ -305,6 +623,8 @@ def load_model(whisper_arch,
         model: Optional[WhisperModel] - The WhisperModel instance to use.
         download_root: Optional[str] - The root directory to download the model to.
         threads: int - The number of cpu threads to use per worker, e.g. will be multiplied by num workers.
+        vad_cache_dir: Optional[str] - Directory to cache raw VAD scores in, so that runs which only change the VAD binarization params or chunk sizes skip the segmentation model (the inner chunks are then always split on the sliced scores of the whole audio, see `get_vad_segments`).
+        use_registry: bool - Reuse the Whisper and VAD models already loaded by earlier calls with the same arch/device/compute type/threads (the VAD model is shared across onset/offset), see `whisperx.registry.MODEL_REGISTRY`.
     Returns:
         A Whisper pipeline.
     '''
@@ -312,12 +632,18 @@ def load_model(whisper_arch,
     if whisper_arch.endswith(".en"):
         language = "en"
 
-    model = model or WhisperModel(whisper_arch,
-                         device=device,
-                         device_index=device_index,
-                         compute_type=compute_type,
-                         download_root=download_root,
-                         cpu_threads=threads)
+    def load():
+        return WhisperModel(whisper_arch,
+                            device=device,
+                            device_index=device_index,
+                            compute_type=compute_type,
+                            download_root=download_root,
+                            cpu_threads=threads)
+
+    if model is None and use_registry:
+        key = ("whisper", whisper_arch, device, str(device_index), compute_type, threads, download_root)
+        model = MODEL_REGISTRY.get_or_load(key, load, nbytes=model_dir_nbytes(whisper_arch, download_root))
+    model = model or load()
     if language is not None:
         tokenizer = faster_whisper.tokenizer.Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task=task, language=language)
     else:
@@ -364,16 +690,17 @@ def load_model(whisper_arch,
         "vad_onset": 0.500,
         "vad_offset": 0.363,
         "min_duration_on": 0.1,
-        "min_duration_off": 0.1
+        "min_duration_off": 0.1,
+        "vad_vectorized": False,
     }
 
     if vad_options is not None:
         default_vad_options.update(vad_options)
 
     if vad_model_fp is not None:
-        vad_model = load_vad_model(torch.device(device), use_auth_token=None, **default_vad_options, model_fp=vad_model_fp)
+        vad_model = load_vad_model(torch.device(device), use_auth_token=None, **default_vad_options, model_fp=vad_model_fp, use_registry=use_registry)
     else:
-        vad_model = load_vad_model(torch.device(device), use_auth_token=None, **default_vad_options)
+        vad_model = load_vad_model(torch.device(device), use_auth_token=None, **default_vad_options, use_registry=use_registry)
 
     return FasterWhisperPipeline(
         model=model,
@@ -383,4 +710,17 @@ def load_model(whisper_arch,
         language=language,
         suppress_numerals=suppress_numerals,
         vad_params=default_vad_options,
+        vad_cache=VadScoreCache(vad_cache_dir) if vad_cache_dir is not None else None,
     )
+
+
+def model_dir_nbytes(whisper_arch: str, download_root: Optional[str] = None) -> int:
+    """Size of the converted model files, used as the memory cost of a Whisper model in the registry."""
+    try:
+        if os.path.isdir(whisper_arch):
+            model_dir = whisper_arch
+        else:
+            model_dir = faster_whisper.utils.download_model(whisper_arch, local_files_only=True, cache_dir=download_root)
+        return sum(entry.stat().st_size for entry in os.scandir(model_dir) if entry.is_file())
+    except Exception:
+        return 0
@@ -1,7 +1,11 @@
+import hashlib
+import mmap
 import os
+import struct
 import subprocess
+import tempfile
 from functools import lru_cache
-from typing import Optional, Union
+from typing import Iterator, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -22,7 +26,7 @@ FRAMES_PER_SECOND = exact_div(SAMPLE_RATE, HOP_LENGTH)  # 10ms per audio frame
 TOKENS_PER_SECOND = exact_div(SAMPLE_RATE, N_SAMPLES_PER_TOKEN)  # 20ms per audio token
 
 
-def load_audio(file: str, sr: int = SAMPLE_RATE):
+def load_audio(file: str, sr: int = SAMPLE_RATE, start: Optional[float] = None, duration: Optional[float] = None, block_size: int = 1 << 16):
     """
     Open an audio file and read as mono waveform, resampling as necessary
 
@@ -34,35 +38,226 @@ def load_audio(file: str, sr: int = SAMPLE_RATE):
     sr: int
         The sample rate to resample the audio if necessary
 
+    start: Optional[float]
+        Offset in seconds to start decoding at, the beginning of the file if not given
+
+    duration: Optional[float]
+        Number of seconds to decode, the rest of the file if not given
+
+    block_size: int
+        Number of samples read from ffmpeg at a time, see `iter_audio`
+
     Returns
     -------
     A NumPy array containing the audio waveform, in float32 dtype.
     """
+    # 16-bit mono PCM WAV at the target rate needs no decoding, skip spawning ffmpeg
+    audio = read_wav(file, sr, start=start, duration=duration)
+    if audio is not None:
+        return audio
+
+    # the blocks are written into a buffer that grows by half when full and is trimmed in place at the end,
+    # peak memory stays around the final array instead of the s16le output, its int16 and float32 copies
+    capacity = int(duration * sr) + 1 if duration is not None else 30 * sr
+    audio = np.empty(capacity, np.float32)
+    num_samples = 0
+    for block in iter_audio(file, sr, start=start, duration=duration, block_size=block_size):
+        if num_samples + len(block) > len(audio):
+            audio.resize(max(num_samples + len(block), len(audio) * 3 // 2), refcheck=False)
+        audio[num_samples:num_samples + len(block)] = block
+        num_samples += len(block)
+    audio.resize(num_samples, refcheck=False)
+    return audio
+
+
+def read_wav(file: str, sr: int = SAMPLE_RATE, start: Optional[float] = None, duration: Optional[float] = None) -> Optional[np.ndarray]:
+    """
+    Read a 16-bit mono PCM WAV file sampled at `sr` without ffmpeg, the samples are the ones ffmpeg would output.
+    Returns None for any other file, which then needs decoding or resampling by ffmpeg.
+    """
+    if not os.path.isfile(file):
+        return None
+    with open(file, "rb") as f:
+        data_chunk = _pcm_wav_data(f, sr)
+        if data_chunk is None:
+            return None
+        offset, num_bytes = data_chunk
+        num_samples = num_bytes // 2
+        first = min(int(start * sr), num_samples) if start is not None else 0
+        last = min(first + int(duration * sr), num_samples) if duration is not None else num_samples
+        if last <= first:
+            return np.empty(0, np.float32)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            samples = np.frombuffer(mm, "<i2", count=last - first, offset=offset + 2 * first)
+            audio = samples.astype(np.float32)
+            # release the view before the map is closed
+            del samples
+    audio /= 32768.0
+    return audio
+
+
+def _pcm_wav_data(f, sr: int) -> Optional[Tuple[int, int]]:
+    """Offset and size of the samples of an open 16-bit mono PCM WAV file sampled at `sr`, None for other files."""
+    riff, _, wave = struct.unpack("<4sI4s", f.read(12).ljust(12, b"\0"))
+    if riff != b"RIFF" or wave != b"WAVE":
+        return None
+    pcm_s16_mono = False
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"data":
+            break
+        if chunk_id == b"fmt ":
+            fmt = f.read(chunk_size)
+            if len(fmt) < 16:
+                return None
+            format_tag, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+            if format_tag == 0xFFFE and len(fmt) >= 26:
+                # WAVE_FORMAT_EXTENSIBLE, the format is the start of the sub-format GUID
+                format_tag = struct.unpack("<H", fmt[24:26])[0]
+            pcm_s16_mono = format_tag == 1 and channels == 1 and bits == 16 and sample_rate == sr
+            f.seek(chunk_size % 2, os.SEEK_CUR)
+        else:
+            # chunks are padded to an even size
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+    offset = f.tell()
+    # streamed WAVs leave the size of the data chunk at 0 or 0xFFFFFFFF, let ffmpeg handle the former
+    if not pcm_s16_mono or chunk_size == 0:
+        return None
+    return offset, min(chunk_size, os.fstat(f.fileno()).st_size - offset)
+
+
+def get_duration(file: str, sr: int = SAMPLE_RATE) -> float:
+    """
+    Duration in seconds of an audio file, read from the header of the WAV files `read_wav` handles and probed with
+    ffprobe otherwise.
+    """
+    if os.path.isfile(file):
+        with open(file, "rb") as f:
+            data_chunk = _pcm_wav_data(f, sr)
+        if data_chunk is not None:
+            return data_chunk[1] // 2 / sr
+    cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", file]
     try:
-        # Launches a subprocess to decode audio while down-mixing and resampling as necessary.
-        # Requires the ffmpeg CLI to be installed.
-        cmd = [
-            "ffmpeg",
-            "-nostdin",
-            "-threads",
-            "0",
-            "-i",
-            file,
-            "-f",
-            "s16le",
-            "-ac",
-            "1",
-            "-acodec",
-            "pcm_s16le",
-            "-ar",
-            str(sr),
-            "-",
-        ]
         out = subprocess.run(cmd, capture_output=True, check=True).stdout
+        return float(out)
     except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
+        raise RuntimeError(f"Failed to probe audio: {e.stderr.decode()}") from e
+    except ValueError as e:
+        raise RuntimeError(f"Failed to probe audio: no duration for {file}") from e
+
+
+def iter_audio(file: str, sr: int = SAMPLE_RATE, start: Optional[float] = None, duration: Optional[float] = None, block_size: int = 1 << 16) -> Iterator[np.ndarray]:
+    """
+    Decode an audio file like `load_audio`, yielding float32 blocks of `block_size` samples (the last one shorter)
+    as ffmpeg produces them. ffmpeg is stopped if the generator is closed early.
+    """
+    # Launches a subprocess to decode audio while down-mixing and resampling as necessary.
+    # Requires the ffmpeg CLI to be installed.
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0"]
+    if start is not None:
+        cmd += ["-ss", str(start)]
+    if duration is not None:
+        cmd += ["-t", str(duration)]
+    cmd += ["-i", file, "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr), "-"]
+
+    # stderr goes to a file, a pipe could fill up with progress lines and block ffmpeg while stdout is read
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            while True:
+                out = process.stdout.read(2 * block_size)
+                if len(out) == 0:
+                    break
+                block = np.frombuffer(out, np.int16, count=len(out) // 2).astype(np.float32)
+                block /= 32768.0
+                yield block
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise RuntimeError(f"Failed to load audio: {stderr.read().decode()}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+
+
+class AudioCache:
+    """On-disk cache of decoded audio, so that sweeps and reruns over the same files skip ffmpeg.
+
+    Waveforms are stored as float32 `.npy` files keyed by the path, modification time and size of the
+    source file and the sample rate, and are loaded back memory-mapped: processes reading the same file
+    share its pages through the page cache. Once the cache grows over `max_bytes`, the least recently
+    used entries are evicted.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory holding the decoded audio.
+    max_bytes : int, optional
+        Size bound of the cache. Defaults to 8 GiB, about 36 hours of 16 kHz audio.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 8 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, file: str, sr: int = SAMPLE_RATE) -> str:
+        stat = os.stat(file)
+        digest = hashlib.sha256(f"{os.path.abspath(file)}:{stat.st_mtime_ns}:{stat.st_size}:{sr}".encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def load(self, file: str, sr: int = SAMPLE_RATE, mmap_mode: str = "c") -> np.memmap:
+        """
+        Memory-mapped waveform of `file`, decoded with `load_audio` and stored on a miss.
+        The default copy-on-write mode keeps the cached file intact if the array is written to.
+        """
+        key = self.key(file, sr)
+        data_fp = self._path(key)
+        try:
+            # mark as recently used
+            os.utime(data_fp)
+            return np.load(data_fp, mmap_mode=mmap_mode)
+        except FileNotFoundError:
+            # not cached, or evicted meanwhile by another process
+            pass
+        # write to a uniquely named temporary file first, so that concurrent readers never see partial entries
+        # and concurrent decoders of the same file (processes or decode threads) never share it
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            np.save(f, load_audio(file, sr))
+        os.replace(f.name, data_fp)
+        self.evict(keep=key)
+        return np.load(data_fp, mmap_mode=mmap_mode)
 
-    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+    def evict(self, keep: Optional[str] = None):
+        """Remove the least recently used entries until the cache fits `max_bytes`, except the entry `keep`."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".npy")]))
+        total = sum(size for _, size, _ in entries)
+        # least recently used first
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
 
 
 def pad_or_trim(array, length: int = N_SAMPLES, *, axis: int = -1):
@@ -0,0 +1,109 @@
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import ctranslate2
+import faster_whisper
+import numpy as np
+import torch
+
+from .asr import FasterWhisperPipeline
+from .audio import load_audio
+from .types import SingleSegment, TranscriptionResult
+
+
+class DecodeSweep:
+    """
+    Decode-only hyperparameter sweeps on one audio file.
+    VAD, log-Mel features and the encoder run once when the sweep is built; every option set then only replays
+    `model.generate` on the cached encoder outputs, which are kept in memory or spilled to `.npy` files.
+
+    Args:
+        pipeline: FasterWhisperPipeline - The loaded pipeline, its `options` are the base of every option set.
+        audio: Union[str, np.ndarray] - The audio file to sweep on.
+        batch_size: int - Number of VAD chunks per encoder/decoder batch.
+        language: Optional[str] - Language of the audio, detected on the first batch if not given.
+        task: str - "transcribe" or "translate".
+        spill_dir: Optional[str] - Directory to spill the encoder outputs to instead of keeping them in memory.
+        vad_kwargs: dict - Passed on to `FasterWhisperPipeline.get_vad_segments`.
+    """
+
+    def __init__(
+        self,
+        pipeline: FasterWhisperPipeline,
+        audio: Union[str, np.ndarray],
+        batch_size: int = 8,
+        language: Optional[str] = None,
+        task: str = "transcribe",
+        spill_dir: Optional[str] = None,
+        **vad_kwargs,
+    ):
+        self.pipeline = pipeline
+        self.spill_dir = spill_dir
+        if isinstance(audio, str):
+            audio = load_audio(audio)
+
+        start = time.time()
+        self.segments = pipeline.get_vad_segments(audio, **vad_kwargs)
+        if language is None and pipeline.preset_language is not None:
+            language = pipeline.tokenizer.language_code
+        if language is None and len(self.segments) > 0:
+            language = pipeline.detect_language_batch(audio, self.segments[:batch_size], keep_encoder_output=False)
+        self.language = language or pipeline.detect_language(audio)
+        self.tokenizer = faster_whisper.tokenizer.Tokenizer(pipeline.model.hf_tokenizer,
+                                                            pipeline.model.model.is_multilingual, task=task,
+                                                            language=self.language)
+
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.encoder_outputs = []
+        for batch_start in range(0, len(self.segments), batch_size):
+            features = pipeline.get_features(audio, self.segments[batch_start:batch_start + batch_size])
+            encoder_output = pipeline.model.encode(features)
+            if spill_dir is not None:
+                path = os.path.join(spill_dir, f"encoder_output_{batch_start // batch_size:05d}.npy")
+                np.save(path, encoder_output_to_numpy(encoder_output))
+                encoder_output = path
+            self.encoder_outputs.append(encoder_output)
+        self.encode_time = time.time() - start
+
+    def _encoder_output(self, encoder_output) -> ctranslate2.StorageView:
+        if isinstance(encoder_output, str):
+            return ctranslate2.StorageView.from_array(np.load(encoder_output))
+        return encoder_output
+
+    def decode(self, options: faster_whisper.transcribe.TranscriptionOptions) -> TranscriptionResult:
+        """
+        Decode all chunks with the given options, reusing the cached encoder outputs.
+        """
+        texts = []
+        for encoder_output in self.encoder_outputs:
+            texts += self.pipeline.model.generate_segment_batched(
+                None, self.tokenizer, options, encoder_output=self._encoder_output(encoder_output)
+            )
+        segments: List[SingleSegment] = [
+            {
+                "text": text,
+                "start": round(seg['start'], 3),
+                "end": round(seg['end'], 3)
+            }
+            for seg, text in zip(self.segments, texts)
+        ]
+        return {"segments": segments, "language": self.language}
+
+    def run(self, option_sets: Dict[str, dict]) -> Iterator[Tuple[str, TranscriptionResult, float]]:
+        """
+        Decode with every option set, given as overrides of the pipeline options.
+        Yields `(name, result, decode_seconds)` for every set.
+        """
+        for name, overrides in option_sets.items():
+            options = self.pipeline.options._replace(**overrides)
+            start = time.time()
+            result = self.decode(options)
+            yield name, result, time.time() - start
+
+
+def encoder_output_to_numpy(encoder_output: ctranslate2.StorageView) -> np.ndarray:
+    if encoder_output.device == "cuda":
+        return torch.as_tensor(encoder_output, device=f"cuda:{encoder_output.device_index}").cpu().numpy()
+    return np.array(encoder_output)
@@ -1,10 +1,123 @@
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 from pyannote.audio import Pipeline
-from typing import Optional, Union
+from pyannote.audio.utils.signal import binarize
+from pyannote.core import Annotation, Segment as TurnSegment, SlidingWindow, SlidingWindowFeature
+from scipy.cluster.hierarchy import fcluster, linkage
+from typing import Optional, Tuple, Union
 import torch
 
-from .audio import load_audio, SAMPLE_RATE
+from .audio import get_duration, load_audio, SAMPLE_RATE
+
+
+class DiarizationCache:
+    """Cache of the segmentations and speaker embeddings computed by the pyannote pipeline, so that
+    reruns with other speaker counts only repeat the clustering (see `DiarizationPipeline.recluster`).
+
+    Entries are keyed by the SHA-256 of the audio samples and the name of the diarization model.
+    The last entry is kept in memory; with a `cache_dir`, all entries are also stored there as `.npz`
+    files next to a small json file holding the sliding window of the segmentations. Once the directory
+    grows over `max_bytes`, the least recently used entries are evicted.
+
+    Parameters
+    ----------
+    model_name : str
+        Name of the diarization model the entries are computed with.
+    cache_dir : str, optional
+        Directory holding the cached entries, in memory only if not given.
+    max_bytes : int, optional
+        Size bound of the cache directory. Defaults to 2 GiB.
+    """
+
+    def __init__(self, model_name: str, cache_dir: Optional[str] = None, max_bytes: int = 2 << 30):
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._last = None
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, audio: np.ndarray) -> str:
+        digest = hashlib.sha256(self.model_name.encode())
+        digest.update(np.ascontiguousarray(audio).view(np.uint8))
+        return digest.hexdigest()
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        path = os.path.join(self.cache_dir, key)
+        return path + ".npz", path + ".json"
+
+    def get(self, key: str) -> Optional[Tuple[SlidingWindowFeature, Optional[np.ndarray]]]:
+        """The segmentations and embeddings (None if no speaker is ever active) of `key`, if cached."""
+        if self._last is not None and self._last[0] == key:
+            return self._last[1]
+        if self.cache_dir is None:
+            return None
+        data_fp, meta_fp = self._paths(key)
+        try:
+            with open(meta_fp) as f:
+                meta = json.load(f)
+            with np.load(data_fp) as data:
+                segmentations = data["segmentations"]
+                embeddings = data["embeddings"] if "embeddings" in data else None
+            # mark as recently used
+            os.utime(data_fp)
+        except FileNotFoundError:
+            # not cached, or evicted meanwhile by another process
+            return None
+        sliding_window = SlidingWindow(start=meta["start"], duration=meta["duration"], step=meta["step"])
+        entry = (SlidingWindowFeature(segmentations, sliding_window), embeddings)
+        self._last = (key, entry)
+        return entry
+
+    def put(self, key: str, segmentations: SlidingWindowFeature, embeddings: Optional[np.ndarray]):
+        self._last = (key, (segmentations, embeddings))
+        if self.cache_dir is None:
+            return
+        data_fp, meta_fp = self._paths(key)
+        frames = segmentations.sliding_window
+        meta = {"start": frames.start, "duration": frames.duration, "step": frames.step}
+        arrays = {"segmentations": np.asarray(segmentations.data)}
+        if embeddings is not None:
+            arrays["embeddings"] = np.asarray(embeddings)
+        # write to uniquely named temporary files first, so that concurrent readers never see partial entries
+        # and concurrent writers of the same entry (processes or threads) never share them
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            np.savez(f, **arrays)
+        tmp_data_fp = f.name
+        with tempfile.NamedTemporaryFile("w", dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            json.dump(meta, f)
+        os.replace(f.name, meta_fp)
+        os.replace(tmp_data_fp, data_fp)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".npz")]))
+        total = sum(size for _, size, _ in entries)
+        # least recently used first
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for fp in self._paths(key):
+                try:
+                    os.remove(fp)
+                except FileNotFoundError:
+                    pass
+            total -= size
 
 
 class DiarizationPipeline:
@@ -13,58 +126,369 @@ class DiarizationPipeline:
         model_name="pyannote/speaker-diarization-3.1",
         use_auth_token=None,
         device: Optional[Union[str, torch.device]] = "cpu",
+        cache_dir: Optional[str] = None,
+        max_pending: Optional[int] = None,
     ):
         if isinstance(device, str):
             device = torch.device(device)
         self.model = Pipeline.from_pretrained(model_name, use_auth_token=use_auth_token).to(device)
+        # reclustering needs the segmentations and embeddings, only hash the audio and keep them when asked to
+        self.cache = DiarizationCache(model_name, cache_dir=cache_dir) if cache_dir is not None else None
+        self._last_key: Optional[str] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # every submitted file holds its decoded audio until it is diarized
+        self._pending = threading.BoundedSemaphore(max_pending) if max_pending is not None else None
 
-    def __call__(self, audio: Union[str, np.ndarray], num_speakers=None, min_speakers=None, max_speakers=None):
+    def __call__(self, audio: Union[str, np.ndarray], num_speakers=None, min_speakers=None, max_speakers=None, chunk_duration: Optional[float] = None, chunk_overlap: float = 30.0):
+        """
+        Diarize the audio into a DataFrame of speaker turns.
+        With `chunk_duration` (in seconds), audio longer than that is diarized in overlapping windows, see `diarize_chunked`.
+        """
+        if isinstance(audio, str) and chunk_duration is not None:
+            # decode the file window by window instead of holding all of it
+            segments = self.diarize_chunked(audio, chunk_duration, chunk_overlap, num_speakers=num_speakers, min_speakers=min_speakers, max_speakers=max_speakers)
+            return diarization_dataframe(segments)
         if isinstance(audio, str):
             audio = load_audio(audio)
+        if chunk_duration is not None and len(audio) > chunk_duration * SAMPLE_RATE:
+            segments = self.diarize_chunked(audio, chunk_duration, chunk_overlap, num_speakers=num_speakers, min_speakers=min_speakers, max_speakers=max_speakers)
+        elif self.cache is not None:
+            segments = self._diarize_cached(audio, num_speakers=num_speakers, min_speakers=min_speakers, max_speakers=max_speakers)
+        else:
+            audio_data = {
+                'waveform': torch.from_numpy(audio[None, :]),
+                'sample_rate': SAMPLE_RATE
+            }
+            segments = self.model(audio_data, num_speakers = num_speakers, min_speakers=min_speakers, max_speakers=max_speakers)
+        return diarization_dataframe(segments)
+
+    def _diarize_cached(self, audio: np.ndarray, num_speakers=None, min_speakers=None, max_speakers=None) -> Annotation:
+        """Diarize, reusing the cached segmentations and embeddings of the audio or caching them."""
+        key = self.cache.key(audio)
+        self._last_key = key
+        intermediates = self.cache.get(key)
+        if intermediates is not None:
+            return cluster_diarization(self.model, *intermediates, num_speakers=num_speakers, min_speakers=min_speakers, max_speakers=max_speakers)
+
+        intermediates = {}
+
+        def hook(step_name, step_artefact, file=None, total=None, completed=None):
+            # keep the final artefacts of the two expensive steps, not their progress updates
+            if completed is None and step_name in ("segmentation", "embeddings"):
+                intermediates[step_name] = step_artefact
+
         audio_data = {
             'waveform': torch.from_numpy(audio[None, :]),
             'sample_rate': SAMPLE_RATE
         }
-        segments = self.model(audio_data, num_speakers = num_speakers, min_speakers=min_speakers, max_speakers=max_speakers)
-        diarize_df = pd.DataFrame(segments.itertracks(yield_label=True), columns=['segment', 'label', 'speaker'])
-        diarize_df['start'] = diarize_df['segment'].apply(lambda x: x.start)
-        diarize_df['end'] = diarize_df['segment'].apply(lambda x: x.end)
-        return diarize_df
+        segments = self.model(audio_data, num_speakers = num_speakers, min_speakers=min_speakers, max_speakers=max_speakers, hook=hook)
+        self.cache.put(key, intermediates["segmentation"], intermediates.get("embeddings"))
+        return segments
+
+    def recluster(self, audio: Optional[Union[str, np.ndarray]] = None, num_speakers=None, min_speakers=None, max_speakers=None) -> pd.DataFrame:
+        """
+        Diarize again with other speaker counts, running only the clustering step on the cached segmentations and
+        embeddings of `audio` (by default the audio diarized last).
+        Requires a `cache_dir`, and is not available for chunked diarization.
+        """
+        if self.cache is None:
+            raise ValueError("Reclustering needs the pipeline to be created with a cache_dir")
+        if audio is None:
+            key = self._last_key
+        else:
+            if isinstance(audio, str):
+                audio = load_audio(audio)
+            key = self.cache.key(audio)
+        intermediates = self.cache.get(key) if key is not None else None
+        if intermediates is None:
+            raise ValueError("No cached segmentations and embeddings, the audio has to be diarized (unchunked) first")
+        segments = cluster_diarization(self.model, *intermediates, num_speakers=num_speakers, min_speakers=min_speakers, max_speakers=max_speakers)
+        return diarization_dataframe(segments)
+
+    def submit(self, audio: Union[str, np.ndarray], **kwargs) -> Future:
+        """
+        Diarize on a background thread, e.g. while Whisper transcribes the same audio; the decoded array is shared
+        with the caller, not copied. Files are diarized one at a time, in the order they are submitted.
+        With `max_pending`, this blocks until fewer than that many submitted files are still waiting or running.
+        Returns a future of the `diarize_df`, `kwargs` are passed on to `__call__`.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diarize")
+        if self._pending is None:
+            return self._executor.submit(self, audio, **kwargs)
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(self, audio, **kwargs)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def diarize_chunked(self, audio: Union[str, np.ndarray], chunk_duration: float = 600.0, chunk_overlap: float = 30.0, num_speakers=None, min_speakers=None, max_speakers=None) -> Annotation:
+        """
+        Diarize the audio in windows of `chunk_duration` seconds overlapping by `chunk_overlap` seconds, so that
+        the memory of the pyannote pipeline (its segmentations, embeddings and their pairwise distances) is bounded
+        by the window length instead of the file length.
+        Every window is diarized on its own with its speaker embeddings, and keeps the turns of its core, the part
+        closer to it than to its neighbours. The speakers of all windows are then linked by clustering their
+        embeddings, see `link_speakers`.
+        Given the path of the audio file, only the current window is decoded.
+        """
+        step = chunk_duration - chunk_overlap
+        if step <= 0:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be shorter than chunk_duration ({chunk_duration})")
+
+        turns = []  # (start, end, window speaker)
+        embeddings = []
+        for window, (start, window_audio, last) in enumerate(iter_windows(audio, chunk_duration, step)):
+            if window == 0 and last:
+                # shorter than a single window
+                if self.cache is not None:
+                    return self._diarize_cached(window_audio, num_speakers=num_speakers, min_speakers=min_speakers, max_speakers=max_speakers)
+                audio_data = {'waveform': torch.from_numpy(window_audio[None, :]), 'sample_rate': SAMPLE_RATE}
+                return self.model(audio_data, num_speakers=num_speakers, min_speakers=min_speakers, max_speakers=max_speakers)
+            end = start + len(window_audio) / SAMPLE_RATE
+            audio_data = {
+                'waveform': torch.from_numpy(window_audio[None, :]),
+                'sample_rate': SAMPLE_RATE
+            }
+            # windows may hold fewer speakers than the file, only bound their number
+            diarization, centroids = self.model(audio_data, max_speakers=num_speakers or max_speakers, return_embeddings=True)
+            core_start = start + chunk_overlap / 2 if window > 0 else 0.0
+            core_end = end - chunk_overlap / 2 if not last else math.inf
+            for label, centroid in zip(diarization.labels(), centroids):
+                for turn in diarization.label_timeline(label):
+                    turn_start = max(turn.start + start, core_start)
+                    turn_end = min(turn.end + start, core_end)
+                    if turn_end > turn_start:
+                        turns.append((turn_start, turn_end, len(embeddings)))
+                embeddings.append(centroid)
+
+        if len(embeddings) == 0:
+            return Annotation()
+        clustering = getattr(self.model, "clustering", None)
+        speakers = link_speakers(
+            np.array(embeddings).reshape(len(embeddings), -1),
+            threshold=getattr(clustering, "threshold", 0.7),
+            method=getattr(clustering, "method", "centroid"),
+            num_speakers=num_speakers,
+            min_speakers=min_speakers,
+            max_speakers=max_speakers,
+        )
+
+        # name the speakers in order of appearance
+        turns.sort()
+        names = {}
+        annotation = Annotation()
+        for turn_start, turn_end, speaker in turns:
+            name = names.setdefault(speakers[speaker], f"SPEAKER_{len(names):02d}")
+            annotation[TurnSegment(turn_start, turn_end)] = name
+        # merge the turns cut at the window cores
+        return annotation.support()
+
+
+def iter_windows(audio: Union[str, np.ndarray], chunk_duration: float, step: float):
+    """
+    Yield `(start, samples, last)` for the windows of `chunk_duration` seconds every `step` seconds of the audio,
+    the last window holds the rest of the audio. Audio files are decoded one window at a time.
+    """
+    duration = get_duration(audio) if isinstance(audio, str) else len(audio) / SAMPLE_RATE
+    num_windows = max(1, math.ceil((duration - (chunk_duration - step)) / step))
+    for window in range(num_windows):
+        start = window * step
+        last = window == num_windows - 1
+        if isinstance(audio, str):
+            samples = load_audio(audio, start=start, duration=None if last else chunk_duration)
+            # the probed duration of compressed files can be off, stop at the actual end of the audio
+            if len(samples) == 0 and window > 0:
+                return
+            last = last or len(samples) < int(chunk_duration * SAMPLE_RATE)
+        else:
+            end = duration if last else start + chunk_duration
+            samples = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        yield start, samples, last
+        if last:
+            return
+
+
+def cluster_diarization(pipeline, segmentations: SlidingWindowFeature, embeddings: Optional[np.ndarray], num_speakers=None, min_speakers=None, max_speakers=None) -> Annotation:
+    """
+    The steps of `SpeakerDiarization.apply` after the segmentation and embedding extraction: speaker counting,
+    clustering of the embeddings and reconstruction of the speaker turns.
+    """
+    num_speakers, min_speakers, max_speakers = pipeline.set_num_speakers(
+        num_speakers=num_speakers,
+        min_speakers=min_speakers,
+        max_speakers=max_speakers,
+    )
+
+    if pipeline._segmentation.model.specifications.powerset:
+        binarized_segmentations = segmentations
+    else:
+        binarized_segmentations = binarize(segmentations, onset=pipeline.segmentation.threshold, initial_state=False)
+
+    count = pipeline.speaker_count(binarized_segmentations, frames=pipeline._frames, warm_up=(0.0, 0.0))
+    # no speaker is ever active
+    if np.nanmax(count.data) == 0.0:
+        return Annotation()
+
+    hard_clusters, _, _ = pipeline.clustering(
+        embeddings=embeddings,
+        segmentations=binarized_segmentations,
+        num_clusters=num_speakers,
+        min_clusters=min_speakers,
+        max_clusters=max_speakers,
+        frames=pipeline._frames,
+    )
+    count.data = np.minimum(count.data, max_speakers).astype(np.int8)
+
+    # keep track of inactive speakers
+    inactive_speakers = np.sum(binarized_segmentations.data, axis=1) == 0
+    hard_clusters[inactive_speakers] = -2
+    discrete_diarization = pipeline.reconstruct(segmentations, hard_clusters, count)
+    diarization = pipeline.to_annotation(
+        discrete_diarization,
+        min_duration_on=0.0,
+        min_duration_off=pipeline.segmentation.min_duration_off,
+    )
+    mapping = {label: expected_label for label, expected_label in zip(diarization.labels(), pipeline.classes())}
+    return diarization.rename_labels(mapping=mapping)
+
+
+def diarization_dataframe(segments: Annotation) -> pd.DataFrame:
+    diarize_df = pd.DataFrame(segments.itertracks(yield_label=True), columns=['segment', 'label', 'speaker'])
+    diarize_df['start'] = diarize_df['segment'].apply(lambda x: x.start)
+    diarize_df['end'] = diarize_df['segment'].apply(lambda x: x.end)
+    return diarize_df
+
+
+def link_speakers(embeddings: np.ndarray, threshold: float, method: str = "centroid", num_speakers=None, min_speakers=None, max_speakers=None) -> np.ndarray:
+    """
+    Global speaker of every window speaker, by agglomerative clustering of their normalized embeddings
+    (cut at `threshold`, or into `num_speakers` / at least `min_speakers` / at most `max_speakers` clusters).
+    Window speakers without embedding (pyannote pads them with zeros) keep a speaker of their own.
+    """
+    speakers = np.arange(len(embeddings))
+    norms = np.linalg.norm(embeddings, axis=1)
+    valid = np.isfinite(norms) & (norms > 0)
+    if valid.sum() < 2:
+        return speakers
+
+    tree = linkage(embeddings[valid] / norms[valid, None], method=method, metric="euclidean")
+    clusters = fcluster(tree, threshold, criterion="distance") - 1
+    num_clusters = clusters.max() + 1
+    if num_speakers is not None:
+        num_clusters = num_speakers
+    elif min_speakers is not None and num_clusters < min_speakers:
+        num_clusters = min_speakers
+    elif max_speakers is not None and num_clusters > max_speakers:
+        num_clusters = max_speakers
+    if num_clusters != clusters.max() + 1:
+        # replay all merges but the last ones, centroid linkage heights are not monotonic
+        # so the tree cannot be cut at a distance
+        num_embeddings = len(tree) + 1
+        members = {i: [i] for i in range(num_embeddings)}
+        for merge, (a, b) in enumerate(tree[:num_embeddings - min(num_clusters, num_embeddings), :2].astype(int)):
+            members[num_embeddings + merge] = members.pop(a) + members.pop(b)
+        for cluster, indices in enumerate(members.values()):
+            clusters[indices] = cluster
+    speakers[valid] = clusters
+    speakers[~valid] = clusters.max() + 1 + np.arange((~valid).sum())
+    return speakers
 
 
 def assign_word_speakers(diarize_df, transcript_result, fill_nearest=False):
+    """
+    Assign every segment and (aligned) word the speaker whose turns in `diarize_df` overlap it the most in total,
+    ties going to the first speaker in sorted order. With `fill_nearest`, all turns are summed, including the
+    negative overlaps of turns that do not reach it, so that every segment and word gets a speaker.
+    `diarize_df` is not modified.
+    """
     transcript_segments = transcript_result["segments"]
+    items = []
     for seg in transcript_segments:
-        # assign speaker to segment (if any)
-        diarize_df['intersection'] = np.minimum(diarize_df['end'], seg['end']) - np.maximum(diarize_df['start'], seg['start'])
-        diarize_df['union'] = np.maximum(diarize_df['end'], seg['end']) - np.minimum(diarize_df['start'], seg['start'])
-        # remove no hit, otherwise we look for closest (even negative intersection...)
-        if not fill_nearest:
-            dia_tmp = diarize_df[diarize_df['intersection'] > 0]
-        else:
-            dia_tmp = diarize_df
-        if len(dia_tmp) > 0:
-            # sum over speakers
-            speaker = dia_tmp.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
-            seg["speaker"] = speaker
-        
-        # assign speaker to words
+        items.append(seg)
         if 'words' in seg:
-            for word in seg['words']:
-                if 'start' in word:
-                    diarize_df['intersection'] = np.minimum(diarize_df['end'], word['end']) - np.maximum(diarize_df['start'], word['start'])
-                    diarize_df['union'] = np.maximum(diarize_df['end'], word['end']) - np.minimum(diarize_df['start'], word['start'])
-                    # remove no hit
-                    if not fill_nearest:
-                        dia_tmp = diarize_df[diarize_df['intersection'] > 0]
-                    else:
-                        dia_tmp = diarize_df
-                    if len(dia_tmp) > 0:
-                        # sum over speakers
-                        speaker = dia_tmp.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
-                        word["speaker"] = speaker
-        
-    return transcript_result            
+            items += [word for word in seg['words'] if 'start' in word]
+    if len(items) == 0 or len(diarize_df) == 0:
+        return transcript_result
+
+    starts = np.array([item['start'] for item in items], dtype=float)
+    ends = np.array([item['end'] for item in items], dtype=float)
+    speakers, turn_speakers = np.unique(diarize_df['speaker'].to_numpy(), return_inverse=True)
+    turn_starts = diarize_df['start'].to_numpy(dtype=float)
+    turn_ends = diarize_df['end'].to_numpy(dtype=float)
+
+    if fill_nearest:
+        best = nearest_speakers(starts, ends, turn_starts, turn_ends, turn_speakers, len(speakers))
+    else:
+        best = overlapping_speakers(starts, ends, turn_starts, turn_ends, turn_speakers)
+    for item, speaker in zip(items, best):
+        if speaker >= 0:
+            item["speaker"] = speakers[speaker]
+
+    return transcript_result
+
+
+def overlapping_speakers(starts, ends, turn_starts, turn_ends, turn_speakers) -> np.ndarray:
+    """
+    Index of the speaker with the largest total overlap of every (start, end) interval, -1 if no turn overlaps it.
+    Turns are sorted by start, so that the turns overlapping an interval are within the range of turns starting
+    before its end and ending (as far as the running maximum of the ends goes) after its start.
+    """
+    order = np.argsort(turn_starts, kind="stable")
+    lo = np.searchsorted(np.maximum.accumulate(turn_ends[order]), starts, side="right")
+    hi = np.searchsorted(turn_starts[order], ends, side="left")
+    counts = np.maximum(hi - lo, 0)
+
+    # all (interval, candidate turn) pairs
+    query = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    turn = order[np.repeat(lo, counts) + offsets]
+    intersection = np.minimum(turn_ends[turn], ends[query]) - np.maximum(turn_starts[turn], starts[query])
+    hit = intersection > 0
+    query, turn, intersection = query[hit], turn[hit], intersection[hit]
+
+    best = np.full(len(starts), -1)
+    if len(query) == 0:
+        return best
+
+    # sum over speakers, in the order of the turns
+    pairs = np.lexsort((turn, turn_speakers[turn], query))
+    query, speaker, intersection = query[pairs], turn_speakers[turn][pairs], intersection[pairs]
+    groups = np.flatnonzero(np.r_[True, (query[1:] != query[:-1]) | (speaker[1:] != speaker[:-1])])
+    sums = np.add.reduceat(intersection, groups)
+    query, speaker = query[groups], speaker[groups]
+
+    # largest sum of every interval, ties to the first speaker
+    ranked = np.lexsort((speaker, -sums, query))
+    query, speaker = query[ranked], speaker[ranked]
+    first = np.r_[True, query[1:] != query[:-1]]
+    best[query[first]] = speaker[first]
+    return best
+
+
+def nearest_speakers(starts, ends, turn_starts, turn_ends, turn_speakers, num_speakers: int) -> np.ndarray:
+    """
+    Index of the speaker with the largest total (possibly negative) overlap of every (start, end) interval over
+    all of its turns, the sums of `min(turn_end, end)` and `max(turn_start, start)` are taken from prefix sums of
+    the sorted turn ends and starts of every speaker.
+    """
+    scores = np.empty((num_speakers, len(starts)))
+    for speaker in range(num_speakers):
+        speaker_starts = np.sort(turn_starts[turn_speakers == speaker])
+        speaker_ends = np.sort(turn_ends[turn_speakers == speaker])
+        start_sums = np.r_[0, np.cumsum(speaker_starts)]
+        end_sums = np.r_[0, np.cumsum(speaker_ends)]
+        # turns ending before the end count their own end, the others the interval end
+        num_before = np.searchsorted(speaker_ends, ends)
+        min_ends = end_sums[num_before] + ends * (len(speaker_ends) - num_before)
+        # turns starting before the start count the interval start, the others their own start
+        num_before = np.searchsorted(speaker_starts, starts)
+        max_starts = starts * num_before + (start_sums[-1] - start_sums[num_before])
+        scores[speaker] = min_ends - max_starts
+    return np.argmax(scores, axis=0)
 
 
 class Segment:
@@ -0,0 +1,194 @@
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+from .asr import FasterWhisperPipeline
+from .audio import AudioCache, load_audio
+from .types import TranscriptionResult
+
+# marks the end of a stage's input
+_DONE = object()
+
+
+class PipelinedExecutor:
+    """
+    Producer/consumer executor around `FasterWhisperPipeline`.
+    Audio decoding and VAD of the next files run on worker threads while the current file is in `model.generate`,
+    with bounded queues between the stages so that at most a few decoded files are held in memory.
+    ffmpeg, torch and ctranslate2 all release the GIL, so the stages overlap even on CPU-only machines.
+
+    Args:
+        model: FasterWhisperPipeline - The pipeline running VAD and ASR.
+        decode_workers: int - Number of threads decoding audio files.
+        vad_workers: int - Number of threads running VAD.
+        queue_size: int - Maximum number of files waiting between two stages.
+        audio_cache: Optional[AudioCache] - Cache of the decoded audio files, decoded with ffmpeg every time if not given.
+        on_decoded: Optional[Callable[[int, np.ndarray], None]] - Called on the decode thread with the index and the
+            audio of every file as soon as it is decoded, e.g. to start its diarization.
+        transcribe_kwargs: dict - Passed on to `FasterWhisperPipeline.transcribe` (and the VAD chunk sizes to `get_vad_segments`).
+    """
+
+    def __init__(
+        self,
+        model: FasterWhisperPipeline,
+        decode_workers: int = 2,
+        vad_workers: int = 1,
+        queue_size: int = 2,
+        audio_cache: Optional[AudioCache] = None,
+        on_decoded: Optional[Callable[[int, np.ndarray], None]] = None,
+        **transcribe_kwargs,
+    ):
+        self.model = model
+        self.decode_workers = decode_workers
+        self.vad_workers = vad_workers
+        self.queue_size = queue_size
+        self.audio_cache = audio_cache
+        self.on_decoded = on_decoded
+        self.transcribe_kwargs = transcribe_kwargs
+        self._stop = threading.Event()
+
+    def __call__(self, audios: Iterable[Union[str, np.ndarray]]) -> Iterator[Tuple[int, np.ndarray, TranscriptionResult]]:
+        """
+        Transcribe the audio files, yielding `(index, audio, result)` in the order files finish VAD.
+        Errors of `audios` itself, decoding and VAD are raised here, the worker threads stop once this iterator
+        raises or is closed.
+        """
+        self._stop.clear()
+        inputs = queue.Queue(self.queue_size)
+        decoded = queue.Queue(self.queue_size)
+        segmented = queue.Queue(self.queue_size)
+
+        vad_kwargs = {
+            key: self.transcribe_kwargs[key]
+            for key in ["outer_chunk_size", "inner_chunk_size", "reuse_vad_scores"]
+            if key in self.transcribe_kwargs
+        }
+
+        def decode(idx, audio):
+            if isinstance(audio, str):
+                audio = self.audio_cache.load(audio) if self.audio_cache is not None else load_audio(audio)
+            if self.on_decoded is not None:
+                self.on_decoded(idx, audio)
+            return audio
+
+        def vad(idx, audio):
+            return audio, self.model.get_vad_segments(audio, **vad_kwargs)
+
+        threads = [threading.Thread(target=self._feed, args=(audios, inputs), daemon=True)]
+        threads += self._stage(decode, inputs, decoded, self.decode_workers)
+        threads += self._stage(vad, decoded, segmented, self.vad_workers)
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = segmented.get()
+                if item is _DONE:
+                    break
+                idx, value = item
+                if isinstance(value, BaseException):
+                    raise value
+                audio, vad_segments = value
+                result = self.model.transcribe(audio, vad_segments=vad_segments, **self.transcribe_kwargs)
+                yield idx, audio, result
+        finally:
+            # unblock the producers if the consumer stops early
+            self._stop.set()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, audios, outbox: queue.Queue):
+        idx = -1
+        try:
+            for idx, audio in enumerate(audios):
+                if not self._put(outbox, (idx, audio)):
+                    return
+        except Exception as e:
+            # e.g. a lazy list of files failing, passed through the stages and raised in the consumer
+            if not self._put(outbox, (idx + 1, e)):
+                return
+        self._put(outbox, _DONE)
+
+    def _stage(self, fn: Callable, inbox: queue.Queue, outbox: queue.Queue, num_workers: int):
+        """Worker threads applying `fn(idx, value)` to the items of `inbox` and putting the results on `outbox`."""
+        num_workers = max(num_workers, 1)
+        remaining = [num_workers]
+        lock = threading.Lock()
+
+        def work():
+            while not self._stop.is_set():
+                try:
+                    item = inbox.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    # let the other workers of this stage stop too, the last one closes the next stage
+                    self._put(inbox, _DONE)
+                    with lock:
+                        remaining[0] -= 1
+                        last = remaining[0] == 0
+                    if last:
+                        self._put(outbox, _DONE)
+                    return
+                idx, value = item
+                if not isinstance(value, BaseException):
+                    try:
+                        value = fn(idx, value)
+                    except Exception as e:
+                        value = e
+                if not self._put(outbox, (idx, value)):
+                    return
+
+        return [threading.Thread(target=work, daemon=True) for _ in range(num_workers)]
+
+
+def prefetch(iterable: Iterable, queue_size: int = 2) -> Iterator:
+    """
+    Iterate `iterable` on a worker thread, at most `queue_size` items ahead of the consumer,
+    e.g. to decode the next Whisper batches of `FasterWhisperPipeline.transcribe_stream` while the
+    segments already decoded are aligned. Exceptions of the worker are raised in the consumer.
+    """
+    outbox = queue.Queue(queue_size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((None, e))
+            return
+        put(_DONE)
+
+    threading.Thread(target=work, daemon=True).start()
+    try:
+        while True:
+            item = outbox.get()
+            if item is _DONE:
+                return
+            value, error = item
+            if error is not None:
+                raise error
+            yield value
+    finally:
+        # unblock the worker if the consumer stops early
+        stop.set()
@@ -0,0 +1,103 @@
+import gc
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+import torch
+from pyannote.audio import Inference
+from pyannote.audio.core.pipeline import Pipeline
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models (Whisper, VAD pipelines, alignment models), so that repeated
+    `load_model`/`load_align_model` calls, e.g. one per combination of a hyperparameter sweep, reuse the weights.
+    Entries are evicted least recently used first once `max_bytes` or `max_entries` is exceeded, or explicitly
+    with `evict`/`clear`.
+
+    Args:
+        max_bytes: Optional[int] - Memory budget of all entries, estimated from the model weights. None for no limit.
+        max_entries: Optional[int] - Maximum number of entries. None for no limit.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, max_entries: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._nbytes = {}
+        self._lock = threading.RLock()
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], nbytes: Optional[int] = None) -> Any:
+        """
+        Return the entry of `key`, calling `loader()` to create it on a miss.
+        `nbytes` is the memory cost of the entry, estimated from its torch modules if not given.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            value = loader()
+            self._entries[key] = value
+            self._nbytes[key] = estimate_nbytes(value) if nbytes is None else nbytes
+            self._enforce_budget()
+            return value
+
+    def evict(self, key: Hashable) -> bool:
+        """Drop the entry of `key`, returns whether it was cached."""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            del self._entries[key]
+            del self._nbytes[key]
+        release_memory()
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes.clear()
+        release_memory()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self._nbytes.values())
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _enforce_budget(self):
+        evicted = False
+        # never evict the entry that was just added, even if it alone exceeds the budget
+        while len(self._entries) > 1 and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            key, _ = self._entries.popitem(last=False)
+            del self._nbytes[key]
+            evicted = True
+        if evicted:
+            release_memory()
+
+
+def estimate_nbytes(value: Any) -> int:
+    """Size of the torch weights held by `value`, 0 for objects it does not know about (e.g. ctranslate2 models)."""
+    if isinstance(value, torch.nn.Module):
+        return sum(t.numel() * t.element_size() for t in itertools.chain(value.parameters(), value.buffers()))
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, Pipeline):
+        return sum(estimate_nbytes(v.model) for v in vars(value).values() if isinstance(v, Inference))
+    return 0
+
+
+def release_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+MODEL_REGISTRY = ModelRegistry()
@@ -2,14 +2,17 @@ import argparse
 import gc
 import os
 import warnings
+from typing import Optional
 
 import numpy as np
 import torch
 
-from .alignment import align, load_align_model
+from .alignment import align, align_stream, load_align_model
 from .asr import load_model
-from .audio import load_audio
+from .audio import AudioCache, load_audio
 from .diarize import DiarizationPipeline, assign_word_speakers
+from .executor import PipelinedExecutor, prefetch
+from .registry import ModelRegistry
 from .utils import (LANGUAGES, TO_LANGUAGE_CODE, get_writer, optional_float,
                     optional_int, str2bool)
 
@@ -37,6 +40,13 @@ def cli():
     parser.add_argument("--interpolate_method", default="nearest", choices=["nearest", "linear", "ignore"], help="For word .srt, method to assign timestamps to non-aligned words, or merge them into neighbouring.")
     parser.add_argument("--no_align", action='store_true', help="Do not perform phoneme alignment")
     parser.add_argument("--return_char_alignments", action='store_true', help="Return character-level alignments in the output json file")
+    parser.add_argument("--align_batch_size", default=1, type=int, help="number of segments of similar length to run through the alignment model at once, models normalizing with group norm (e.g. the default English one) only batch segments of equal length")
+    parser.add_argument("--align_kernel", default="numpy", choices=["python", "numpy", "torchaudio", "banded"], help="forced alignment implementation, torchaudio uses CTC forced_align and gives slightly different timestamps, banded bounds the memory of long segments")
+    parser.add_argument("--align_preprocess_workers", default=0, type=int, help="number of processes preprocessing the transcript text for alignment, 0 to preprocess in the main process")
+    parser.add_argument("--align_band_width", default=250, type=int, help="(banded align kernel) number of frames (20ms) a character may be aligned away from its linear time prior, widened automatically if alignment fails")
+    parser.add_argument("--stream_align", action="store_true", help="align the segments of every file while it is being transcribed, keeping the Whisper and alignment models loaded at once")
+    parser.add_argument("--align_cache_size", default=1, type=int, help="number of alignment models (one per language) kept loaded at once")
+    parser.add_argument("--align_cache_memory", default=None, type=optional_float, help="memory budget in GB of the loaded alignment models, the least recently used ones are unloaded first")
 
     # vad params
     parser.add_argument("--vad_onset", type=float, default=0.500, help="Onset threshold for VAD (see pyannote.audio), reduce this if speech is not being detected")
@@ -47,6 +57,10 @@ def cli():
     parser.add_argument("--diarize", action="store_true", help="Apply diarization to assign speaker labels to each segment/word")
     parser.add_argument("--min_speakers", default=None, type=int, help="Minimum number of speakers to in audio file")
     parser.add_argument("--max_speakers", default=None, type=int, help="Maximum number of speakers to in audio file")
+    parser.add_argument("--diarize_cache_dir", default=None, type=str, help="directory to cache the diarization segmentations and speaker embeddings in, so that reruns with other speaker counts only repeat the clustering")
+    parser.add_argument("--diarize_concurrent", action="store_true", help="diarize every file on a background thread as soon as it is decoded, while it is transcribed and aligned")
+    parser.add_argument("--diarize_chunk_duration", default=None, type=optional_float, help="diarize files longer than this many seconds in overlapping windows of that length, bounding the memory of long recordings")
+    parser.add_argument("--diarize_chunk_overlap", default=30.0, type=float, help="(chunked diarization) overlap in seconds between consecutive windows")
 
     parser.add_argument("--temperature", type=float, default=0, help="temperature to use for sampling")
     parser.add_argument("--best_of", type=optional_int, default=5, help="number of candidates when sampling with non-zero temperature")
@@ -76,6 +90,12 @@ def cli():
     parser.add_argument("--hf_token", type=str, default=None, help="Hugging Face Access Token to access PyAnnote gated models")
 
     parser.add_argument("--print_progress", type=str2bool, default = False, help = "if True, progress will be printed in transcribe() and align() methods.")
+
+    parser.add_argument("--pipelined", action="store_true", help="decode and run VAD on the next audio files on worker threads while the current file is being transcribed")
+    parser.add_argument("--decode_workers", type=int, default=2, help="(requires --pipelined) number of threads decoding audio files")
+    parser.add_argument("--vad_workers", type=int, default=1, help="(requires --pipelined) number of threads running VAD")
+    parser.add_argument("--queue_size", type=int, default=2, help="(requires --pipelined or --diarize_concurrent) maximum number of files waiting between two stages, or for diarization")
+    parser.add_argument("--audio_cache_dir", type=str, default=None, help="directory to cache the decoded audio files in, memory-mapped by every stage and rerun instead of decoding them again with ffmpeg")
     # fmt: on
 
     args = parser.parse_args().__dict__
@@ -100,6 +120,13 @@ def cli():
         no_align = True
 
     return_char_alignments: bool = args.pop("return_char_alignments")
+    align_batch_size: int = args.pop("align_batch_size")
+    align_kernel: str = args.pop("align_kernel")
+    align_band_width: int = args.pop("align_band_width")
+    align_preprocess_workers: int = args.pop("align_preprocess_workers")
+    align_cache_size: int = args.pop("align_cache_size")
+    align_cache_memory: Optional[float] = args.pop("align_cache_memory")
+    stream_align: bool = args.pop("stream_align")
 
     hf_token: str = args.pop("hf_token")
     vad_onset: float = args.pop("vad_onset")
@@ -110,7 +137,16 @@ def cli():
     diarize: bool = args.pop("diarize")
     min_speakers: int = args.pop("min_speakers")
     max_speakers: int = args.pop("max_speakers")
+    diarize_chunk_duration: Optional[float] = args.pop("diarize_chunk_duration")
+    diarize_chunk_overlap: float = args.pop("diarize_chunk_overlap")
+    diarize_concurrent: bool = args.pop("diarize_concurrent") and diarize
+    diarize_cache_dir: Optional[str] = args.pop("diarize_cache_dir")
     print_progress: bool = args.pop("print_progress")
+    pipelined: bool = args.pop("pipelined")
+    decode_workers: int = args.pop("decode_workers")
+    vad_workers: int = args.pop("vad_workers")
+    queue_size: int = args.pop("queue_size")
+    audio_cache_dir: Optional[str] = args.pop("audio_cache_dir")
 
     if args["language"] is not None:
         args["language"] = args["language"].lower()
@@ -162,19 +198,77 @@ def cli():
     if args["max_line_count"] and not args["max_line_width"]:
         warnings.warn("--max_line_count has no effect without --max_line_width")
     writer_args = {arg: args.pop(arg) for arg in word_options}
+    if stream_align and pipelined:
+        parser.error("--stream_align not possible with --pipelined")
+    stream_align = stream_align and not no_align
     
+    align_models = ModelRegistry(
+        max_bytes=int(align_cache_memory * 1e9) if align_cache_memory is not None else None,
+        max_entries=align_cache_size,
+    )
+
+    def align_model_key(result):
+        language = result.get("language", "en")
+        # --align_model is for the --language (or english) files, the others use the default model of their language
+        return (language, align_model if language == align_language else None)
+
+    diarize_options = {"min_speakers": min_speakers, "max_speakers": max_speakers, "chunk_duration": diarize_chunk_duration, "chunk_overlap": diarize_chunk_overlap}
+    diarize_futures = {}
+    if diarize and hf_token is None:
+        print("Warning, no --hf_token used, needs to be saved in environment variable, otherwise will throw error loading diarization model...")
+    if diarize_concurrent:
+        # >> Diarize, every file as soon as it is decoded, on a background thread
+        # files waiting for diarization keep their audio in memory, so at most --queue_size of them are submitted
+        diarize_model = DiarizationPipeline(use_auth_token=hf_token, device=device, cache_dir=diarize_cache_dir, max_pending=queue_size)
+
     # Part 1: VAD & ASR Loop
     results = []
     tmp_results = []
     # model = load_model(model_name, device=device, download_root=model_dir)
     model = load_model(model_name, device=device, device_index=device_index, download_root=model_dir, compute_type=compute_type, language=args['language'], asr_options=asr_options, vad_options={"vad_onset": vad_onset, "vad_offset": vad_offset}, task=task, threads=faster_whisper_threads)
 
-    for audio_path in args.pop("audio"):
-        audio = load_audio(audio_path)
-        # >> VAD & ASR
-        print(">>Performing transcription...")
-        result = model.transcribe(audio, batch_size=batch_size, chunk_size=chunk_size, print_progress=print_progress)
-        results.append((result, audio_path))
+    audio_paths = args.pop("audio")
+    audio_cache = AudioCache(audio_cache_dir) if audio_cache_dir is not None else None
+    decode = audio_cache.load if audio_cache is not None else load_audio
+    if pipelined:
+        # >> VAD & ASR, overlapping decoding and VAD of the next files with transcription
+        print(">>Performing pipelined transcription...")
+        def submit_diarization(idx, audio):
+            # from the decode thread, so that diarization runs while the file waits for VAD and ASR
+            diarize_futures[idx] = diarize_model.submit(audio, **diarize_options)
+
+        executor = PipelinedExecutor(model, decode_workers=decode_workers, vad_workers=vad_workers, queue_size=queue_size, audio_cache=audio_cache, on_decoded=submit_diarization if diarize_concurrent else None, batch_size=batch_size, outer_chunk_size=chunk_size, print_progress=print_progress)
+        # files can finish out of order, keep the results in input order
+        ordered_results = [None] * len(audio_paths)
+        for idx, audio, result in executor(audio_paths):
+            ordered_results[idx] = (result, audio_paths[idx])
+        results.extend(ordered_results)
+    elif stream_align:
+        for audio_path in audio_paths:
+            audio = decode(audio_path)
+            if diarize_concurrent:
+                diarize_futures[len(results)] = diarize_model.submit(audio, **diarize_options)
+            # >> VAD & ASR & Align, aligning the segments decoded so far while Whisper decodes the next batches
+            print(">>Performing transcription with streaming alignment...")
+            language, segments = model.transcribe_stream(audio, batch_size=batch_size, outer_chunk_size=chunk_size, print_progress=print_progress)
+            language, align_model_name = align_model_key({"language": language})
+            if (language, align_model_name) not in align_models:
+                print(f"Loading alignment model for language ({language})...")
+            loaded_align_model, align_metadata = align_models.get_or_load(
+                (language, align_model_name), lambda: load_align_model(language, device, model_name=align_model_name)
+            )
+            aligned_segments = list(align_stream(prefetch(segments, queue_size), loaded_align_model, align_metadata, audio, device, interpolate_method=interpolate_method, return_char_alignments=return_char_alignments, batch_size=align_batch_size, align_kernel=align_kernel, band_width=align_band_width))
+            word_segments = [word for segment in aligned_segments for word in segment["words"]]
+            results.append(({"segments": aligned_segments, "word_segments": word_segments}, audio_path))
+    else:
+        for audio_path in audio_paths:
+            audio = decode(audio_path)
+            if diarize_concurrent:
+                diarize_futures[len(results)] = diarize_model.submit(audio, **diarize_options)
+            # >> VAD & ASR
+            print(">>Performing transcription...")
+            result = model.transcribe(audio, batch_size=batch_size, outer_chunk_size=chunk_size, print_progress=print_progress)
+            results.append((result, audio_path))
 
     # Unload Whisper and VAD
     del model
@@ -182,43 +276,54 @@ def cli():
     torch.cuda.empty_cache()
 
     # Part 2: Align Loop
-    if not no_align:
+    if not no_align and not stream_align:
         tmp_results = results
-        results = []
-        align_model, align_metadata = load_align_model(align_language, device, model_name=align_model)
-        for result, audio_path in tmp_results:
+        results = [None] * len(tmp_results)
+        # group the files by language so that every alignment model is loaded once, starting with --language
+        languages = [align_model_key(result)[0] for result, _ in tmp_results]
+        order = sorted(range(len(tmp_results)), key=lambda idx: (languages[idx] != align_language, languages[idx]))
+        for idx in order:
+            result, audio_path = tmp_results[idx]
             # >> Align
-            if len(tmp_results) > 1:
+            if audio_cache is not None:
+                # the memory-mapped audio of part 1, without decoding it again
+                input_audio = audio_cache.load(audio_path)
+            elif len(tmp_results) > 1:
                 input_audio = audio_path
             else:
                 # lazily load audio from part 1
                 input_audio = audio
 
-            if align_model is not None and len(result["segments"]) > 0:
-                if result.get("language", "en") != align_metadata["language"]:
-                    # load new language
-                    print(f"New language found ({result['language']})! Previous was ({align_metadata['language']}), loading new alignment model for new language...")
-                    align_model, align_metadata = load_align_model(result["language"], device)
+            if len(result["segments"]) > 0:
+                language, model_name = align_model_key(result)
+                if (language, model_name) not in align_models:
+                    print(f"Loading alignment model for language ({language})...")
+                loaded_align_model, align_metadata = align_models.get_or_load(
+                    (language, model_name), lambda: load_align_model(language, device, model_name=model_name)
+                )
                 print(">>Performing alignment...")
-                result = align(result["segments"], align_model, align_metadata, input_audio, device, interpolate_method=interpolate_method, return_char_alignments=return_char_alignments, print_progress=print_progress)
+                result = align(result["segments"], loaded_align_model, align_metadata, input_audio, device, interpolate_method=interpolate_method, return_char_alignments=return_char_alignments, print_progress=print_progress, batch_size=align_batch_size, align_kernel=align_kernel, band_width=align_band_width, preprocess_workers=align_preprocess_workers)
 
-            results.append((result, audio_path))
+            # keep the results in input order
+            results[idx] = (result, audio_path)
 
-        # Unload align model
-        del align_model
-        gc.collect()
-        torch.cuda.empty_cache()
+    # Unload align models
+    align_models.clear()
 
     # >> Diarize
     if diarize:
-        if hf_token is None:
-            print("Warning, no --hf_token used, needs to be saved in environment variable, otherwise will throw error loading diarization model...")
         tmp_results = results
-        print(">>Performing diarization...")
         results = []
-        diarize_model = DiarizationPipeline(use_auth_token=hf_token, device=device)
-        for result, input_audio_path in tmp_results:
-            diarize_segments = diarize_model(input_audio_path, min_speakers=min_speakers, max_speakers=max_speakers)
+        if diarize_concurrent:
+            print(">>Waiting for diarization...")
+        else:
+            print(">>Performing diarization...")
+            diarize_model = DiarizationPipeline(use_auth_token=hf_token, device=device, cache_dir=diarize_cache_dir)
+        for idx, (result, input_audio_path) in enumerate(tmp_results):
+            if diarize_concurrent:
+                diarize_segments = diarize_futures.pop(idx).result()
+            else:
+                diarize_segments = diarize_model(audio_cache.load(input_audio_path) if audio_cache is not None else input_audio_path, **diarize_options)
             result = assign_word_speakers(diarize_segments, result)
             results.append((result, input_audio_path))
     # >> Write
@@ -5,6 +5,8 @@ import sys
 import zlib
 from typing import Callable, Optional, TextIO
 
+import numpy as np
+
 LANGUAGES = {
     "en": "english",
     "zh": "chinese",
@@ -446,3 +448,25 @@ def interpolate_nans(x, method='nearest'):
         return x.interpolate(method=method).ffill().bfill()
     else:
         return x.ffill().bfill()
+
+def interpolate_nans_array(x: np.ndarray, method: str = 'nearest') -> np.ndarray:
+    """
+    `interpolate_nans` on a NumPy array: NaNs between values are interpolated with the "nearest" (ties go to the
+    previous value) or "linear" method, NaNs before the first / after the last value copy it.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    positions = np.flatnonzero(~np.isnan(x))
+    if len(positions) == 0:
+        return x.copy()
+    if len(positions) == 1:
+        return np.full_like(x, x[positions[0]])
+
+    indices = np.arange(len(x))
+    if method == "linear":
+        return np.interp(indices, positions, x[positions])
+    if method == "nearest":
+        previous = positions[np.maximum(np.searchsorted(positions, indices, side="right") - 1, 0)]
+        following = positions[np.minimum(np.searchsorted(positions, indices, side="left"), len(positions) - 1)]
+        nearest = np.where(following - indices < indices - previous, following, previous)
+        return x[nearest]
+    raise ValueError(f"Can not interpolate with method={method}.")
@@ -1,8 +1,10 @@
 import hashlib
+import json
 import os
 import urllib
 import pprint
-from typing import Callable, Optional, Text, Union
+import tempfile
+from typing import Callable, List, Optional, Text, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -11,17 +13,19 @@ from pyannote.audio import Model
 from pyannote.audio.core.io import AudioFile
 from pyannote.audio.pipelines import VoiceActivityDetection
 from pyannote.audio.pipelines.utils import PipelineModel
-from pyannote.core import Annotation, Segment, SlidingWindowFeature
+from pyannote.core import Annotation, Segment, SlidingWindow, SlidingWindowFeature
 from tqdm import tqdm
 
 from .diarize import Segment as SegmentX
+from .registry import MODEL_REGISTRY
 
 printer = pprint.PrettyPrinter(sort_dicts=False)
 
 
 VAD_SEGMENTATION_URL = "https://whisperx.s3.eu-west-2.amazonaws.com/model_weights/segmentation/0b5b3216d60a2d32fc086b47ea8c67589aaeb26b7e07fcbe620d6d0b83e209ea/pytorch_model.bin"
+VAD_SEGMENTATION_SHA256 = VAD_SEGMENTATION_URL.split('/')[-2]
 
-def load_vad_model(device, vad_onset=0.500, vad_offset=0.363, use_auth_token=None, model_fp=None, **kwargs):
+def load_vad_model(device, vad_onset=0.500, vad_offset=0.363, use_auth_token=None, model_fp=None, use_registry=False, **kwargs):
     model_dir = torch.hub._get_torch_home()
     os.makedirs(model_dir, exist_ok = True)
     if model_fp is None:
@@ -46,22 +50,60 @@ def load_vad_model(device, vad_onset=0.500, vad_offset=0.363, use_auth_token=Non
                     output.write(buffer)
                     loop.update(len(buffer))
 
-    model_bytes = open(model_fp, "rb").read()
-    if hashlib.sha256(model_bytes).hexdigest() != VAD_SEGMENTATION_URL.split('/')[-2]:
+    if file_sha256(model_fp) != VAD_SEGMENTATION_SHA256:
         raise RuntimeError(
             "Model has been downloaded but the SHA256 checksum does not not match. Please retry loading the model."
         )
 
-    vad_model = Model.from_pretrained(model_fp, use_auth_token=use_auth_token)
     hyperparameters = {"onset": vad_onset, 
                     "offset": vad_offset,
                     "min_duration_on": 0.0,
                     "min_duration_off": 0.0,
                     }
-    vad_pipeline = VoiceActivitySegmentation(segmentation=vad_model, device=torch.device(device))
-    vad_pipeline.instantiate(hyperparameters)
 
-    return vad_pipeline
+    def load():
+        vad_model = Model.from_pretrained(model_fp, use_auth_token=use_auth_token)
+        vad_pipeline = VoiceActivitySegmentation(segmentation=vad_model, device=torch.device(device))
+        vad_pipeline.instantiate(hyperparameters)
+        return vad_pipeline
+
+    if use_registry:
+        # `apply` returns the raw scores, the onset/offset are applied per call by `merge_chunks`
+        # with the caller's `vad_params`, so one pipeline is shared across thresholds
+        key = ("vad", str(device), os.path.abspath(model_fp))
+        return MODEL_REGISTRY.get_or_load(key, load)
+    return load()
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """
+    SHA-256 of a file, hashed in blocks. The digest is cached in a `<path>.sha256` sidecar keyed by the
+    file's mtime and size, so that an unchanged checkpoint is only hashed once.
+    """
+    stat = os.stat(path)
+    sidecar = path + ".sha256"
+    try:
+        with open(sidecar) as f:
+            cached = json.load(f)
+        if cached["mtime"] == stat.st_mtime and cached["size"] == stat.st_size:
+            return cached["sha256"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+    try:
+        tmp_path = f"{sidecar}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256}, f)
+        os.replace(tmp_path, sidecar)
+    except OSError:
+        # read-only model directory, hash again next time
+        pass
+    return sha256
 
 class Binarize:
     """Binarize detection scores using hysteresis thresholding, with min-cut operation
@@ -85,6 +127,9 @@ class Binarize:
         Defaults to 0s.
     max_duration: float
         The maximum length of an active segment, divides segment at timestamp with lowest score.
+    vectorized : bool, optional
+        Use the array-based hysteresis and min-cut engine instead of the frame-by-frame loop.
+        Both engines return identical regions. Defaults to False.
     Reference
     ---------
     Gregory Gelly and Jean-Luc Gauvain. "Minimum Word Error Training of
@@ -104,7 +149,8 @@ class Binarize:
         min_duration_off: float = 0.0,
         pad_onset: float = 0.0,
         pad_offset: float = 0.0,
-        max_duration: float = float('inf')
+        max_duration: float = float('inf'),
+        vectorized: bool = False,
     ):
 
         super().__init__()
@@ -120,6 +166,8 @@ class Binarize:
 
         self.max_duration = max_duration
 
+        self.vectorized = vectorized
+
     def __call__(self, scores: SlidingWindowFeature) -> Annotation:
         """Binarize detection scores
         Parameters
@@ -131,6 +179,27 @@ class Binarize:
         active : Annotation
             Binarized scores.
         """
+        if self.vectorized:
+            active = self._binarize_vectorized(scores)
+        else:
+            active = self._binarize(scores)
+
+        # because of padding, some active regions might be overlapping: merge them.
+        # also: fill same speaker gaps shorter than min_duration_off
+        if self.pad_offset > 0.0 or self.pad_onset > 0.0 or self.min_duration_off > 0.0:
+            if self.max_duration < float("inf"):
+                raise NotImplementedError(f"This would break current max_duration param")
+            active = active.support(collar=self.min_duration_off)
+
+        # remove tracks shorter than min_duration_on
+        if self.min_duration_on > 0:
+            for segment, track in list(active.itertracks()):
+                if segment.duration < self.min_duration_on:
+                    del active[segment, track]
+
+        return active
+
+    def _binarize(self, scores: SlidingWindowFeature) -> Annotation:
         num_frames, num_classes = scores.data.shape
         frames = scores.sliding_window
         timestamps = [frames[i].middle for i in range(num_frames)]
@@ -183,22 +252,131 @@ class Binarize:
                 region = Segment(start - self.pad_onset, t + self.pad_offset)
                 active[region, k] = label
 
-        # because of padding, some active regions might be overlapping: merge them.
-        # also: fill same speaker gaps shorter than min_duration_off
-        if self.pad_offset > 0.0 or self.pad_onset > 0.0 or self.min_duration_off > 0.0:
-            if self.max_duration < float("inf"):
-                raise NotImplementedError(f"This would break current max_duration param")
-            active = active.support(collar=self.min_duration_off)
+        return active
 
-        # remove tracks shorter than min_duration_on
-        if self.min_duration_on > 0:
-            for segment, track in list(active.itertracks()):
-                if segment.duration < self.min_duration_on:
-                    del active[segment, track]
+    def _binarize_vectorized(self, scores: SlidingWindowFeature) -> Annotation:
+        num_frames, num_classes = scores.data.shape
+        frames = scores.sliding_window
+        # same arithmetic as `frames[i].middle`, so timestamps match the loop bit for bit
+        frame_starts = frames.start + np.arange(num_frames) * frames.step
+        timestamps = 0.5 * (frame_starts + (frame_starts + frames.duration))
+
+        # annotation meant to store 'active' regions
+        active = Annotation()
+        for k, k_scores in enumerate(scores.data.T):
+
+            label = k if scores.labels is None else scores.labels[k]
+
+            for start, end in hysteresis_regions(timestamps, k_scores, self.onset, self.offset, self.max_duration):
+                region = Segment(start - self.pad_onset, end + self.pad_offset)
+                active[region, k] = label
 
         return active
 
 
+def hysteresis_regions(
+    timestamps: np.ndarray,
+    scores: np.ndarray,
+    onset: float,
+    offset: float,
+    max_duration: float = float('inf'),
+) -> List[Tuple[float, float]]:
+    """Array-based hysteresis thresholding with WhisperX's min-cut operation.
+
+    Instead of stepping through every frame, jumps from event to event: onset crossings and
+    offset crossings are looked up among precomputed indices, and max-duration cuts are placed
+    with one `argmin` over the pending index range. Reproduces the regions of the frame loop in
+    `Binarize._binarize` exactly, including its bookkeeping of the pending scores buffer.
+
+    Parameters
+    ----------
+    timestamps : np.ndarray
+        (num_frames,) frame middles, in seconds.
+    scores : np.ndarray
+        (num_frames,) detection scores of one class.
+    onset : float
+        Onset threshold.
+    offset : float
+        Offset threshold.
+    max_duration : float, optional
+        The maximum length of an active segment.
+
+    Returns
+    -------
+    regions : list of (start, end) tuples
+        Active regions, in the order the frame loop emits them.
+    """
+    num_frames = len(scores)
+    times = timestamps.tolist()
+    # compare in float64 like the loop does with float32 scores and Python float thresholds,
+    # scores equal to a threshold in float32 can be on the other side of it in float64
+    scores = np.asarray(scores, dtype=np.float64)
+    above = np.flatnonzero(scores > onset)
+    below = np.flatnonzero(scores < offset)
+
+    def next_index(indices, pos):
+        # first element of `indices` strictly after frame `pos`
+        i = np.searchsorted(indices, pos, side="right")
+        return int(indices[i]) if i < len(indices) else num_frames
+
+    def next_cut(start, pos):
+        # first frame after `pos` with `t - start > max_duration`, searched with the exact
+        # predicate of the loop (the float subtraction is monotonic in `t`)
+        i = max(int(np.searchsorted(timestamps, start + max_duration, side="right")), pos + 1)
+        while i > pos + 1 and timestamps[i - 1] - start > max_duration:
+            i -= 1
+        while i < num_frames and not timestamps[i] - start > max_duration:
+            i += 1
+        return i
+
+    regions = []
+    # the pending buffer of the loop is `[scores[head]] + scores[first:pos + 1]`,
+    # `head` being a leftover frame from before the current active region (if any)
+    pos = 0
+    if scores[0] > onset:
+        is_active, start, head, first = True, times[0], None, 0
+    else:
+        is_active, head = False, 0
+
+    while True:
+        if not is_active:
+            # switching from inactive to active
+            pos = next_index(above, pos)
+            if pos >= num_frames:
+                break
+            is_active, start, first = True, times[pos], pos + 1
+
+        cut = next_cut(start, pos)
+        off = next_index(below, pos)
+        if cut >= num_frames and off >= num_frames:
+            # active at the end, add final region
+            regions.append((start, times[-1]))
+            break
+
+        if cut <= off:
+            # divide segment at the lowest score of the second half of the pending buffer
+            body = scores[first:cut]
+            search_after = (len(body) + (head is not None)) // 2
+            if head is None:
+                min_score_frame = first + search_after + int(np.argmin(body[search_after:]))
+            elif search_after == 0:
+                min_score_frame = head
+            else:
+                min_score_frame = first + search_after - 1 + int(np.argmin(body[search_after - 1:]))
+            regions.append((start, times[min_score_frame]))
+            start = times[min_score_frame]
+            if min_score_frame != head:
+                first = min_score_frame + 1
+            head = None
+            pos = cut
+        else:
+            # switching from active to inactive
+            regions.append((start, times[off]))
+            is_active, head, pos = False, off, off
+
+    return regions
+
+
 class VoiceActivitySegmentation(VoiceActivityDetection):
     def __init__(
         self,
@@ -244,6 +422,138 @@ class VoiceActivitySegmentation(VoiceActivityDetection):
         return segmentations
 
 
+class VadScoreCache:
+    """On-disk cache of raw VAD scores, so that sweeps over the binarization parameters
+    (`vad_onset`, `vad_offset`, chunk sizes) do not run the segmentation model again.
+
+    Entries are keyed by the SHA-256 of the audio samples and the checksum of the VAD model.
+    Scores are stored as `.npy` files next to a small json file holding the sliding window,
+    and are loaded back memory-mapped. Once the cache grows over `max_bytes`, the least
+    recently used entries are evicted. The size of the cache directory is scanned once, then tracked
+    as entries are added, so that only puts going over `max_bytes` scan it again.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory holding the cached scores.
+    model_checksum : str, optional
+        Checksum of the VAD model the scores were computed with.
+    max_bytes : int, optional
+        Size bound of the cache. Defaults to 2 GiB.
+    """
+
+    def __init__(self, cache_dir: str, model_checksum: str = VAD_SEGMENTATION_SHA256, max_bytes: int = 2 << 30):
+        self.cache_dir = cache_dir
+        self.model_checksum = model_checksum
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # bytes of the cached scores, None until the directory was scanned
+        self._nbytes = None
+
+    def key(self, audio: np.ndarray) -> str:
+        digest = hashlib.sha256(self.model_checksum.encode())
+        digest.update(np.ascontiguousarray(audio).view(np.uint8))
+        return digest.hexdigest()
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        path = os.path.join(self.cache_dir, key)
+        return path + ".npy", path + ".json"
+
+    def get(self, audio: np.ndarray) -> Optional[SlidingWindowFeature]:
+        data_fp, meta_fp = self._paths(self.key(audio))
+        try:
+            with open(meta_fp) as f:
+                meta = json.load(f)
+            data = np.load(data_fp, mmap_mode="r")
+            # mark as recently used
+            os.utime(data_fp)
+        except FileNotFoundError:
+            # not cached, or evicted meanwhile by another process
+            return None
+        sliding_window = SlidingWindow(start=meta["start"], duration=meta["duration"], step=meta["step"])
+        return SlidingWindowFeature(data, sliding_window, labels=meta["labels"])
+
+    def put(self, audio: np.ndarray, scores: SlidingWindowFeature):
+        data_fp, meta_fp = self._paths(self.key(audio))
+        frames = scores.sliding_window
+        meta = {"start": frames.start, "duration": frames.duration, "step": frames.step, "labels": scores.labels}
+        # write to uniquely named temporary files first, so that concurrent readers never see partial entries
+        # and concurrent writers of the same entry (processes or threads) never share them
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            np.save(f, np.asarray(scores.data))
+        tmp_data_fp = f.name
+        with tempfile.NamedTemporaryFile("w", dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            json.dump(meta, f)
+        os.replace(f.name, meta_fp)
+        os.replace(tmp_data_fp, data_fp)
+        if self._nbytes is None:
+            self._nbytes = sum(size for _, size, _ in self._entries())
+        else:
+            self._nbytes += os.path.getsize(data_fp)
+        if self._nbytes > self.max_bytes:
+            self.evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """`(mtime, size, key)` of the cached scores."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".npy")]))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_bytes`."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        # least recently used first
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for fp in self._paths(key):
+                try:
+                    os.remove(fp)
+                except FileNotFoundError:
+                    pass
+            total -= size
+        self._nbytes = total
+
+
+def crop_scores(scores: SlidingWindowFeature, start: float, end: float) -> SlidingWindowFeature:
+    """Crop detection scores to the [start, end] region and shift them so that `start` becomes time 0.
+
+    The cropped scores can be fed straight back into `Binarize`/`merge_chunks` in place of
+    running the segmentation model again on `audio[start:end]`.
+
+    Parameters
+    ----------
+    scores : SlidingWindowFeature
+        Detection scores of the whole file.
+    start : float
+        Start of the region, in seconds.
+    end : float
+        End of the region, in seconds.
+
+    Returns
+    -------
+    cropped : SlidingWindowFeature
+        Detection scores of the region, with timestamps relative to `start`.
+    """
+    frames = scores.sliding_window
+    num_frames = scores.data.shape[0]
+    first = max(0, frames.closest_frame(start))
+    last = min(num_frames, frames.closest_frame(end) + 1)
+    sliding_window = SlidingWindow(
+        start=frames.start + first * frames.step - start,
+        duration=frames.duration,
+        step=frames.step,
+    )
+    return SlidingWindowFeature(scores.data[first:last], sliding_window, labels=scores.labels)
+
+
 def merge_vad(vad_arr, pad_onset=0.0, pad_offset=0.0, min_duration_off=0.0, min_duration_on=0.0):
 
     active = Annotation()
@@ -270,6 +580,7 @@ def merge_chunks(
     chunk_size: int = 5,
     onset: float = 0.5,
     offset: Optional[float] = None,
+    vectorized: bool = False,
 ):
     """
     Merge operation described in paper
@@ -281,7 +592,7 @@ def merge_chunks(
 
     assert chunk_size > 0  
     
-    binarize = Binarize(max_duration=chunk_size, onset=onset, offset=offset)
+    binarize = Binarize(max_duration=chunk_size, onset=onset, offset=offset, vectorized=vectorized)
     segments = binarize(segments)
     segments_list = []
     for speech_turn in segments.get_timeline():